@@ -1,89 +1,260 @@
 #!/usr/bin/env python3
 
+import sys
 import argparse
 from pathlib import Path
 
-parser = argparse.ArgumentParser()
-parser.add_argument("dir", type=Path)
+parser = argparse.ArgumentParser(
+    description=
+    """
+        Summarize the runtime, CPU time, memory usage, and I/O of each step of
+        the pipeline based on the benchmark files that snakemake writes. Provide
+        a second output directory to compare two runs (ex: of different commits)
+        side by side.
+    """
+)
+parser.add_argument(
+    "dir", type=Path, help="the output directory of a sample (ex: out/sample)"
+)
+parser.add_argument(
+    "-c", "--compare", type=Path, default=None, help="the output directory of a sample from a baseline run to compare against"
+)
+parser.add_argument(
+    "-j", "--cores", type=int, default=None, help="the number of cores the pipeline was run with; if provided, the parallel efficiency of each step is reported"
+)
+parser.add_argument(
+    "-o", "--json", type=argparse.FileType('w', encoding='UTF-8'), default=None, help="the path to a JSON file in which to store a machine-readable summary"
+)
+parser.add_argument(
+    "-t", "--threshold", type=float, default=None, help="if --compare is provided, exit with a nonzero code when the wall time or memory usage of any step grows by more than this percentage"
+)
+parser.add_argument(
+    "--metrics", action='store_true', help="summarize the per-stage metrics recorded by the scripts (see the metrics option in the config file) instead of the per-rule snakemake benchmarks"
+)
 args = parser.parse_args()
+if args.threshold is not None and args.compare is None:
+    parser.error('The --threshold option requires --compare.')
 args.dir = str(args.dir)+"/benchmark"
 
 
 
+import json
 import itertools
 import pandas as pd
 
-# --FIRST: IMPORT THE DATA--
-# initialize dictionaries
-default = {}
-experimental = {}
-
-# load common steps
-default['stitch'] = pd.read_csv(args.dir+"/stitch-lowQual.tsv", sep="\t", header=0)
-default['export_ortho'] = pd.read_csv(args.dir+"/export_ortho.tsv", sep="\t", header=0)
-for step in default:
-    experimental[step] = default[step]
-
-# default strategy
-default['segment'] = pd.read_csv(args.dir+"/segments/ortho.tsv", sep="\t", header=0)
-default['watershed'] = pd.read_csv(args.dir+"/watershed.tsv", sep="\t", header=0)
-default['extract_features'] = pd.read_csv(args.dir+"/extract_features/ortho.tsv", sep="\t", header=0)
-default['classify'] = pd.read_csv(args.dir+"/classify/ortho.tsv", sep="\t", header=0)
-default['map'] = pd.read_csv(args.dir+"/map.tsv", sep="\t", header=0)
-
-# experimental strategy
-experimental['segment'] = pd.DataFrame({'sum':pd.concat((
-    pd.read_csv(f, sep="\t", header=0)
-    for f in Path(args.dir+"/segments").iterdir()
-    if f.stem != 'ortho'
-)).max()}).T
-experimental['transform'] = pd.DataFrame({'sum':pd.concat((
-    pd.read_csv(f, sep="\t", header=0)
-    for f in Path(args.dir+"/transform").iterdir()
-)).max()}).T
-experimental['watershed'] = pd.read_csv(args.dir+"/watershed-exp.tsv", sep="\t", header=0)
-experimental['rev_transform'] = pd.read_csv(args.dir+"/rev_transform.tsv", sep="\t", header=0)
-experimental['extract_features'] = pd.DataFrame({'sum':pd.concat((
-    pd.read_csv(f, sep="\t", header=0)
-    for f in Path(args.dir+"/extract_features-exp").iterdir()
-)).max()}).T
-experimental['classify'] = pd.DataFrame({'sum':pd.concat((
-    pd.read_csv(f, sep="\t", header=0)
-    for f in Path(args.dir+"/classify-exp").iterdir()
-)).max()}).T
-experimental['resolve_conflicts'] = pd.read_csv(args.dir+"/resolved_conflicts.tsv", sep="\t", header=0)
-experimental['map'] = pd.read_csv(args.dir+"/map-exp.tsv", sep="\t", header=0)
-
-# concatenate the dicts into big pd dfs
-default = pd.concat(default, ignore_index=False)
-experimental = pd.concat(experimental, ignore_index=False)
-
-# --SECOND: CALCULATE OUR METRICS--
-# extract only the metrics we care about:
-# running time (in secs) and max memory usage (in MB)
-metrics = {}
-metrics['default'] = default[['s','max_rss']]
-metrics['experimental'] = experimental[['s','max_rss']]
-
-steps = {
+if args.metrics:
+    import instrument
+    stages, counters = instrument.summarize(instrument.load(args.dir+"/metrics"))
+    print('units (secs, MB)\n')
+    with pd.option_context('display.max_rows', None, 'display.width', None):
+        print(stages.round(3))
+        if len(counters.columns):
+            print()
+            print(counters)
+    sys.exit()
+
+
+# the benchmark files of each step, relative to the benchmark dir
+# each step is a list of glob patterns, and only the first pattern that
+# matches any files is used
+# patterns ending in '/*' refer to directories with a benchmark file for each image
+COMMON = {
+    'export_ortho': ['export_ortho.tsv']
+}
+STEPS = {
+    'default': {
+        'stitch': ['stitch.tsv', 'stitch-lowQual.tsv'],
+        **COMMON,
+        'segment': ['segments/ortho.tsv'],
+        'watershed': ['watershed.tsv'],
+        'extract_features': ['extract_features/ortho.tsv'],
+        'classify': ['classify/ortho.tsv'],
+        'map': ['map.tsv']
+    },
+    'experimental': {
+        'stitch': ['stitch-lowQual.tsv', 'stitch.tsv'],
+        **COMMON,
+        'segment': ['segments/*'],
+        'transform': ['transform/*'],
+        'watershed': ['watershed-exp.tsv'],
+        'rev_transform': ['rev_transform.tsv'],
+        'extract_features': ['extract_features-exp/*'],
+        # all of the images may have been classified in a single, batched job
+        'classify': ['classify-exp.tsv', 'classify-exp/*'],
+        'resolve_conflicts': ['resolved_conflicts.tsv'],
+        'map': ['map-exp.tsv']
+    }
+}
+# how the steps are grouped in the summary of each strategy
+# the experimental strategy includes the steps in the second item of each tuple
+GROUPS = {
     'stitching': (('stitch', 'export_ortho'),),
     'segmentation': (('segment', 'watershed'), ('transform', 'rev_transform')),
     'classification': (('extract_features', 'classify'), ('resolve_conflicts',))
 }
+# the metrics we compare between runs (smaller is better for all of them)
+COMPARED = ['wall', 'cpu', 'max_rss', 'io_in', 'io_out']
+
+
+def benchmark_files(bench_dir, patterns):
+    """ find the benchmark files of a step, using the first pattern that matches any files """
+    for pattern in patterns:
+        if pattern.endswith('/*'):
+            files = sorted(
+                f for f in Path(bench_dir).glob(pattern)
+                # the default strategy stores its benchmark files in some of the same dirs
+                if f.is_file() and f.name != 'ortho.tsv'
+            )
+        else:
+            files = sorted(Path(bench_dir).glob(pattern))
+        if files:
+            return files, pattern.endswith('/*')
+    return [], False
+
+def cpu_seconds(bench):
+    """ get the CPU time of each job, estimating it from the mean load if snakemake didn't record it """
+    if 'cpu_time' in bench.columns:
+        return bench['cpu_time']
+    return bench['s']*bench['mean_load']/100
+
+def read_step(files, per_image):
+    """
+        summarize the benchmark files of a step
+        per-image steps have a job for each image, which we assume were run in parallel
+    """
+    bench = pd.concat(pd.read_csv(f, sep="\t", header=0) for f in files)
+    cpu = cpu_seconds(bench)
+    step = {
+        'jobs': len(bench),
+        # the wall time of a per-image step is that of its slowest job
+        'wall': bench['s'].max() if per_image else bench['s'].sum(),
+        # the time spent by all of the jobs, combined
+        'job_seconds': bench['s'].sum(),
+        'cpu': cpu.sum(),
+        'max_rss': bench['max_rss'].max(),
+        'io_in': bench['io_in'].sum() if 'io_in' in bench.columns else None,
+        'io_out': bench['io_out'].sum() if 'io_out' in bench.columns else None
+    }
+    # how many cores the step kept busy, on average
+    step['parallelism'] = step['cpu']/step['wall'] if step['wall'] else None
+    if args.cores is not None and step['parallelism'] is not None:
+        step['efficiency'] = step['parallelism']/args.cores
+    if per_image:
+        step['images_per_hour'] = step['jobs']/step['wall']*60*60 if step['wall'] else None
+        step['seconds_per_image'] = step['job_seconds']/step['jobs']
+    return step
+
+def read_run(bench_dir):
+    """ summarize every step of each strategy that has benchmark files in bench_dir """
+    run = {}
+    for strategy, steps in STEPS.items():
+        run[strategy] = {}
+        for step, patterns in steps.items():
+            files, per_image = benchmark_files(bench_dir, patterns)
+            if files:
+                run[strategy][step] = read_step(files, per_image)
+    return run
+
+def summarize(steps, i):
+    """ total the steps of a strategy within each group (see GROUPS) """
+    groups = {}
+    for group in GROUPS:
+        names = [
+            name for name in itertools.chain.from_iterable(GROUPS[group][:i+1])
+            if name in steps
+        ]
+        groups[group] = {
+            'wall': sum(steps[name]['wall'] for name in names),
+            'cpu': sum(steps[name]['cpu'] for name in names),
+            'max_rss': max((steps[name]['max_rss'] for name in names), default=0)
+        }
+    groups['total'] = {
+        'wall': sum(step['wall'] for step in steps.values()),
+        'cpu': sum(step['cpu'] for step in steps.values()),
+        'max_rss': max((step['max_rss'] for step in steps.values()), default=0)
+    }
+    return groups
+
+def delta(new, old):
+    """ the percent change from old to new """
+    if new is None or old is None or pd.isna(new) or pd.isna(old) or not old:
+        return None
+    return (new-old)/old*100
+
+def compare(run, baseline):
+    """ compare each step of a run with the same step of the baseline """
+    deltas = {}
+    for strategy in run:
+        deltas[strategy] = {}
+        for step in run[strategy]:
+            if step not in baseline.get(strategy, {}):
+                continue
+            deltas[strategy][step] = {
+                metric: delta(run[strategy][step][metric], baseline[strategy][step][metric])
+                for metric in COMPARED
+            }
+    return deltas
+
+def regressions(deltas, threshold):
+    """ find the steps whose wall time or memory usage grew by more than threshold percent """
+    return [
+        (strategy, step, metric, deltas[strategy][step][metric])
+        for strategy in deltas for step in deltas[strategy]
+        for metric in ('wall', 'max_rss')
+        if deltas[strategy][step][metric] is not None and deltas[strategy][step][metric] > threshold
+    ]
+
+
+# --FIRST: IMPORT THE DATA--
+run = read_run(args.dir)
+baseline = read_run(str(args.compare)+"/benchmark") if args.compare is not None else None
+
+# --SECOND: REPORT OUR METRICS--
+summary = {'dir': str(Path(args.dir).parent), 'strategies': {}}
 print('units (hrs, GB)\n')
-strategies = sorted(metrics.keys())
-for i in range(len(strategies)):
-    strategy = strategies[i]
+for i, strategy in enumerate(STEPS):
+    if not run[strategy]:
+        continue
+    groups = summarize(run[strategy], i)
+    summary['strategies'][strategy] = {'steps': run[strategy], 'groups': groups}
     print(strategy, 'strategy')
-    strat = metrics[strategy].copy()
-    print('total', (
-        round(strat.sum()['s']/60/60/24, ndigits=5),
-        strat.max()['max_rss']/1000)
-    )
-    for step in sorted(steps.keys(), reverse=True):
-        step_names = list(itertools.chain.from_iterable(steps[step][:i+1]))
-        time = strat.loc[step_names].sum()['s']/60/60/24
-        mem = strat.loc[step_names].max()['max_rss']/1000
-        print(step, (round(time, ndigits=5), mem))
+    for group in ['total']+sorted(GROUPS, reverse=True):
+        print(group, (round(float(groups[group]['wall'])/60/60, ndigits=5), float(groups[group]['max_rss'])/1000))
     print()
+    # also print a table of the metrics for each step
+    # (units: secs for times, MB for memory and I/O)
+    steps = pd.DataFrame(run[strategy]).T
+    with pd.option_context('display.max_rows', None, 'display.width', None):
+        print(steps.astype(float).round(3))
+    print()
+
+exit_code = 0
+if baseline is not None:
+    deltas = compare(run, baseline)
+    summary['baseline'] = {'dir': str(args.compare), 'strategies': baseline}
+    summary['deltas'] = deltas
+    for strategy in deltas:
+        if not deltas[strategy]:
+            continue
+        print(strategy, 'strategy: % change from', args.compare)
+        with pd.option_context('display.max_rows', None, 'display.width', None):
+            print(pd.DataFrame(deltas[strategy]).T.astype(float).round(1))
+        print()
+    if args.threshold is not None:
+        summary['regressions'] = [
+            {'strategy': strategy, 'step': step, 'metric': metric, 'delta': change}
+            for strategy, step, metric, change in regressions(deltas, args.threshold)
+        ]
+        for regression in summary['regressions']:
+            print(
+                'regression:', regression['strategy'], regression['step'],
+                regression['metric'], '+'+str(round(regression['delta'], 1))+'%',
+                file=sys.stderr
+            )
+        exit_code = int(bool(summary['regressions']))
 
+if args.json is not None:
+    # convert numpy types, so that they are JSON serializable
+    json.dump(summary, args.json, indent=4, default=float)
+    args.json.write("\n")
+sys.exit(exit_code)
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+import os
+import numpy as np
+
+
+# the most resampled indices to hold in memory at once
+# the replicates are drawn in batches of about this many indices
+BATCH_SIZE = 10000000
+# the names of the metrics computed for each replicate, in the same order as metrics.py
+# there is no bootstrap estimate of the support, so its column is always nan
+METRICS = [
+    'precision', 'recall', 'f1', 'support',
+    'predicted_negatives', 'predicted_positives', 'auroc', 'average_precision'
+]
+
+
+def groups(probs):
+    """
+        number the distinct probabilities in decreasing order, so that the
+        examples in group 0 have the highest probability
+    """
+    unique, inverse = np.unique(-np.asarray(probs, dtype=np.float64), return_inverse=True)
+    return len(unique), inverse.ravel()
+
+def resample(rng, replicates, size):
+    """ draw the indices of the examples in each replicate, with one row for each replicate """
+    return rng.integers(0, size, size=(replicates, size))
+
+def batch_counts(keys, idx, num_keys):
+    """
+        count the resampled examples with each key in every replicate at once,
+        by offsetting the keys of each row of the index matrix by a multiple of num_keys
+        return an array with one row for each replicate and a column for each key
+    """
+    offsets = np.arange(idx.shape[0], dtype=np.int64)[:, np.newaxis]*num_keys
+    return np.bincount(
+        (keys[idx]+offsets).ravel(), minlength=idx.shape[0]*num_keys
+    ).reshape(idx.shape[0], num_keys)
+
+def confusion_scores(counts):
+    """
+        compute the precision, recall, F1 score, and the number of predicted
+        negatives and positives of each replicate from its tn, fp, fn, and tp counts
+        like scikit-learn, the precision, recall, and F1 score are 0 when they're undefined
+    """
+    tn, fp, fn, tp = counts.T
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.where(tp+fp > 0, tp/(tp+fp), 0)
+        recall = np.where(tp+fn > 0, tp/(tp+fn), 0)
+        f1 = np.where(precision+recall > 0, 2*precision*recall/(precision+recall), 0)
+    return np.stack((precision, recall, f1, np.full(len(tp), np.nan), tn+fn, tp+fp), axis=1)
+
+def rank_scores(counts):
+    """
+        compute the AUROC and the average precision of each replicate from the
+        number of negatives and positives in each group of tied probabilities
+        (see groups()), given as an array with shape (replicates, groups, 2)
+        the metrics are nan for replicates without both positives and negatives
+    """
+    neg, pos = counts[..., 0], counts[..., 1]
+    # the number of false and true positives at or above each threshold
+    fps, tps = np.cumsum(neg, axis=1), np.cumsum(pos, axis=1)
+    negatives, positives = fps[:, -1], tps[:, -1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # each positive outranks the negatives in the groups below it and ties with half of those in its own group
+        auroc = np.sum(pos*(negatives[:, np.newaxis]-fps+neg/2), axis=1)/(positives*negatives)
+        # the precision at each threshold, weighted by the recall gained there (like average_precision_score)
+        precision = np.where(pos > 0, tps/(tps+fps), 0)
+        average_precision = np.sum(pos*precision, axis=1)/positives
+    auroc[(positives == 0) | (negatives == 0)] = np.nan
+    average_precision[positives == 0] = np.nan
+    return np.stack((auroc, average_precision), axis=1)
+
+
+BOOTSTRAP_DATA = {}
+
+def init_bootstrap(cells, ranks, num_groups):
+    BOOTSTRAP_DATA['cells'], BOOTSTRAP_DATA['ranks'], BOOTSTRAP_DATA['num_groups'] = cells, ranks, num_groups
+
+def replicate(batch):
+    """
+        compute the metrics of a batch of bootstrap replicates
+        batch is the number of replicates and the np.random.SeedSequence to draw them with
+    """
+    replicates, seed = batch
+    cells, ranks = BOOTSTRAP_DATA['cells'], BOOTSTRAP_DATA['ranks']
+    idx = resample(np.random.default_rng(seed), replicates, len(cells))
+    scores = confusion_scores(batch_counts(cells, idx, 4))
+    if ranks is None:
+        return scores
+    num_groups = BOOTSTRAP_DATA['num_groups']
+    counts = batch_counts(ranks, idx, 2*num_groups).reshape(replicates, num_groups, 2)
+    return np.concatenate((scores, rank_scores(counts)), axis=1)
+
+def bootstrap(truth, predict, probs=None, replicates=1000, seed=None, jobs=1):
+    """
+        compute the metrics of many bootstrap replicates of a set of predictions
+        each replicate is drawn with replacement from the examples, but only the
+        counts of each kind of example are computed for each one, so that the
+        metrics of a whole batch of replicates are computed with a few array operations
+        return an array with a row for each replicate and a column for each of the METRICS
+        (excluding the AUROC and average precision if probs isn't provided)
+    """
+    truth, predict = np.asarray(truth, dtype=bool), np.asarray(predict, dtype=bool)
+    # the cell of the confusion matrix (tn, fp, fn, tp) that each example is in
+    cells = 2*truth.astype(np.int64)+predict
+    ranks, num_groups = None, 0
+    if probs is not None:
+        num_groups, ranks = groups(probs)
+        # the group of tied probabilities and the class of each example, as a single key
+        ranks = 2*ranks+truth
+    # split the replicates into batches whose indices fit in memory
+    # the batches (and their seeds) don't depend on the number of jobs, so the results don't either
+    size = max(1, BATCH_SIZE//max(len(truth), 1))
+    sizes = [min(size, replicates-start) for start in range(0, replicates, size)]
+    batches = list(zip(sizes, np.random.SeedSequence(seed).spawn(len(sizes))))
+    if jobs == 1 or len(batches) == 1:
+        init_bootstrap(cells, ranks, num_groups)
+        results = [replicate(batch) for batch in batches]
+    else:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        # fork the processes, so that they inherit the examples instead of copying them
+        with ProcessPoolExecutor(
+            min(jobs if jobs > 0 else os.cpu_count(), len(batches)), multiprocessing.get_context('fork'),
+            initializer=init_bootstrap, initargs=(cells, ranks, num_groups)
+        ) as pool:
+            results = list(pool.map(replicate, batches))
+    return np.concatenate(results)
+
+def intervals(replicates, confidence=0.95):
+    """
+        get the percentile confidence interval of each column of the replicates
+        return the lower and upper bounds as object arrays, with None for the
+        columns that were never defined (ex: the support)
+    """
+    low, high = np.full(replicates.shape[1], None, dtype=object), np.full(replicates.shape[1], None, dtype=object)
+    for col in range(replicates.shape[1]):
+        values = replicates[:, col]
+        values = values[~np.isnan(values)]
+        if len(values):
+            low[col], high[col] = np.percentile(values, [50*(1-confidence), 50*(1+confidence)])
+    return low, high
@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+import os
+import time
+import itertools
+from pathlib import Path
+
+import tables
+import numpy as np
+import pandas as pd
+
+
+CLASS_LABEL = 'species_label'
+# the hyperparameters of the random forest
+# these mirror the defaults that ranger uses in classify_train.R
+PARAMS = {
+    'n_estimators': 500,
+    'max_features': 'sqrt',
+    'min_samples_split': 2
+}
+# the hyperparameters to try when tuning the random forest
+# this is the same grid that classify_train.R searches over (for mtry and min.node.size)
+GRID = {
+    'max_features': list(range(1, 11)),
+    'min_samples_split': list(range(7, 26))
+}
+# the names that classify_train.R uses for the hyperparameters in the grid
+GRID_NAMES = {'max_features': 'mtry', 'min_samples_split': 'min.node.size'}
+# when tuning, we use cross validation to optimize the F-beta score with this beta
+BETA = 0.5
+FOLDS = 5
+# successive halving keeps the best 1/ETA of the configs in each round and
+# gives them ETA times as many trees, but never fewer than MIN_TREES
+ETA = 3
+MIN_TREES = 10
+# roughly how many bytes of memory each node of a tree takes up
+NODE_BYTES = 100
+
+
+def load_table(fname):
+    """
+        load a table of features, indexed by the segment labels
+        like classify_train.R and classify_test.R, we use the first column as
+        the index if it is named 'label' and otherwise number the rows from 1
+    """
+    df = tables.read(fname)
+    if 'label' in df.columns:
+        df = df.set_index('label')
+    elif isinstance(df.index, pd.RangeIndex):
+        df.index = pd.RangeIndex(1, len(df)+1)
+    return df
+
+def split_features(df, features=None):
+    """
+        split a table into the features and the true labels (if there are any)
+        provide features to select (and reorder) only the columns used by a trained model
+    """
+    truth = df[CLASS_LABEL] if CLASS_LABEL in df.columns else None
+    if features is None:
+        features = [col for col in df.columns if col != CLASS_LABEL]
+    return df[list(features)].fillna(0), truth
+
+def train(df, n_jobs=1, **params):
+    """ train a random forest classifier on a table of features with true labels """
+    from sklearn.ensemble import RandomForestClassifier
+    X, y = split_features(df)
+    fit = RandomForestClassifier(**{**PARAMS, **params}, n_jobs=n_jobs)
+    fit.fit(X.values, y.values)
+    # store the feature names with the model so that we can check them later
+    return {'fit': fit, 'features': list(X.columns)}
+
+def available_memory():
+    """ get the number of bytes of memory that are currently available """
+    try:
+        with open('/proc/meminfo') as meminfo:
+            for line in meminfo:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1])*1024
+    except OSError:
+        pass
+    return os.sysconf('SC_AVPHYS_PAGES')*os.sysconf('SC_PAGE_SIZE')
+
+def available_cores():
+    """ get the number of cores that this process is allowed to use """
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def worker_memory(X, n_estimators, min_samples_split):
+    """
+        estimate the number of bytes of memory that a single tuning worker will need
+        each worker keeps its own copy of the training data (plus the float32 copy
+        that sklearn makes) and the forest that it is currently training
+        a tree has at most 2*n/min_samples_split nodes, where n is the number of rows
+    """
+    rows, cols = X.shape
+    data = rows*cols*(X.itemsize+4)
+    forest = n_estimators*(2*rows/min_samples_split+1)*NODE_BYTES
+    return int(data+forest)
+
+def worker_count(X, n_estimators, jobs=-1, memory=None):
+    """
+        choose how many workers to use for tuning, based on the available cores and memory
+        jobs is the most workers to use (or -1 for as many as there are cores)
+        memory is the most bytes of memory to use (or None for as much as is available)
+    """
+    cores = available_cores() if jobs < 1 else jobs
+    if memory is None:
+        # leave some memory for the main process and everything else on the machine
+        memory = 0.8*available_memory()
+    per_worker = worker_memory(X, n_estimators, min(GRID['min_samples_split']))
+    return max(1, min(cores, int(memory//per_worker)))
+
+# the training data for each tuning worker (see init_worker())
+TUNE_DATA = {}
+
+def init_worker(X, y):
+    """ store the training data in each worker once, instead of once for every config """
+    TUNE_DATA['X'], TUNE_DATA['y'] = X, y
+
+def cross_validate(params):
+    """
+        estimate the F-beta score of a random forest with the provided hyperparameters
+        using cross validation on the training data in TUNE_DATA
+        return the hyperparameters, the mean score, and how long it took (in seconds)
+    """
+    from sklearn.metrics import fbeta_score
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.model_selection import StratifiedKFold
+    X, y = TUNE_DATA['X'], TUNE_DATA['y']
+    start = time.perf_counter()
+    scores = []
+    for train_idx, test_idx in StratifiedKFold(FOLDS, shuffle=True, random_state=0).split(X, y):
+        fit = RandomForestClassifier(**{**PARAMS, **params}, n_jobs=1)
+        fit.fit(X[train_idx], y[train_idx])
+        scores.append(fbeta_score(y[test_idx], fit.predict(X[test_idx]), beta=BETA))
+    return params, np.mean(scores), time.perf_counter()-start
+
+def tune(df, search='halving', jobs=-1, memory=None):
+    """
+        choose the best hyperparameters (from GRID) for a random forest trained on df
+        search can be either
+            1) 'grid' - evaluate every config with the full number of trees
+            2) 'halving' - evaluate every config with only a few trees and
+               successively give more trees to only the best configs
+        return the best hyperparameters and a table with the results for every config we tried
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    X, y = split_features(df)
+    X, y = X.values, y.values
+    # there can't be more features per split than there are features
+    grid = dict(GRID, max_features=sorted({min(i, X.shape[1]) for i in GRID['max_features']}))
+    configs = [dict(zip(grid.keys(), values)) for values in itertools.product(*grid.values())]
+    # figure out how many trees to use in each round
+    if search == 'grid':
+        budgets = [PARAMS['n_estimators']]
+    else:
+        rounds = int(np.ceil(np.log(len(configs))/np.log(ETA)))
+        budgets = [
+            max(MIN_TREES, PARAMS['n_estimators']//(ETA**(rounds-i)))
+            for i in range(rounds+1)
+        ]
+    workers = worker_count(X, PARAMS['n_estimators'], jobs, memory)
+    print(
+        "tuning", len(configs), "configs with", workers, "workers (estimated",
+        round(worker_memory(X, PARAMS['n_estimators'], min(grid['min_samples_split']))/1e9, 3),
+        "GB each)"
+    )
+    results = []
+    with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(X, y)) as pool:
+        for iteration, n_estimators in enumerate(budgets):
+            start = time.perf_counter()
+            scores = []
+            for params, score, secs in pool.map(
+                cross_validate, [dict(config, n_estimators=n_estimators) for config in configs]
+            ):
+                print(
+                    ", ".join(GRID_NAMES[param]+"="+str(params[param]) for param in grid),
+                    "trees="+str(n_estimators)+":", "fbeta="+str(round(score, 4)),
+                    "("+str(round(secs, 2))+"s)"
+                )
+                results.append({
+                    **{GRID_NAMES[param]: params[param] for param in grid},
+                    'num.trees': n_estimators,
+                    'fbeta.test.mean': score,
+                    'iteration': iteration+1,
+                    'exec.time': secs
+                })
+                scores.append(score)
+            print(
+                "round", iteration+1, "evaluated", len(configs), "configs with", n_estimators,
+                "trees in", round(time.perf_counter()-start, 2), "s"
+            )
+            # keep only the best configs for the next round (the sort is stable, so ties go to the first config)
+            configs = [configs[i] for i in np.argsort(-np.array(scores), kind='stable')]
+            configs = configs[:int(np.ceil(len(configs)/ETA))]
+            if len(configs) == 1:
+                break
+    return configs[0], pd.DataFrame(results)
+
+def importance(model):
+    """ get the importance of each feature, as deemed by the random forest """
+    return pd.DataFrame(
+        {'importance': model['fit'].feature_importances_},
+        index=pd.Index(model['features'], name='variable')
+    ).sort_values('importance', ascending=False)
+
+def save_model(model, fname):
+    """ write a trained model to a file """
+    import joblib
+    joblib.dump(model, fname)
+
+def load_model(fname):
+    """
+        load a trained model from a file (created by save_model())
+        the models are cached in the models module rather than this one, since
+        the worker (see worker.py) runs this script in a fresh namespace for
+        each job, so that a model it has already loaded is reused
+    """
+    import models
+    return models.load_model(fname)
+
+def predict(model, df):
+    """
+        predict the class of each segment in a table of features
+        return a table with the columns that classify_test.R outputs:
+        truth (only if the table has true labels), prob.0, prob.1, and response
+    """
+    X, truth = split_features(df, model['features'])
+    fit = model['fit']
+    columns = ['prob.'+str(cls) for cls in fit.classes_]
+    if len(X):
+        probs = fit.predict_proba(X.values)
+    else:
+        print("warning: there are no segments in this table")
+        probs = np.empty((0, len(fit.classes_)))
+    pred = pd.DataFrame(probs, columns=columns, index=X.index)
+    pred['response'] = fit.classes_[probs.argmax(axis=1)].astype(int)
+    if truth is not None:
+        pred.insert(0, 'truth', truth if truth.isna().any() else truth.astype(int))
+    return pred
+
+def write_predictions(pred, out):
+    """ write the predictions to a table, in the same format as classify_test.R """
+    if tables.table_format(out) == 'tsv':
+        # like R, leave the index column out of the header
+        pred.to_csv(out, sep="\t", na_rep='.', index_label=False)
+    else:
+        tables.write(pred, out)
+
+def predict_batch(model, dfs):
+    """
+        predict the class of each segment in many tables (ex: one for each camera) at once
+        dfs is a dictionary of tables keyed by name, and the predictions are returned the same way
+        the tables are concatenated so that every tree in the forest is traversed
+        only once (and in parallel) for all of them
+    """
+    if not len(dfs):
+        return {}
+    names = list(dfs.keys())
+    pred = predict(model, pd.concat([dfs[name] for name in names], keys=names, names=[tables.CAMERA]))
+    # split the predictions back up, using the number of rows in each table
+    ends = np.cumsum([len(dfs[name]) for name in names])
+    return {
+        name: pred.iloc[end-len(dfs[name]):end].droplevel(0).drop(
+            columns=([] if CLASS_LABEL in dfs[name].columns else ['truth']),
+            errors='ignore'
+        )
+        for name, end in zip(names, ends)
+    }
+
+def predict_files(model, features, out):
+    """
+        predict the class of each segment in the features table(s) and write them to out
+        features and out can both be either a single table or a directory of tables
+        (for each camera); the model is loaded only once for all of them
+    """
+    features, out = Path(features), Path(out)
+    if features.is_dir():
+        out.mkdir(exist_ok=True)
+        print('loading features')
+        files = {
+            f.stem: f
+            for f in sorted(features.iterdir())
+            if f.is_file() and tables.is_table(f)
+        }
+        dfs = {cam: load_table(files[cam]) for cam in files}
+        print('predicting the segments in '+str(len(dfs))+' tables')
+        preds = predict_batch(model, dfs)
+        print('writing predictions')
+        for cam in preds:
+            if not len(preds[cam]):
+                print("warning: "+str(files[cam])+" has no segments")
+            write_predictions(preds[cam], str(out/files[cam].name))
+    else:
+        write_predictions(predict(model, load_table(features)), str(out))
+
+if __name__ == '__main__':
+    # if this script is being called but not imported:
+    import argparse
+    parser = argparse.ArgumentParser(description='Train a random forest classifier or use it to predict the species of each segment. This script can replace classify_train.R and classify_test.R.')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    train_parser = subparsers.add_parser('train', help='train the classifier')
+    train_parser.add_argument(
+        "training", help="a table containing the data on which to train the classifier; there must be a species_label column with binarized, true labels"
+    )
+    train_parser.add_argument(
+        "model", help="the path to a file in which to store the trained classifier"
+    )
+    train_parser.add_argument(
+        "importance", help="the path to a TSV in which to store how important the random forest deems each feature"
+    )
+    test_parser = subparsers.add_parser('test', help='predict the species of each segment using a trained classifier')
+    test_parser.add_argument(
+        "features", help="a table containing the features of each segment (or a directory of such tables for each camera, which are all predicted at once); columns must be named the same as in the training data"
+    )
+    test_parser.add_argument(
+        "model", help="a trained classifier, created by the train subcommand"
+    )
+    test_parser.add_argument(
+        "out", help="the path to a table (or directory of tables, if features is a directory) in which to write the predictions"
+    )
+    train_parser.add_argument(
+        "tune", nargs='?', default=None, help="the path to a TSV in which to store the results of cross validation on the classifier's hyperparameters; if not specified, the hyperparameters will not be tuned"
+    )
+    train_parser.add_argument(
+        "-s", "--search", choices=['halving', 'grid'], default='halving', help="how to search for the best hyperparameters: successive halving, which gives more trees only to the most promising configs, or an exhaustive grid search (default: halving)"
+    )
+    train_parser.add_argument(
+        "-m", "--memory", type=float, default=None, help="the most memory (in GB) to use when tuning; defaults to most of the memory that is currently available"
+    )
+    for subparser in (train_parser, test_parser):
+        subparser.add_argument(
+            "-j", "--jobs", type=int, default=1, help="the number of cores to use (default: 1); -1 means all of them"
+        )
+    args = parser.parse_args()
+
+    import instrument
+    if args.command == 'train':
+        print("loading training data")
+        with instrument.timer('load'):
+            training = load_table(args.training)
+        instrument.count('segments', len(training))
+        params = {}
+        if args.tune is not None:
+            print("tuning hyperparameters")
+            with instrument.timer('tune'):
+                params, results = tune(
+                    training, args.search, args.jobs,
+                    None if args.memory is None else args.memory*1e9
+                )
+            results.to_csv(args.tune, sep="\t", index=False)
+            print("tuned params are", {GRID_NAMES[param]: params[param] for param in params})
+        print("training model")
+        with instrument.timer('train'):
+            model = train(training, n_jobs=args.jobs, **params)
+        print("recording variable importance")
+        with instrument.timer('write'):
+            importance(model).to_csv(args.importance, sep="\t")
+            save_model(model, args.model)
+    else:
+        print("loading model")
+        with instrument.timer('load_model'):
+            model = load_model(args.model)
+        model['fit'].n_jobs = args.jobs
+        with instrument.timer('predict'):
+            predict_files(model, args.features, args.out)
@@ -6,7 +6,7 @@ parser = argparse.ArgumentParser(
     description="Create data that can be used to train a random forest classifier implemented by ranger."
 )
 parser.add_argument(
-    "features", type=Path, help="the path to a file containing tsv files (for each image in the orthomosaic) with the features of each segmented region (or the path to a directory if there are many such files)"
+    "features", type=Path, help="the path to a table (tsv, parquet, or feather) with the features of each segmented region (or the path to a directory of such tables for each image in the orthomosaic, or a single multi-camera parquet/feather table with a camera column)"
 )
 parser.add_argument(
     "truth", help="the path to a tsv file containing true class labels for each segmented region; the tsv must have no header and two columns: 1) the segment ID and 2) the class label"
@@ -18,26 +18,50 @@ parser.add_argument(
     "-d", "--segment-dict", help="the path to a json file containing a dictionary mapping the labels of the original segmented regions to their corresponding merged labels in the orthomosaic; this is output from watershed.py"
 )
 parser.add_argument(
-    "-p", "--test-proportion", default=0.5, help="what proportion of the data should be used for testing? this is only relevant if the truth data is being split between training and testing (see the 'out' argument)"
+    "-p", "--test-proportion", type=float, default=0.5, help="what proportion of the data should be used for testing? this is only relevant if the truth data is being split between training and testing (see the 'out' argument)"
+)
+parser.add_argument(
+    "--split", choices=['random', 'group', 'spatial'], default='random', help=
+    """
+        how to split the truth data between training and testing: 'random'
+        splits the rows at random (stratified by class), 'group' keeps all of
+        the rows for an orthomosaic segment (ex: from different cameras)
+        together, and 'spatial' keeps all of the segments within each square
+        block of the orthomosaic together, so that neighboring plants don't
+        end up in both sets (default: random)
+    """
+)
+parser.add_argument(
+    "--segments", default=None, help="the path to the orthomosaic segments from watershed.py (a .json or .npy file), which are used to locate each segment for --split spatial; for --split group, it is only used to tell whether the segments have changed since the --folds-cache was made"
+)
+parser.add_argument(
+    "-b", "--block-size", type=int, default=1000, help="the width (in orthomosaic pixels) of the blocks for --split spatial (default: 1000)"
+)
+parser.add_argument(
+    "--folds-cache", type=Path, default=None, help="a tsv file in which to store whether each orthomosaic segment was assigned to the training or testing set by --split group or spatial; if it already exists, contains every segment, and was made from the same segments files (see --segments and --segment-dict), split, test proportion, and block size, its assignments are reused instead of recomputed, so that repeated runs use the same split"
 )
 args = parser.parse_args()
 if len(args.out) > 2:
     parser.error("You can provide at most two outputs.")
+if args.split == 'spatial' and args.segments is None:
+    parser.error("The --segments option is required for --split spatial.")
 # but if there are two outputs, make sure the first one is a file
 if len(args.out)-1:
     assert (not Path(args.out[0]).is_dir()), "If you provide two outputs, the first must be a file (for training). The second (for testing) can be either a file or a directory if you want the output split by camera."
 
+import os
 import json
+import tables
+import instrument
 import numpy as np
 import pandas as pd
-from sklearn.model_selection import train_test_split
 
 
 CLASS_LABEL = 'species_label'
 
 def get_features(fname):
     """ get a features table """
-    return pd.read_csv(fname, sep="\t", index_col='label')
+    return tables.read(fname, index_col='label')
 
 def get_truth(add_ortho=True):
     """ get the true labels """
@@ -47,81 +71,187 @@ def get_truth(add_ortho=True):
         names=[index_col, CLASS_LABEL], index_col=index_col
     )
 
-# get the features files
-# check: are we running the experimental strategy or the default one?
-if args.features.is_dir():
-
-    # get the features
-    features = {
-        f.stem: str(f)
-        for f in args.features.iterdir()
-        if f.suffix == '.tsv'
-    }
-    features = pd.concat(
-        {
-            cam: get_features(features[cam])
-            for cam in features
-        }
-    )
+def read_segment_dict(fname):
+    """
+        read the segment_dict from watershed.py and flatten it into a series
+        of orthomosaic segment ids, indexed by camera and drone image segment label
+    """
+    with open(fname) as json_file:
+        # a data structure for mapping drone image segments to orthomosaic segments
+        # dictionary:
+        #   key: a camera name
+        #   value:
+        #       another dictionary:
+        #           key: the drone image segment label
+        #           value: the orthomosaic segment id
+        segment_dict = json.load(json_file)
+    return pd.DataFrame(
+        [
+            (cam, int(label), int(ortho_label))
+            for cam, labels in segment_dict.items() for label, ortho_label in labels.items()
+        ], columns=[tables.CAMERA, 'label', 'ortho_label']
+    ).set_index([tables.CAMERA, 'label'])['ortho_label']
 
-    # now, get the true labels and add them as a column to the features df
-    truth = get_truth()
-
-    # get the segment_dict
-    # but first, check that the segment_dict is provided
-    if args.segment_dict is None:
-        features[CLASS_LABEL] = features.apply(
-            lambda row: truth.loc[row.name[1]],
-            axis=1
+def true_labels(truth, ortho_labels):
+    """ look up the true class label of each of the ortho_labels (an array) """
+    found = np.isin(ortho_labels, truth.index)
+    if not found.all():
+        raise KeyError(
+            'There are no true labels for some segments (ex: '+
+            ', '.join(map(str, pd.unique(ortho_labels[~found])[:5]))+')'
         )
+    return truth[CLASS_LABEL].reindex(ortho_labels).to_numpy()
+
+# get the features files
+with instrument.timer('load_features'):
+    if args.features.is_dir():
+        features = tables.read_cameras(args.features, index_col='label')
     else:
-        with open(args.segment_dict) as json_file:
-            # a data structure for mapping drone image segments to orthomosaic segments
-            # dictionary:
-            #   key: a camera name
-            #   value:
-            #       another dictionary:
-            #           key: the drone image segment label
-            #           value: the orthomosaic segment id
-            segment_dict = json.load(json_file)
-        features[CLASS_LABEL] = features.apply(
-            lambda row: truth.loc[segment_dict[row.name[0]][str(int(row.name[1]))]],
-            axis=1
-        )
+        features = get_features(str(args.features))
 
-else:
+# check: are we running the experimental strategy or the default one?
+with instrument.timer('join_truth'):
+    if tables.CAMERA in features.index.names or tables.CAMERA in features.columns:
 
-    # get the features
-    features = get_features(str(args.features))
+        # make sure the features are multi-indexed by camera and label
+        if tables.CAMERA not in features.index.names:
+            features = features.set_index(tables.CAMERA, append=True).swaplevel()
 
-    # get the true labels and add them as a column to the features df
-    features = features.join(get_truth(add_ortho=False))
+        # now, get the true labels and add them as a column to the features df
+        truth = get_truth()
 
-def write_dir_output(df, out, *args):
-    """ write the test data to multiple files if the output is a directory """
-    for cam in set(df.index.get_level_values(0)):
-        df.loc[cam].to_csv(str(out)+"/"+cam+".tsv", sep="\t", *args)
+        # get the segment_dict
+        # but first, check that the segment_dict is provided
+        if args.segment_dict is None:
+            ortho_labels = features.index.get_level_values(1).to_numpy()
+        else:
+            # look up the orthomosaic segment of every row at once
+            ortho_labels = read_segment_dict(args.segment_dict).reindex(pd.MultiIndex.from_arrays([
+                features.index.get_level_values(0), features.index.get_level_values(1).astype(int)
+            ])).to_numpy()
+        features[CLASS_LABEL] = true_labels(truth, ortho_labels)
 
-# check: do we have to split the output?
-if len(args.out)-1:
-    # now, split the truth data among the output files
-    train, test = train_test_split(
-        features, test_size=args.test_proportion, stratify=features[CLASS_LABEL]
+    else:
+
+        # get the true labels and add them as a column to the features df
+        features = features.join(get_truth(add_ortho=False))
+        ortho_labels = features.index.to_numpy()
+instrument.count('segments', len(features))
+
+def segment_positions(fname):
+    """ get the (row, column) centroid of each orthomosaic segment, as a data frame indexed by label """
+    if fname.endswith('.json'):
+        import import_labelme
+        segments = import_labelme.main(fname, True)
+        return pd.DataFrame(
+            [np.mean(pts, axis=0)[::-1] for pts in segments.values()],
+            index=list(segments.keys()), columns=['row', 'col']
+        )
+    import scipy.ndimage
+    segments = np.load(fname)
+    label_keys = np.flatnonzero(np.bincount(segments.ravel()))[1:]
+    return pd.DataFrame(
+        scipy.ndimage.center_of_mass(segments != 0, segments, label_keys),
+        index=label_keys, columns=['row', 'col']
     )
 
-    # and write to the files
-    # keep only the species labels and the features
-    train.to_csv(args.out[0], sep="\t", index=False)
-    out_file = Path(args.out[1])
-    if out_file.is_dir():
-        write_dir_output(test, out_file)
+def assign_folds(ortho_labels):
+    """
+        randomly assign whole groups of orthomosaic segments to the testing set
+        until it has about the requested proportion of rows
+        ortho_labels is the orthomosaic segment of each row
+        return a data frame indexed by orthomosaic segment with the group of
+        each segment and whether it is in the testing set
+    """
+    segments = np.unique(ortho_labels)
+    if args.split == 'spatial':
+        positions = segment_positions(args.segments).reindex(segments)
+        if positions.isna().any(axis=None):
+            raise KeyError('Some of the segments are missing from '+args.segments)
+        blocks = (positions.to_numpy() // args.block_size).astype(np.int64)
+        groups = pd.Series([str(row)+'_'+str(col) for row, col in blocks], index=segments)
     else:
-        test.to_csv(args.out[1], sep="\t", index=False)
-else:
-    out_file = Path(args.out[0])
+        groups = pd.Series(segments.astype(str), index=segments)
+    # visit the groups in a random order
+    sizes = groups.reindex(ortho_labels).value_counts().sample(frac=1)
+    test = sizes.cumsum()-sizes < args.test_proportion*len(ortho_labels)
+    folds = pd.DataFrame({'group': groups, 'test': groups.map(test)})
+    folds.index.name = 'ortho_label'
+    return folds
+
+def folds_key():
+    """
+        describe everything that the folds depend on, so that a cached split
+        is only reused if none of it has changed
+        the segments files are identified by their modification time and size,
+        since watershed.py renumbers the segments whenever it is rerun
+    """
+    key = {'split': args.split, 'test_proportion': args.test_proportion}
+    if args.split == 'spatial':
+        key['block_size'] = args.block_size
+    for name, fname in (('segments', args.segments), ('segment_dict', args.segment_dict)):
+        if fname is not None:
+            stat = os.stat(fname)
+            key[name] = [stat.st_mtime_ns, stat.st_size]
+    return key
+
+def load_folds(ortho_labels):
+    """
+        get the folds from the cache if it was made the same way and has every
+        segment (see assign_folds()), otherwise assign and cache them
+        the first line of the cache is a comment with the folds_key() it was made with
+    """
+    key = folds_key()
+    if args.folds_cache is not None and args.folds_cache.exists():
+        with open(args.folds_cache) as cache:
+            header = cache.readline()
+            if header.startswith('# ') and json.loads(header[2:]) == key:
+                folds = pd.read_csv(cache, sep="\t", index_col='ortho_label', dtype={'group': str})
+                if np.isin(ortho_labels, folds.index).all():
+                    return folds
+                print('The folds cache is missing some segments. Reassigning them.')
+            else:
+                print('The folds cache was made from different segments or options. Reassigning them.')
+    folds = assign_folds(ortho_labels)
+    if args.folds_cache is not None:
+        with open(args.folds_cache, 'w') as cache:
+            cache.write('# '+json.dumps(key)+"\n")
+            folds.to_csv(cache, sep="\t")
+    return folds
+
+def write_output(df, out):
+    """
+        write the truth data to a table
+        or to a table for each camera if the output is a directory
+    """
+    out_file = Path(out)
     if out_file.is_dir():
-        write_dir_output(features, out_file)
+        tables.write_cameras(df, out_file)
+    elif tables.table_format(out_file) != 'tsv' and tables.CAMERA in df.index.names:
+        # binary tables can store the data from every camera in a single file
+        tables.write_cameras(df, out_file)
     else:
         # write to a file without the segment IDs, keeping only the species labels
         # and the features
-        features.to_csv(args.out[0], sep="\t", index=False)
+        tables.write(df, out_file, index=False)
+
+with instrument.timer('write'):
+    # check: do we have to split the output?
+    if len(args.out)-1:
+        # now, split the truth data among the output files
+        if args.split == 'random':
+            from sklearn.model_selection import train_test_split
+            train, test = train_test_split(
+                features, test_size=args.test_proportion, stratify=features[CLASS_LABEL]
+            )
+        else:
+            # keep the rows of each group of segments in the same set
+            test_rows = load_folds(ortho_labels)['test'].reindex(ortho_labels).to_numpy(dtype=bool)
+            train, test = features[~test_rows], features[test_rows]
+
+        # and write to the files
+        # keep only the species labels and the features
+        tables.write(train, args.out[0], index=False)
+        write_output(test, args.out[1])
+    else:
+        write_output(features, args.out[0])
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+import argparse
+
+parser = argparse.ArgumentParser(description='Evaluate the predictions for many samples at once: write the metrics.tsv, statistics.tsv, roc.tsv, and results.pdf that metrics.py, statistics.py, statistics.py --roc, and prc.py would for each sample, along with a summary of every sample.')
+parser.add_argument(
+    "summary", help="the path to a tsv in which to write the metrics of every sample, with a row for each sample"
+)
+parser.add_argument(
+    "-s", "--sample", nargs=3, action='append', required=True, metavar=('NAME', 'RESULTS', 'OUT'), help="the name of a sample, the path to its results table (from classify_test.R, classify.py, or resolve_conflicts.py), and the directory in which to write its outputs; can be given more than once"
+)
+parser.add_argument(
+    "-b", "--bins", type=int, default=None, help="read each results table in chunks and count the probabilities in this many bins, like metrics.py --bins (default: compute every metric exactly)"
+)
+parser.add_argument(
+    "--range", nargs=2, type=float, default=[0, 1], metavar=('LOW', 'HIGH'), help="the lowest and highest possible probabilities, between which the --bins are spread, like metrics.py --range; the scores aren't divided by their maximum like they are without --bins, so it is an error for any of them to be outside of this range (default: 0 1)"
+)
+parser.add_argument(
+    "--beta", type=float, default=1, help="the beta of the F-beta score (default: 1, the F1 score)"
+)
+parser.add_argument(
+    "-j", "--jobs", type=int, default=1, help="the number of samples to evaluate in parallel (default: 1); -1 means one for each core"
+)
+args = parser.parse_args()
+
+import os
+import sys
+import numpy as np
+import histogram
+import pandas as pd
+from pathlib import Path
+
+
+# the columns of the results tables that have the truth, the probability of
+# the positive class, and the prediction (as in `cut -f 2,4,5`)
+COLUMNS = {1: 'truth', 3: 'probs', 4: 'predict'}
+DTYPES = {'truth': np.bool_, 'probs': np.float64, 'predict': np.bool_}
+# the order of the metrics in metrics.tsv (as in metrics.py's default -m r,p,b,t,f,a,v)
+METRICS = ['recall', 'precision', 'fbeta', 'predicted_positives', 'predicted_negatives', 'auroc', 'average_precision']
+
+
+def read_results(fname, chunksize=None):
+    """ read the truth, probs, and predict columns of a results table (skipping its header) """
+    df = pd.read_csv(
+        fname, sep='\t', header=None, skiprows=1, usecols=list(COLUMNS),
+        na_values='.', low_memory=False, chunksize=chunksize
+    )
+    if chunksize is None:
+        return df.rename(columns=COLUMNS).fillna(0).astype(DTYPES)
+    return (chunk.rename(columns=COLUMNS).fillna(0).astype(DTYPES) for chunk in df)
+
+def exact_metrics(df):
+    """
+        compute the metrics and the precision recall and ROC curves of a results table exactly, like metrics.py and statistics.py
+        return a dictionary of the metrics, the (recall, precision) curve, and the (fpr, tpr) curve
+    """
+    import sklearn.metrics
+    precision, recall, fbeta, _ = sklearn.metrics.precision_recall_fscore_support(
+        df['truth'], df['predict'], beta=args.beta, average='binary'
+    )
+    predicted = sklearn.metrics.confusion_matrix(df['truth'], df['predict'], labels=[False, True]).sum(0)
+    # replace inf values with a number 1 larger than the next largest value
+    probs = df['probs']
+    if probs.max() == np.inf:
+        probs = probs.replace(np.inf, np.sort(probs.unique())[-2]+1)
+    # turn the scores into probabilities if they're not already
+    probs = probs/probs.max()
+    curve_precision, curve_recall, _ = sklearn.metrics.precision_recall_curve(df['truth'], probs)
+    fpr, tpr, _ = sklearn.metrics.roc_curve(df['truth'], probs)
+    return {
+        'precision': precision, 'recall': recall, 'fbeta': fbeta,
+        'predicted_negatives': predicted[0], 'predicted_positives': predicted[1],
+        'auroc': sklearn.metrics.roc_auc_score(df['truth'], probs),
+        'average_precision': sklearn.metrics.average_precision_score(df['truth'], probs)
+    }, np.array([curve_recall, curve_precision]), np.array([fpr, tpr])
+
+def binned_metrics(chunks, bins):
+    """ compute the metrics and the precision recall and ROC curves of a results table in chunks, like metrics.py --bins """
+    confusion = histogram.ConfusionCounts()
+    hist = histogram.ScoreHistogram(bins, *args.range)
+    for chunk in chunks:
+        confusion.add(chunk['truth'], chunk['predict'])
+        hist.add(chunk['truth'], chunk['probs'])
+    hist.check()
+    precision, recall, fbeta, _, negatives, positives = confusion.scores(args.beta)
+    curve_precision, curve_recall, _ = hist.precision_recall_curve()
+    fpr, tpr, _ = hist.roc_curve()
+    return {
+        'precision': precision, 'recall': recall, 'fbeta': fbeta,
+        'predicted_negatives': negatives, 'predicted_positives': positives,
+        'auroc': hist.roc_auc(), 'average_precision': hist.average_precision()
+    }, np.array([curve_recall, curve_precision]), np.array([fpr, tpr])
+
+def evaluate(sample):
+    """ evaluate a single sample, write its outputs, and return its row of the summary """
+    import prc
+    name, results, out = sample
+    out = Path(out)
+    out.mkdir(parents=True, exist_ok=True)
+    if args.bins is None:
+        scores, curve, roc = exact_metrics(read_results(results))
+    else:
+        scores, curve, roc = binned_metrics(read_results(results, histogram.CHUNKSIZE), args.bins)
+    # write the same files as metrics.py, statistics.py, statistics.py --roc, and prc.py
+    point = np.array([scores[metric] for metric in METRICS], dtype=object)
+    np.savetxt(str(out/'metrics.tsv'), point, delimiter="\t", fmt='%s')
+    np.savetxt(str(out/'statistics.tsv'), curve)
+    np.savetxt(str(out/'roc.tsv'), roc)
+    prc.plot({'buckwheat_pt': point.astype(np.float64), 'buckwheat': curve}, str(out/'results.pdf'))
+    print('evaluated', name, file=sys.stderr)
+    return dict(sample=name, **scores)
+
+
+if args.jobs == 1 or len(args.sample) == 1:
+    rows = [evaluate(sample) for sample in args.sample]
+else:
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(
+        min(args.jobs if args.jobs > 0 else os.cpu_count(), len(args.sample)),
+        multiprocessing.get_context('fork')
+    ) as pool:
+        rows = list(pool.map(evaluate, args.sample))
+pd.DataFrame(rows, columns=['sample']+METRICS).to_csv(args.summary, sep='\t', index=False)
@@ -27,6 +27,8 @@ parser.add_argument(
 args = parser.parse_args()
 
 import Metashape
+import numpy as np
+import import_labelme
 from pathlib import Path
 
 
@@ -51,18 +53,16 @@ def coord_pt(chunk, point):
 
 def import_segments(file):
     """
-        import the segments in whatever format they're in and get their centroids
+        import the segments in whatever format they're in and get their centroids, as (x, y) pixel coordinates
     """
-    img_shape = (WIDTH, HEIGHT)
+    img_shape = (chunk.orthomosaic.width, chunk.orthomosaic.height)
     # if the data is from labelme, import it using the labelme importer
     if file.endswith('.json'):
         labels = import_labelme.main(file, True, img_shape)
         label_keys = sorted(labels.keys())
-        # make sure the segments are in sorted order, according to the keys
-        labels = Polygons([labels[i] for i in label_keys])
         pts = {
-            label_keys[i] : tuple(np.around(labels.points[i].mean(axis=0)).astype(np.uint))[::-1]
-            for i in range(len(labels.points))
+            label: tuple(np.around(np.mean(labels[label], axis=0)).astype(np.uint))
+            for label in label_keys
         }
     elif file.endswith('.npy'):
         segments = np.load(file) != 0
@@ -79,7 +79,7 @@ if args.points is None:
     print("{0},{1}\t{2},{3}".format(chunk.orthomosaic.width, chunk.orthomosaic.height, chunk.orthomosaic.bottom, chunk.orthomosaic.right), file=args.out)
 else:
     if Path(args.points).is_file():
-        args.points = import_segments(args.points)
+        args.points = list(import_segments(args.points).values())
     else:
         args.points = [
             tuple(int(i) for i in pt.split(','))
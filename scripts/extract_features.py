@@ -9,21 +9,28 @@ parser.add_argument(
     "labels", help="the path to the file containing the coordinates of each segmented region"
 )
 parser.add_argument(
-    "out", help="a TSV containing the features (as columns) of each segmented regions (as rows)"
+    "out", help="a table containing the features (as columns) of each segmented regions (as rows); the table will be written in a binary columnar format if the file has a .parquet or .feather ending (and as a TSV otherwise)"
 )
 args = parser.parse_args()
 
+import tables
+if not tables.is_table(args.out):
+    parser.error('Unsupported output file type. The file must have one of these endings: '+", ".join(tables.FORMATS))
+
 import features
+import instrument
 import numpy as np
 from PIL import Image, ImageDraw
 
 
 NUM_FEATURES = 19
+COLUMNS = ["label", "redAvg", "greenAvg", "blueAvg", "yellow", "variance", "edges", "texture", "contrast", "dissim", "homog", "energy", "corr", "ASM", "Hstd", "Sstd", "Vstd", "Hskew", "Sskew", "Vskew"]
 Image.MAX_IMAGE_PIXELS = None # so that PIL doesn't complain when we open large files
 
 # load the image
-img = Image.open(args.img).convert("RGB")
-img_array = np.asarray(img)
+with instrument.timer('load_image'):
+    img = Image.open(args.img).convert("RGB")
+    img_array = np.asarray(img)
 
 def metrics(img, mask):
     """
@@ -90,35 +97,52 @@ def processMarkers(markers):
             inFileCorrectIndex += 1
         except:
             print("Current marker invalid, discarded.")
+            instrument.count('discarded')
     return np.hstack((marker_ids[:, np.newaxis], out))
 
-# if the data is from labelme, import it using the labelme importer
-if args.labels.endswith('.json'):
-    import import_labelme
-    # labels = [np.array(label, dtype=np.int32) for label in labels]
-    labels = import_labelme.main(args.labels, True, img_array.shape[-2::-1])
-    label_keys = sorted(labels.keys())
-    # make sure the segments are in sorted order, according to the keys
-    labels = [labels[i] for i in label_keys]
-    out = np.empty((len(labels), NUM_FEATURES))
-    # for each segmented region:
-    # TODO: parallelize these steps somehow? one potential complication: the output needs to remain in the same order as the labels
-    inFileCorrectIndex = 0
-    for i in range(len(labels)):
-        try:
-            processLabel(labels[inFileCorrectIndex])
-            inFileCorrectIndex += 1
-        except:
-            print("Current marker invalid, discarded.")
-    # add the keys
-    out = np.hstack((np.array(label_keys)[:, np.newaxis], out))
-elif args.labels.endswith('.npy'):
-    markers = np.load(args.labels)
-    out = processMarkers(markers)
-else:
-    raise Exception('label format not supported yet')
+with instrument.timer('features'):
+    # if the data is from labelme, import it using the labelme importer
+    if args.labels.endswith('.json'):
+        import import_labelme
+        # labels = [np.array(label, dtype=np.int32) for label in labels]
+        labels = import_labelme.main(args.labels, True, img_array.shape[-2::-1])
+        label_keys = sorted(labels.keys())
+        # make sure the segments are in sorted order, according to the keys
+        labels = [labels[i] for i in label_keys]
+        out = np.empty((len(labels), NUM_FEATURES))
+        # for each segmented region:
+        # TODO: parallelize these steps somehow? one potential complication: the output needs to remain in the same order as the labels
+        inFileCorrectIndex = 0
+        for i in range(len(labels)):
+            try:
+                processLabel(labels[inFileCorrectIndex])
+                inFileCorrectIndex += 1
+            except:
+                print("Current marker invalid, discarded.")
+                instrument.count('discarded')
+        instrument.count('segments', len(labels))
+        # add the keys
+        out = np.hstack((np.array(label_keys)[:, np.newaxis], out))
+    elif args.labels.endswith('.npy'):
+        markers = np.load(args.labels)
+        out = processMarkers(markers)
+        instrument.count('segments', len(out))
+    else:
+        raise Exception('label format not supported yet')
 
-# write the output to the tsv file
-np.savetxt(args.out, out, fmt='%f', delimiter="\t", comments='',
-    header="\t".join(["label", "redAvg", "greenAvg", "blueAvg", "yellow", "variance", "edges", "texture", "contrast", "dissim", "homog", "energy", "corr", "ASM", "Hstd", "Sstd", "Vstd", "Hskew", "Sskew", "Vskew"])
-)
+# write the output to the table
+with instrument.timer('write'):
+    if tables.table_format(args.out) == 'tsv':
+        np.savetxt(args.out, out, fmt='%f', delimiter="\t", comments='',
+            header="\t".join(COLUMNS)
+        )
+    else:
+        # binary tables keep the full precision of each feature and store the labels as integers
+        import pandas as pd
+        tables.write(
+            pd.DataFrame(
+                out[:,1:], columns=COLUMNS[1:],
+                index=pd.Index(out[:,0].astype(np.int64), name=COLUMNS[0])
+            ),
+            args.out
+        )
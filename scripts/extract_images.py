@@ -22,27 +22,47 @@ import os
 import re
 import json
 import yaml
+import segment_index
 import import_labelme
 
 
+def labelImages(sourceDir, targetLabels):
+    """
+        find the (label, image) pairs for the target labels
+        use the index written by rev_transform.py if there is one, since it can
+        look up each label without reading every json
+    """
+    indexFile = os.path.join(sourceDir, segment_index.INDEX_FILE)
+    if os.path.exists(indexFile):
+        for label in targetLabels:
+            if not label.strip().lstrip('-').isdigit():
+                print("Ignoring label '"+label+"', since it isn't a segment ID", file=sys.stderr)
+        return [
+            (str(label), camera+'.JPG')
+            for label, camera, _, _ in sorted(
+                segment_index.query(indexFile, targetLabels), key=lambda row: row[1]
+            )
+        ]
+    # otherwise, scan the segments of every image
+    pairs = []
+    for filename in sorted(os.listdir(sourceDir)):
+        if filename.endswith(".json"):
+            segments = import_labelme.main(sourceDir+"/"+filename, labeled=True)
+            for currentLabel in segments.keys():
+                if str(currentLabel) in targetLabels:
+                    pairs.append((str(currentLabel), filename[:-5]+'.JPG'))
+    return pairs
+
 def extractAllImages(sourceDir, targetLabels, out):
     """extract images used to form certain labels in the segment map stitch"""
     outputImages = []
     outputImageDict = {}
-    for filename in os.listdir(sourceDir):
-        if filename.endswith(".json"):
-            segments = import_labelme.main(sourceDir+"/"+filename, labeled=True)
-            if segments != {}:
-                currentLabels = list(segments.keys())
-                currentLabels = [str(label) for label in currentLabels]
-            for currentLabel in currentLabels:
-                if currentLabel in targetLabels:
-                    imageFilename = filename[:-5]+'.JPG'
-                    outputImages.append(imageFilename)
-                    if currentLabel not in outputImageDict.keys():
-                        outputImageDict.update({currentLabel: [imageFilename]})
-                    else:
-                        outputImageDict[currentLabel].append(imageFilename)
+    for currentLabel, imageFilename in labelImages(sourceDir, targetLabels):
+        outputImages.append(imageFilename)
+        if currentLabel not in outputImageDict.keys():
+            outputImageDict.update({currentLabel: [imageFilename]})
+        else:
+            outputImageDict[currentLabel].append(imageFilename)
 
     uniqueOutputImages = list(set(outputImages))
     # write unique output images to output file
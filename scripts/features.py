@@ -1,12 +1,10 @@
 #!/usr/bin/env python3
 import numpy as np
+from functools import lru_cache
 from colorsys import *
-import matplotlib as mpl
-from scipy.stats import skew
-from sklearn import preprocessing
-from skimage import filters, color
 from PIL import Image, ImageStat, ImageFilter
-from skimage.feature import greycomatrix, greycoprops
+# scipy, skimage, and matplotlib are imported only by the functions that need
+# them, since they take a while to import and not every script uses them
 
 
 
@@ -128,9 +126,20 @@ def hsv(colors):
     r,g,b=colors
     return rgb_to_hsv(r/255., g/255., b/255.)
 
+@lru_cache(maxsize=None)
+def glcm_functions():
+    """
+        import skimage's GLCM functions the first time they're needed
+        glcm() is called once for each window of an image, so this keeps it from
+        running the import statement (and its lookups) over and over again
+    """
+    from skimage.feature import greycomatrix, greycoprops
+    return greycomatrix, greycoprops
+
 def glcm(im, mask=None, offset=None, features=['contrast', 'dissimilarity', 'homogeneity', 'energy', 'correlation', 'ASM']):
     """Calculate the grey level co-occurrence matrices and output values for
     contrast, dissimilarity, homogeneity, energy, correlation, and ASM in a list"""
+    greycomatrix, greycoprops = glcm_functions()
 
     newIm = im
     if not isinstance(im, np.ndarray):
@@ -160,8 +169,10 @@ def colorMoment(im, mask):
     #The first color moment is the mean. This is already considered as a metric for
     #the red, green, and blue channels, so this is not included here.
     #Only the 2nd and 3rd moments will be calculated here.
+    import matplotlib.colors
+    from scipy.stats import skew
 
-    newIm = mpl.colors.rgb_to_hsv(im) #convert to HSV space
+    newIm = matplotlib.colors.rgb_to_hsv(im) #convert to HSV space
 
     #Pull out each channel from the image to analyze seperately.
     HChannel = newIm[:,:,0]
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+import numpy as np
+
+
+# the number of rows to read from a table at a time
+CHUNKSIZE = 1000000
+
+
+class ScoreHistogram:
+    """
+        the number of positive and negative examples whose scores fall in each of a fixed set of bins
+        histograms can be filled one chunk of a table at a time, so they take
+        constant memory, no matter how many rows the table has
+        the curves and areas computed from them approximate scikit-learn's,
+        since scores in the same bin are treated as ties (ex: a score of 1 is
+        tied with the scores just below it)
+        the range of the bins is fixed, so the scores must be within it
+        (unlike the exact metrics, they aren't divided by their maximum)
+    """
+
+    def __init__(self, bins=1000, low=0, high=1):
+        """
+            divide the range of scores from low to high into bins
+            infinite scores fall in the first or last bin, but finite scores outside
+            of the range are counted in outside, since binning them would be wrong
+        """
+        self.low, self.high = low, high
+        # the negatives (in the first row) and positives (in the second) in each bin
+        self.counts = np.zeros((2, bins), dtype=np.int64)
+        # the number of finite scores outside of the range
+        self.outside = 0
+
+    @property
+    def bins(self):
+        return self.counts.shape[1]
+
+    def add(self, truth, scores):
+        """ count the examples in a chunk, given their truth (bool) and scores (floats) """
+        truth = np.asarray(truth, dtype=bool)
+        scores = np.asarray(scores, dtype=np.float64)
+        self.outside += int(np.sum(np.isfinite(scores) & ((scores < self.low) | (scores > self.high))))
+        scaled = (scores-self.low)/(self.high-self.low)*self.bins
+        # clip before converting to integers, so that infinite scores fall in the first or last bin
+        idx = np.clip(np.floor(scaled), 0, self.bins-1).astype(np.int64)
+        self.counts += np.stack((
+            np.bincount(idx[~truth], minlength=self.bins), np.bincount(idx[truth], minlength=self.bins)
+        ))
+
+    def check(self):
+        """ raise a ValueError if any of the scores were outside of the range of the bins """
+        if self.outside:
+            raise ValueError(
+                str(self.outside)+" of the scores were outside of the range of the bins ("+
+                str(self.low)+" to "+str(self.high)+"), so their metrics would be wrong. "
+                "Provide the range of the scores or compute the metrics exactly instead."
+            )
+
+    def flip(self):
+        """ flip the scores (ie replace each score s with low+high-s) """
+        self.counts = self.counts[:, ::-1].copy()
+
+    def thresholds(self):
+        """ get the lower edge of each bin """
+        return self.low+np.arange(self.bins)*(self.high-self.low)/self.bins
+
+    def cumulative(self):
+        """
+            get the number of false positives and true positives when every
+            example at or above each threshold is predicted to be positive
+            only the thresholds of the nonempty bins are included, in decreasing order
+        """
+        nonempty = np.flatnonzero(self.counts.sum(axis=0))[::-1]
+        counts = np.cumsum(self.counts[:, ::-1], axis=1)[:, self.bins-1-nonempty]
+        return counts[0], counts[1], self.thresholds()[nonempty]
+
+    def roc_curve(self):
+        """ get the false positive rates, true positive rates, and thresholds, like sklearn.metrics.roc_curve() """
+        fps, tps, thresholds = self.cumulative()
+        fps, tps = np.r_[0, fps], np.r_[0, tps]
+        return fps/fps[-1], tps/tps[-1], np.r_[np.inf, thresholds]
+
+    def precision_recall_curve(self):
+        """ get the precisions, recalls, and thresholds, like sklearn.metrics.precision_recall_curve() """
+        fps, tps, thresholds = self.cumulative()
+        precision = tps/(tps+fps)
+        recall = tps/tps[-1]
+        # stop once we reach full recall and then reverse the order, so that recall is decreasing
+        last = np.searchsorted(tps, tps[-1])+1
+        return (
+            np.r_[precision[:last][::-1], 1], np.r_[recall[:last][::-1], 0], thresholds[:last][::-1]
+        )
+
+    def roc_auc(self):
+        """ get the area under the ROC curve """
+        fpr, tpr, _ = self.roc_curve()
+        # use the trapezoidal rule, which gives half credit to ties
+        return np.sum(np.diff(fpr)*(tpr[1:]+tpr[:-1])/2)
+
+    def average_precision(self):
+        """ get the average precision, like sklearn.metrics.average_precision_score() """
+        fps, tps, _ = self.cumulative()
+        recall = np.r_[0, tps/tps[-1]]
+        return np.sum(np.diff(recall)*tps/(tps+fps))
+
+
+class ConfusionCounts:
+    """ the number of true and false positives and negatives, which can be counted one chunk of a table at a time """
+
+    def __init__(self):
+        self.tp = self.fp = self.fn = self.tn = 0
+
+    def add(self, truth, predict):
+        truth, predict = np.asarray(truth, dtype=bool), np.asarray(predict, dtype=bool)
+        self.tp += int(np.sum(truth & predict))
+        self.fp += int(np.sum(~truth & predict))
+        self.fn += int(np.sum(truth & ~predict))
+        self.tn += int(np.sum(~truth & ~predict))
+
+    def scores(self, beta=1):
+        """
+            get the precision, recall, F-beta score, and the number of predicted
+            negatives and positives, in the same order as metrics.py
+            like scikit-learn, the precision and recall are 0 when they're undefined
+            and there is a None (for the support) after the F-beta score
+        """
+        precision = self.tp/(self.tp+self.fp) if self.tp+self.fp else 0
+        recall = self.tp/(self.tp+self.fn) if self.tp+self.fn else 0
+        fbeta = (1+beta**2)*precision*recall/(beta**2*precision+recall) if precision+recall else 0
+        return np.array([precision, recall, fbeta, None, self.tn+self.fn, self.tp+self.fp], dtype=object)
+
+
+def read_chunks(table, names, dtype, chunksize=CHUNKSIZE, **kwargs):
+    """ read a headerless tsv (like metrics.py and statistics.py do) one chunk of rows at a time """
+    import pandas as pd
+    for chunk in pd.read_csv(
+        table, sep='\t', header=None, names=names, index_col=False, dtype=dtype,
+        na_values='.', chunksize=chunksize, **kwargs
+    ):
+        yield chunk.fillna(0)
@@ -13,5 +13,9 @@ if [ ! -d "${1%/}"/rev_transforms ]; then
   echo "The directory '${1%/}/rev_transforms/' must exist in order to run this script. Check that you are using the experimental strategy of the pipeline and that the 'parallel' config option is set to true."
   exit 1
 fi
+# look up the segment in the index written by rev_transform.py, if there is one
+if [ -f "${1%/}"/rev_transforms/index.sqlite ]; then
+  exec "$(dirname "$0")"/segment_index.py "${1%/}"/rev_transforms/index.sqlite "$2"
+fi
 cd "${1%/}"/rev_transforms
 grep -cl '"label": "'$2'"' *.json | sed 's/.json//g'
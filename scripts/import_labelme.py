@@ -1,40 +1,120 @@
 #!/usr/bin/env python3
+import re
 import json
+import numpy as np
 
 
+# how many characters of a labelme file to read at a time
+CHUNKSIZE = 1 << 20
+# the characters that can separate the shapes in the list of shapes
+SEPARATORS = re.compile(r'[\s,]*')
+
+
+def parse_label(label):
+    """ convert a label to an integer, ignoring any chars in the string """
+    if type(label) != int:
+        label = int("".join([s for s in label if s.isdigit()]))
+    return label
+
+def shapes(labels):
+    """
+        iterate over the shapes in a labelme file, one at a time, without
+        reading the entire file into memory
+        only the part of the file with the current shape is kept in memory, so
+        this is much more economical than json.load() for large files
+    """
+    decoder = json.JSONDecoder()
+    with open(labels) as json_file:
+        buffer = json_file.read(CHUNKSIZE)
+        # find the start of the list of shapes
+        while True:
+            start = buffer.find('"shapes"')
+            if start != -1:
+                start = buffer.find('[', start)
+                if start != -1:
+                    break
+            chunk = json_file.read(CHUNKSIZE)
+            if not chunk:
+                # there aren't any shapes in this file
+                return
+            buffer += chunk
+        pos = start+1
+        while True:
+            # skip to the next shape (or the end of the list)
+            pos = SEPARATORS.match(buffer, pos).end()
+            if pos < len(buffer):
+                if buffer[pos] == ']':
+                    return
+                try:
+                    shape, end = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    # the shape continues past the end of the buffer
+                    end = None
+                if end is not None:
+                    yield shape
+                    pos = end
+                    continue
+            # read more of the file, dropping the shapes we've already parsed
+            chunk = json_file.read(CHUNKSIZE)
+            if not chunk:
+                raise ValueError("The list of shapes in "+str(labels)+" ends before it is closed.")
+            buffer, pos = buffer[pos:]+chunk, 0
+
+def iterate(labels, dims=tuple()):
+    """
+        iterate over the label and coordinates of each segment in a labelme file, one at a time
+        if dimensions are specified, labels that don't exist inside the dims will be ignored
+    """
+    for shape in shapes(labels):
+        pts = shape['points']
+        if dims:
+            pts = list(
+                filter(
+                    lambda pt: (0 <= pt[0] < dims[0]) and (0 <= pt[1] < dims[1]),
+                    pts
+                )
+            )
+        if len(pts) < 3:
+            continue
+        yield parse_label(shape['label']), pts
+
 def main(labels, labeled=False, dims=tuple()):
     """
         import the labels and extract the coordinates to a list
         if dimensions are specified, labels that don't exist inside the dims will be ignored
     """
-    with open(labels) as json_file:
-        # initialize input and output
-        labels = json.load(json_file)['shapes']
-        segments = {}
-        new_labels = []
-        # for each segment, grab its pt and store it in the output
-        for i in range(len(labels)):
-            pts = labels[i]['points']
-            if dims:
-                pts = list(
-                    filter(
-                        lambda pt: (0 <= pt[0] < dims[0]) and (0 <= pt[1] < dims[1]),
-                        pts
-                    )
-                )
-            if len(pts) < 3:
-                continue
-            # add to the segments dict
-            label = labels[i]['label']
-            if type(label) != int:
-                # convert the label to an integer, ignoring any chars in the string
-                label = int("".join([s for s in labels[i]['label'] if s.isdigit()]))
-            segments[label] = pts
-            # add to the new labels array
-            new_labels.append(pts)
-    return segments if labeled else new_labels
+    segments = iterate(labels, dims)
+    return dict(segments) if labeled else [pts for label, pts in segments]
+
+def format_points(pts, precision=None):
+    """
+        format the points of a segment as a JSON list
+        pts can be a list of points or a numpy array with a row for each point
+        if precision is provided, the coordinates are rounded to that many decimal places
+    """
+    if precision is None and not isinstance(pts, np.ndarray):
+        return json.dumps(pts)
+    pts = np.asarray(pts)
+    if precision is not None and not np.issubdtype(pts.dtype, np.integer):
+        pts = np.round(pts, precision)
+        if precision <= 0:
+            pts = pts.astype(np.int64)
+    if not pts.size:
+        return "[]"
+    # format all of the coordinates at once, instead of converting each point to a list
+    fmt = "%d" if np.issubdtype(pts.dtype, np.integer) else "%r"
+    point = "["+", ".join([fmt]*pts.shape[1])+"]"
+    return "["+(", ".join([point]*len(pts)) % tuple(pts.ravel().tolist()))+"]"
+
+def format_shape(label, pts, flags=None, precision=None):
+    """ format a segment as a labelme shape """
+    return (
+        '{"label": '+json.dumps(str(label))+', "line_color": null, "fill_color": null, '
+        '"points": '+format_points(pts, precision)+', "shape_type": "polygon", '
+        '"flags": '+json.dumps(flags or {})+'}'
+    )
 
-def write(file, segments, image_path=None):
+def write(file, segments, image_path=None, precision=None):
     """
         write the segments (belonging to image_path) to the file in JSON format
         segments can be one of a number of things:
@@ -44,43 +124,31 @@ def write(file, segments, image_path=None):
                 where class_label is one of two things:
                 1) a label
                 2) a 2-element tuple (label, probability)
+        pts can be lists of points or numpy arrays with a row for each point
+        segments can also be an iterator, since each segment is written as soon
+        as it is created
+        if precision is provided, the coordinates are rounded to that many decimal places
         if image_path is provided, the file will be in valid labelme format
     """
     if image_path:
         import os.path
         image_path = os.path.relpath(image_path, os.path.dirname(file))
     with open(file, 'w') as out:
-        json.dump(
-            {
-                'flags': {},
-                'shapes': [
-                    {
-                        'label': str(segment[0]),
-                        'line_color': None,
-                        'fill_color': None,
-                        'points': segment[1],
-                        'shape_type': "polygon",
-                        'flags': dict([
-                            segment[2] if type(segment[2]) is tuple else (segment[2], True)
-                        ]) if len(segment) == 3 else {}
-                    }
-                    if type(segment) is tuple else
-                    {
-                        'label': str(idx),
-                        'line_color': None,
-                        'fill_color': None,
-                        'points': segment,
-                        'shape_type': "polygon",
-                        'flags': {}
-                    }
-                    for idx, segment in enumerate(segments)
-                ],
-                "lineColor": [0,255,0,128],
-                "fillColor": [255,0,0,128],
-                "imagePath": image_path,
-                "imageData": None
-            },
-            out
+        out.write('{"flags": {}, "shapes": [')
+        for idx, segment in enumerate(segments):
+            if idx:
+                out.write(', ')
+            if type(segment) is tuple:
+                out.write(format_shape(
+                    segment[0], segment[1], dict([
+                        segment[2] if type(segment[2]) is tuple else (segment[2], True)
+                    ]) if len(segment) == 3 else {}, precision
+                ))
+            else:
+                out.write(format_shape(idx, segment, precision=precision))
+        out.write(
+            '], "lineColor": [0, 255, 0, 128], "fillColor": [255, 0, 0, 128], '
+            '"imagePath": '+json.dumps(image_path)+', "imageData": null}'
         )
 
 if __name__ == '__main__':
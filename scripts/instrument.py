@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import atexit
+import resource
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+
+
+# the environment variable containing the path to a directory in which to write metrics
+# if it isn't set, the functions in this module do (almost) nothing
+ENV_VAR = 'FLOWER_MAP_METRICS'
+# how often (in seconds) to sample the memory usage of the process
+SAMPLE_INTERVAL = 0.05
+
+METRICS_DIR = os.environ.get(ENV_VAR)
+SCRIPT = Path(sys.argv[0]).stem if sys.argv and sys.argv[0] else 'python'
+START = time.perf_counter()
+# counters (ex: of segments processed) that are reported when the script exits
+COUNTERS = {}
+# the stages that are currently being timed, so that the memory sampler can
+# record their peak memory usage
+ACTIVE = []
+
+
+def enabled():
+    """ whether metrics are being recorded """
+    return METRICS_DIR is not None
+
+def rss():
+    """ get the current resident set size of this process in MB """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1])*resource.getpagesize()/1e6
+    except OSError:
+        # fall back to the peak memory usage on systems without /proc
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024/1e6
+
+def sample_memory():
+    """ periodically record the memory usage of every stage that is being timed """
+    while True:
+        current = rss()
+        for stage in list(ACTIVE):
+            stage['peak_rss'] = max(stage['peak_rss'], current)
+        time.sleep(SAMPLE_INTERVAL)
+
+def record(**fields):
+    """ write a single record (as a line of JSON) to this process's metrics file """
+    if not enabled():
+        return
+    fields = {'script': SCRIPT, 'pid': os.getpid(), **fields}
+    path = Path(METRICS_DIR)
+    path.mkdir(parents=True, exist_ok=True)
+    # each process writes to its own file, so that parallel jobs don't clobber each other
+    with open(str(path/(SCRIPT+'.'+str(os.getpid())+'.jsonl')), 'a') as metrics:
+        metrics.write(json.dumps(fields)+"\n")
+
+@contextmanager
+def timer(stage):
+    """
+        a context manager that records how long a stage of a script takes,
+        how much CPU time it uses, and its peak memory usage
+    """
+    if not enabled():
+        yield
+        return
+    stats = {'peak_rss': rss()}
+    ACTIVE.append(stats)
+    start, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield
+    finally:
+        ACTIVE.remove(stats)
+        record(
+            stage=stage, seconds=time.perf_counter()-start,
+            cpu_seconds=time.process_time()-cpu,
+            peak_rss=max(stats['peak_rss'], rss())
+        )
+
+def count(name, amount=1):
+    """ add amount to a counter (ex: of the number of segments processed) """
+    COUNTERS[name] = COUNTERS.get(name, 0)+amount
+
+def finish():
+    """ record the total running time, peak memory usage, and counters of the script """
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    record(
+        stage='total', seconds=time.perf_counter()-START,
+        cpu_seconds=usage.ru_utime+usage.ru_stime,
+        # ru_maxrss is in kilobytes on linux
+        peak_rss=usage.ru_maxrss*1024/1e6,
+        counters=COUNTERS, argv=sys.argv[1:]
+    )
+
+def load(path):
+    """ load the metrics in a directory of JSON lines files into a pandas data frame """
+    import pandas as pd
+    records = []
+    for fname in sorted(Path(path).glob('*.jsonl')):
+        with open(str(fname)) as metrics:
+            records.extend(json.loads(line) for line in metrics if line.strip())
+    return pd.DataFrame(records)
+
+def summarize(metrics):
+    """
+        aggregate the metrics from load() across every run of each script
+        return 1) the number of runs, total and max time, total CPU time, and
+        peak memory usage of each stage of each script and 2) the sum of each
+        counter for each script
+    """
+    import pandas as pd
+    stages = metrics.groupby(['script', 'stage'], sort=False).agg(
+        runs=('seconds', 'size'), seconds=('seconds', 'sum'),
+        max_seconds=('seconds', 'max'), cpu_seconds=('cpu_seconds', 'sum'),
+        peak_rss=('peak_rss', 'max')
+    )
+    totals = metrics[metrics['stage'] == 'total']
+    counters = pd.DataFrame(
+        list(totals['counters']) if 'counters' in totals else [],
+        index=totals['script'] if 'counters' in totals else None
+    ).fillna(0).groupby(level=0).sum().astype(int)
+    return stages, counters
+
+
+if enabled():
+    threading.Thread(target=sample_memory, daemon=True).start()
+    atexit.register(finish)
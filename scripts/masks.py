@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+import numpy as np
+
+
+class RLEMask:
+    """
+        a boolean mask stored as the runs of True pixels in the flattened (row-major) array
+        plants cover only a small part of most images, so this is usually an
+        order of magnitude smaller than a dense array of the same shape
+        runs may continue from the end of one row onto the start of the next
+    """
+
+    def __init__(self, shape, starts=(), ends=()):
+        """ create a mask from the (sorted, non-overlapping) start and end indices of its runs """
+        self.shape = tuple(int(i) for i in shape[:2])
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.ends = np.asarray(ends, dtype=np.int64)
+
+    @classmethod
+    def from_dense(cls, mask):
+        """ create a mask from a dense array, where nonzero pixels are True """
+        flat = np.zeros(mask.size+2, dtype=np.int8)
+        flat[1:-1] = mask.ravel() != 0
+        edges = np.diff(flat)
+        return cls(mask.shape, np.flatnonzero(edges == 1), np.flatnonzero(edges == -1))
+
+    def to_dense(self, dtype=np.uint8, value=1):
+        """ convert the mask to a dense array, with value in place of True pixels """
+        # mark the start and end of each run and then fill in between them
+        edges = np.zeros(self.size+1, dtype=np.int8)
+        edges[self.starts] += 1
+        edges[self.ends] -= 1
+        return np.cumsum(edges[:-1], dtype=np.int8).reshape(self.shape).astype(dtype) * dtype(value)
+
+    @property
+    def size(self):
+        return self.shape[0]*self.shape[1]
+
+    def __len__(self):
+        """ the number of runs """
+        return len(self.starts)
+
+    def area(self):
+        """ the number of True pixels """
+        return int(np.sum(self.ends-self.starts))
+
+    def nbytes(self):
+        return self.starts.nbytes+self.ends.nbytes
+
+    def _combine(self, other, op):
+        """
+            combine this mask with other, pixel by pixel, using op (a numpy logical function)
+            the runs of both masks divide the image into intervals that are
+            either entirely inside or entirely outside of each mask, so we only
+            have to apply op once per interval
+        """
+        if self.shape != other.shape:
+            raise ValueError('Cannot combine masks with different shapes: '+str(self.shape)+' and '+str(other.shape))
+        bounds = np.unique(np.concatenate(([0, self.size], self.starts, self.ends, other.starts, other.ends)))
+        inside = op(self._contains(bounds[:-1]), other._contains(bounds[:-1]))
+        # merge adjacent intervals that are both inside the result
+        changes = np.diff(np.concatenate(([False], inside, [False])).astype(np.int8))
+        return RLEMask(self.shape, bounds[:-1][changes[:-1] == 1], bounds[1:][changes[1:] == -1])
+
+    def _contains(self, indices):
+        """ whether each of the (sorted) flat indices lies within a run """
+        return np.searchsorted(self.starts, indices, 'right') > np.searchsorted(self.ends, indices, 'right')
+
+    def __or__(self, other):
+        return self._combine(other, np.logical_or)
+
+    def __and__(self, other):
+        return self._combine(other, np.logical_and)
+
+    def __sub__(self, other):
+        return self._combine(other, lambda a, b: a & ~b)
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, RLEMask) and self.shape == other.shape and
+            np.array_equal(self.starts, other.starts) and np.array_equal(self.ends, other.ends)
+        )
+
+    def rows(self):
+        """ split the runs at the end of each row and return the row, start column, and end column of each """
+        width = self.shape[1]
+        first, last = self.starts // width, (self.ends-1) // width
+        count = last-first+1
+        # repeat each run once for each row that it spans
+        run = np.repeat(np.arange(len(self)), count)
+        row = first[run] + np.arange(count.sum()) - np.repeat(np.cumsum(count)-count, count)
+        start = np.maximum(self.starts[run], row*width) - row*width
+        end = np.minimum(self.ends[run], (row+1)*width) - row*width
+        return row, start, end
+
+    def bbox(self):
+        """ get the (top, bottom, left, right) bounds of the True pixels, or None if there aren't any """
+        row, start, end = self.rows()
+        if not len(row):
+            return None
+        return int(row.min()), int(row.max())+1, int(start.min()), int(end.max())
+
+    def label(self, connectivity=8):
+        """
+            find the connected components of the mask, numbering them in the
+            order of their first pixel (like scipy.ndimage.label())
+            return the number of components and the component of each run in rows()
+        """
+        from relabel import UnionFind
+        row, start, end = self.rows()
+        if not len(row):
+            return 0, np.zeros(0, dtype=np.int64)
+        # runs in adjacent rows touch if their columns overlap (or touch diagonally, with 8-connectivity)
+        reach = 1 if connectivity == 8 else 0
+        # make a key that sorts runs by their row and then their columns
+        stride = self.shape[1]+2
+        starts, ends = row*stride+start, row*stride+end
+        below = (row+1)*stride
+        # find the runs in the next row whose end is after our start and whose start is before our end
+        lo = np.searchsorted(ends, below+start-reach, 'right')
+        hi = np.searchsorted(starts, below+end+reach, 'left')
+        count = np.maximum(hi-lo, 0)
+        above = np.repeat(np.arange(len(row)), count)
+        adjacent = np.repeat(lo, count) + np.arange(count.sum()) - np.repeat(np.cumsum(count)-count, count)
+        # the root of each component is its first run, which is also its first pixel
+        sets = UnionFind(len(row))
+        sets.union(above, adjacent)
+        return sets.consecutive(None)
+
+    def to_labels(self, connectivity=8, dtype=np.int32):
+        """
+            label the connected components of the mask in a dense array
+            return the number of labels (including the background) and the array, like cv.connectedComponents()
+        """
+        num, labels = self.label(connectivity)
+        row, start, end = self.rows()
+        width = self.shape[1]
+        # mark the start and end of each run with its label and then fill in between them
+        edges = np.zeros(self.size+1, dtype=np.int64)
+        edges[row*width+start] += labels
+        edges[row*width+end] -= labels
+        return num+1, np.cumsum(edges[:-1]).astype(dtype).reshape(self.shape)
+
+    def centroids(self, connectivity=8):
+        """ get the (row, column) centroid of each connected component, ordered by their labels """
+        num, labels = self.label(connectivity)
+        row, start, end = self.rows()
+        length = end-start
+        area = np.bincount(labels, length, num+1)[1:]
+        # the columns of a run sum to its length times its middle column
+        rows = np.bincount(labels, row*length, num+1)[1:]/area
+        cols = np.bincount(labels, (start+end-1)/2*length, num+1)[1:]/area
+        return np.stack((rows, cols), axis=1)
+
+    def save(self, fname):
+        """ write the mask to an npz file """
+        np.savez_compressed(fname, shape=np.array(self.shape), starts=self.starts, ends=self.ends)
+
+    @classmethod
+    def load(cls, fname):
+        """ read a mask from an npz file written by save() """
+        with np.load(fname) as data:
+            return cls(data['shape'], data['starts'], data['ends'])
+
+
+# the file ending of a bit-packed mask (see save_bits())
+BITS = '.bits.npy'
+
+
+def narrowest_dtype(max_value):
+    """ get the smallest unsigned integer type that can hold max_value """
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if max_value <= np.iinfo(dtype).max:
+            return dtype
+    return np.uint64
+
+def save_labels(labels, fname):
+    """ save a dense array of (nonnegative) labels to an npy file, using the narrowest dtype that fits them """
+    np.save(fname, labels.astype(narrowest_dtype(labels.max() if labels.size else 0), copy=False))
+
+def save_bits(mask, fname):
+    """
+        save a dense mask to an npy file with eight pixels packed into each byte
+        this is 8 times smaller than a bool array and 32 times smaller than int32 labels
+    """
+    np.save(fname, np.packbits(mask != 0, axis=1))
+
+def load_bits(fname, width=None, mmap=True):
+    """
+        load a bit-packed mask written by save_bits() as a bool array
+        provide width to remove the padding at the end of each row (it is a multiple of 8 otherwise)
+        the file is memory-mapped, so that only the rows that are used get read
+    """
+    packed = np.load(fname, mmap_mode='r' if mmap else None)
+    return np.unpackbits(packed, axis=1, count=width).view(bool)
+
+def load(fname, width=None):
+    """
+        load a mask from a file as an RLEMask
+        the file can be an npz (run-length encoded), bits.npy (bit-packed), or npy (dense) file
+    """
+    fname = str(fname)
+    if fname.endswith('.npz'):
+        return RLEMask.load(fname)
+    if fname.endswith(BITS):
+        return RLEMask.from_dense(load_bits(fname, width))
+    return RLEMask.from_dense(np.load(fname))
+
+def save(mask, fname):
+    """ save an RLEMask to an npz (run-length encoded), bits.npy (bit-packed), or npy (dense, labeled) file """
+    fname = str(fname)
+    if fname.endswith('.npz'):
+        mask.save(fname)
+    elif fname.endswith(BITS):
+        save_bits(mask.to_dense(), fname)
+    else:
+        save_labels(mask.to_labels()[1], fname)
+
+if __name__ == '__main__':
+    # if this script is being called but not imported:
+    import argparse
+    parser = argparse.ArgumentParser(description='Convert a mask between the dense (.npy), bit-packed (.bits.npy), and run-length encoded (.npz) formats. Dense masks are written with a label for each connected component.')
+    parser.add_argument(
+        "mask", help="the path to the mask to convert"
+    )
+    parser.add_argument(
+        "out", help="the path to the converted mask; its format is inferred from its file ending"
+    )
+    parser.add_argument(
+        "-w", "--width", type=int, default=None, help="the width of a bit-packed mask; otherwise, it is rounded up to a multiple of 8"
+    )
+    args = parser.parse_args()
+
+    mask = load(args.mask, args.width)
+    save(mask, args.out)
+    print(
+        'converted a', 'x'.join(map(str, mask.shape)), 'mask with', len(mask),
+        'runs covering', mask.area(), 'pixels'
+    )
@@ -31,52 +31,100 @@ parser.add_argument(
 parser.add_argument(
     "-f", "--flip", action='store_true', help="whether to flip the probabilities; only relevant if --ignore-probs is not passed"
 )
+parser.add_argument(
+    "-b", "--bins", type=int, default=None, help="read the table in chunks and count the probabilities in this many bins between 0 and 1 (see --range), instead of reading the whole table into memory; the AUROC and avg precision are then computed from the bins, so probabilities in the same bin are treated as ties (default: read the whole table and compute every metric exactly)"
+)
+parser.add_argument(
+    "--bootstrap", type=int, default=None, help="also output a confidence interval for each metric (in two more columns) from this many bootstrap replicates of the table; this option cannot be used with --bins (default: don't compute confidence intervals)"
+)
+parser.add_argument(
+    "-c", "--confidence", type=float, default=0.95, help="the confidence level of the bootstrap confidence intervals (default: 0.95)"
+)
+parser.add_argument(
+    "-s", "--seed", type=int, default=None, help="the random seed to use for the bootstrap replicates (default: a different seed each time)"
+)
+parser.add_argument(
+    "-j", "--jobs", type=int, default=1, help="the number of processes to use for the bootstrap replicates (default: 1); -1 means one for each core"
+)
+parser.add_argument(
+    "--range", nargs=2, type=float, default=[0, 1], metavar=('LOW', 'HIGH'), help="the lowest and highest possible probabilities, between which the --bins are spread; the scores aren't divided by their maximum like they are without --bins, so it is an error for any of them to be outside of this range (default: 0 1)"
+)
 parser.add_argument(
     "table", nargs="?", default=sys.stdin,
     help="a three column (truth/probs/predicted) table w/o a header"
 )
 args = parser.parse_args()
 
+if args.bootstrap is not None and args.bins is not None:
+    parser.error("The --bootstrap option cannot be used with --bins, since the bootstrap replicates are drawn from the whole table.")
+
 # which cols should we read?
 fields = ['truth', 'probs', 'predict']
 dtypes = {'predict': np.bool_, 'truth': np.bool_, 'probs': np.float_}
 if args.ignore_probs:
     fields = fields[:2]
     dtypes.pop('probs')
-# read the file into a pandas data frame
-df = pd.read_csv(
-    args.table, sep='\t', header=None, names=fields,
-    index_col=False, dtype=dtypes,
-    low_memory=False, na_values='.'
-)
-df.fillna(0, inplace=True)
+if args.bins is not None:
+    # stream the table, keeping only counts in memory
+    import histogram
+    confusion = histogram.ConfusionCounts()
+    hist = histogram.ScoreHistogram(args.bins, *args.range)
+    for chunk in histogram.read_chunks(args.table, fields, dtypes):
+        confusion.add(chunk['truth'], chunk['predict'])
+        if not args.ignore_probs:
+            hist.add(chunk['truth'], chunk['probs'])
+    scores = confusion.scores()
+    if not args.ignore_probs:
+        try:
+            hist.check()
+        except ValueError as error:
+            sys.exit(str(error))
+        if args.flip:
+            print("Inverting predictions.", file=sys.stderr)
+            hist.flip()
+        scores = np.append(scores, [hist.roc_auc(), hist.average_precision()])
+else:
+    # read the file into a pandas data frame
+    df = pd.read_csv(
+        args.table, sep='\t', header=None, names=fields,
+        index_col=False, dtype=dtypes,
+        low_memory=False, na_values='.'
+    )
+    df.fillna(0, inplace=True)
 
-# calculate the metrics
-scores = np.append(
-    sklearn.metrics.precision_recall_fscore_support(
-        df['truth'], df['predict'], beta=1, average='binary'
-    ),
-    sklearn.metrics.confusion_matrix(df['truth'], df['predict']).sum(0)
-)
-# calculate additional metrics if we can
-if not args.ignore_probs:
-    # replace inf values with a number 1 larger than the next largest value
-    if df['probs'].max() == np.float_('inf'):
-        df['probs'] = df['probs'].replace(
-            np.float_('inf'), np.sort(df['probs'].unique())[-2]+1
-        )
-    # turn the scores into probabilities if they're not already
-    probs = df['probs']/df['probs'].max()
-    if args.flip:
-        print("Inverting predictions.", file=sys.stderr)
-        probs = 1-probs
+    # calculate the metrics
     scores = np.append(
-        scores,
-        np.array([
-            sklearn.metrics.roc_auc_score(df['truth'], probs),
-            sklearn.metrics.average_precision_score(df['truth'], probs)
-        ])
+        sklearn.metrics.precision_recall_fscore_support(
+            df['truth'], df['predict'], beta=1, average='binary'
+        ),
+        sklearn.metrics.confusion_matrix(df['truth'], df['predict']).sum(0)
     )
+    # calculate additional metrics if we can
+    if not args.ignore_probs:
+        # replace inf values with a number 1 larger than the next largest value
+        if df['probs'].max() == np.float_('inf'):
+            df['probs'] = df['probs'].replace(
+                np.float_('inf'), np.sort(df['probs'].unique())[-2]+1
+            )
+        # turn the scores into probabilities if they're not already
+        probs = df['probs']/df['probs'].max()
+        if args.flip:
+            print("Inverting predictions.", file=sys.stderr)
+            probs = 1-probs
+        scores = np.append(
+            scores,
+            np.array([
+                sklearn.metrics.roc_auc_score(df['truth'], probs),
+                sklearn.metrics.average_precision_score(df['truth'], probs)
+            ])
+        )
+    if args.bootstrap is not None:
+        import bootstrap
+        replicates = bootstrap.bootstrap(
+            df['truth'], df['predict'], None if args.ignore_probs else probs,
+            args.bootstrap, args.seed, args.jobs
+        )
+        low, high = bootstrap.intervals(replicates, args.confidence)
 
 # which metrics should we return?
 metrics = [
@@ -87,8 +135,10 @@ metrics = [
 
 # format results
 result = scores[metrics]
+if args.bootstrap is not None:
+    result = np.array([result, low[metrics], high[metrics]], dtype=object).T
 if args.names:
     metric_names = [metric_names[metric] for metric in args.metrics.split(",")]
-    result = np.array([metric_names, result]).T
+    result = np.column_stack([metric_names, result])
 
 np.savetxt(args.out, result, delimiter="\t", fmt='%s')
@@ -0,0 +1,19 @@
+#!/usr/bin/env python3
+import os
+
+
+# the trained models that have already been loaded, keyed by their path and modification time
+# a long-lived process (see worker.py) can load a model once and then reuse it for every job
+MODELS = {}
+
+
+def load_model(fname):
+    """
+        load a trained model from a file (created by classify.py's save_model())
+        the model is loaded only once per process, no matter how many times this is called
+    """
+    import joblib
+    key = (os.path.abspath(fname), os.path.getmtime(fname))
+    if key not in MODELS:
+        MODELS[key] = joblib.load(fname)
+    return MODELS[key]
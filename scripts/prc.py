@@ -10,23 +10,6 @@ from sklearn.metrics import auc
 from itertools import product
 
 
-parser = argparse.ArgumentParser()
-parser.add_argument(
-    "out", nargs="?", default=sys.stdout, help="the filename to save the data to"
-)
-known_args, unknown_args = parser.parse_known_args()
-# dynamically parse whatever options the user passes us
-count = 0
-for arg in unknown_args:
-    if arg.startswith('--'):
-        parser.add_argument('--{}'.format(arg[2:]), type=argparse.FileType('r'))
-        count += 1
-if count < 1:
-    parser.error("Specify the path to at least one space separated table (w/o a header) with two rows (recall/precision) using options like --gatk-indel path/to/gatk-table")
-args = parser.parse_args()
-all_args = vars(args)
-
-
 def get_marker():
     """ retrieve a unique marker in a deterministic order """
     yield from product(range(2, 6), range(1, 3), [52])
@@ -46,11 +29,19 @@ for k in list(colors.keys()):
     elif k == 'breakca':
         colors['varca'] = colors[k]
 
-markers = get_marker()
-# go through each table and get its name from all of the args
-for arg in sorted(all_args.keys()):
-    if arg not in known_args:
-        table = np.loadtxt(all_args[arg])
+def plot(tables, out):
+    """
+        plot precision recall curves and points in a single figure
+        tables maps the name of each curve or point to its table (see the
+        command line arguments below): a 2D array of recall (1st row) and
+        precision (2nd row) for a curve, or a 1D array starting with the recall
+        and precision of a point
+    """
+    markers = get_marker()
+    fig = plt.figure()
+    # go through each table
+    for arg in sorted(tables.keys()):
+        table = tables[arg]
         # recall: 1st row, precision: 2nd row
         if table.ndim != 1:
             # area = auc(table[0], table[1])
@@ -82,10 +73,36 @@ for arg in sorted(all_args.keys()):
                 label=arg.replace('breakca', 'varca')+": height={0:0.2f}".format(area), **extra
             )
 
-plt.legend(bbox_to_anchor=(1.02, 1), loc="upper left", fontsize='small')
-plt.xlabel('Recall')
-plt.ylabel('Precision')
-plt.ylim([0.0, 1.0])
-plt.xlim([0.0, 1.0])
-plt.gcf().set_size_inches(5, 5)
-plt.savefig(args.out, bbox_inches='tight', pad_inches=0.1, set_dpi=10)
\ No newline at end of file
+    plt.legend(bbox_to_anchor=(1.02, 1), loc="upper left", fontsize='small')
+    plt.xlabel('Recall')
+    plt.ylabel('Precision')
+    plt.ylim([0.0, 1.0])
+    plt.xlim([0.0, 1.0])
+    fig.set_size_inches(5, 5)
+    plt.savefig(out, bbox_inches='tight', pad_inches=0.1, set_dpi=10)
+    plt.close(fig)
+
+
+if __name__ == '__main__':
+    # if this script is being called but not imported:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "out", nargs="?", default=sys.stdout, help="the filename to save the data to"
+    )
+    known_args, unknown_args = parser.parse_known_args()
+    # dynamically parse whatever options the user passes us
+    count = 0
+    for arg in unknown_args:
+        if arg.startswith('--'):
+            parser.add_argument('--{}'.format(arg[2:]), type=argparse.FileType('r'))
+            count += 1
+    if count < 1:
+        parser.error("Specify the path to at least one space separated table (w/o a header) with two rows (recall/precision) using options like --gatk-indel path/to/gatk-table")
+    args = parser.parse_args()
+    all_args = vars(args)
+
+    # go through each table and get its name from all of the args
+    plot({
+        arg: np.loadtxt(all_args[arg])
+        for arg in all_args if arg not in known_args
+    }, args.out)
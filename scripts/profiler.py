@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+import signal
+from pathlib import Path
+from collections import Counter
+
+
+# how often (in seconds of CPU time) the sampling profiler should take a sample
+INTERVAL = 0.005
+
+
+class Sampler:
+    """
+        a statistical profiler that periodically records the call stack of the
+        main thread, weighted by the CPU time that has elapsed since the last sample
+        the stacks can be written in the "folded" format used by flamegraph.pl
+    """
+
+    def __init__(self, interval=INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.last = None
+
+    def sample(self, signum, frame):
+        """ record the current call stack (this is called by the timer signal) """
+        now = time.process_time()
+        # the signal isn't handled until long-running C code (ex: opencv) returns
+        # so we weight each sample by the CPU time since the last one
+        weight, self.last = now-self.last, now
+        stack = []
+        while frame is not None:
+            stack.append(Path(frame.f_code.co_filename).name+':'+frame.f_code.co_name)
+            frame = frame.f_back
+        self.stacks[';'.join(reversed(stack))] += weight
+
+    def start(self):
+        self.last = time.process_time()
+        signal.signal(signal.SIGPROF, self.sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_IGN)
+
+    def write(self, out):
+        """ write the stacks in folded format, with the weights in milliseconds """
+        with open(out, 'w') as folded:
+            for stack, weight in self.stacks.most_common():
+                if round(weight*1000):
+                    folded.write(stack+' '+str(round(weight*1000))+"\n")
+
+def run(script, script_args, out, mode='cprofile', interval=INTERVAL):
+    """
+        run a python script (as if it had been called from the command line) under a profiler
+        the profile is written to a file named by the script and the process ID in the out directory:
+        a .prof file for cProfile or a .folded file for the sampling profiler
+    """
+    import runpy
+    out = Path(out)
+    out.mkdir(parents=True, exist_ok=True)
+    out = str(out/(Path(script).stem+'.'+str(os.getpid())))
+    # make the script think it was called directly
+    sys.argv = [script] + list(script_args)
+    sys.path[0] = str(Path(script).resolve().parent)
+    if mode == 'cprofile':
+        import cProfile
+        prof = cProfile.Profile()
+        prof.enable()
+    else:
+        prof = Sampler(interval)
+        prof.start()
+    try:
+        runpy.run_path(script, run_name='__main__')
+    finally:
+        # write the profile even if the script exits with an error
+        if mode == 'cprofile':
+            prof.disable()
+            prof.dump_stats(out+'.prof')
+        else:
+            prof.stop()
+            prof.write(out+'.folded')
+
+def profile_files(paths):
+    """ find all of the profiles in paths, which can be files or directories of files """
+    files = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            files.extend(sorted(
+                f for f in path.rglob('*') if f.suffix in ('.prof', '.folded')
+            ))
+        else:
+            files.append(path)
+    return files
+
+def read_folded(files):
+    """
+        aggregate the folded stacks in files
+        return the self and total (ie including callees) weight of each function, in milliseconds
+    """
+    own, total = Counter(), Counter()
+    for fname in files:
+        with open(str(fname)) as folded:
+            for line in folded:
+                stack, weight = line.rsplit(' ', 1)
+                stack = stack.split(';')
+                own[stack[-1]] += int(weight)
+                # count recursive functions only once per stack
+                for func in set(stack):
+                    total[func] += int(weight)
+    return own, total
+
+def summarize(paths, top=20, sort='tottime', out=sys.stdout):
+    """ print the functions that took the most time across all of the profiles in paths """
+    files = profile_files(paths)
+    prof_files = [str(f) for f in files if f.suffix == '.prof']
+    folded_files = [f for f in files if f.suffix == '.folded']
+    if not files:
+        raise Exception('Could not find any .prof or .folded files in '+", ".join(map(str, paths)))
+    if prof_files:
+        import pstats
+        print('cProfile:', len(prof_files), 'profiles', file=out)
+        stats = pstats.Stats(*prof_files, stream=out)
+        stats.sort_stats(sort).print_stats(top)
+    if folded_files:
+        own, total = read_folded(folded_files)
+        print('sampling:', len(folded_files), 'profiles (ms of CPU time)\n', file=out)
+        print('self\ttotal\tfunction', file=out)
+        # sort by the time spent in the function itself, unless asked otherwise
+        ranked = total if sort in ('cumtime', 'cumulative') else own
+        for func, _ in ranked.most_common(top):
+            print(str(own[func])+"\t"+str(total[func])+"\t"+func, file=out)
+
+
+if __name__ == '__main__':
+    # if this script is being called but not imported:
+    import argparse
+    parser = argparse.ArgumentParser(description='Profile a python script or summarize the resulting profiles.')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    run_parser = subparsers.add_parser('run', help='run a python script under a profiler')
+    run_parser.add_argument(
+        "-o", "--out", required=True, help="a directory in which to store the profile; it is named by the script and its process ID, so many jobs can share a directory"
+    )
+    run_parser.add_argument(
+        "-m", "--mode", choices=['cprofile', 'sampling'], default='cprofile', help="cprofile records every function call in a .prof file, while sampling periodically records the call stack in a .folded file that can be passed to flamegraph.pl (default: cprofile)"
+    )
+    run_parser.add_argument(
+        "-i", "--interval", type=float, default=INTERVAL, help="how often (in seconds of CPU time) to sample the call stack in sampling mode (default: "+str(INTERVAL)+")"
+    )
+    run_parser.add_argument(
+        "script", help="the path to the python script to profile"
+    )
+    run_parser.add_argument(
+        "args", nargs=argparse.REMAINDER, help="the arguments to the script"
+    )
+    summarize_parser = subparsers.add_parser('summarize', help='list the functions that took the most time across many profiles')
+    summarize_parser.add_argument(
+        "profiles", nargs='+', help="the paths to .prof or .folded files (or directories containing them)"
+    )
+    summarize_parser.add_argument(
+        "-n", "--top", type=int, default=20, help="the number of functions to list (default: 20)"
+    )
+    summarize_parser.add_argument(
+        "-s", "--sort", default='tottime', help="how to sort the functions: tottime (the time spent in the function itself) or cumtime (including the functions it calls), or any other pstats sort key (default: tottime)"
+    )
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        run(args.script, args.args, args.out, args.mode, args.interval)
+    else:
+        summarize(args.profiles, args.top, args.sort)
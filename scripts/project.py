@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+import os
+
+
+# the metashape documents that have already been opened, keyed by their path
+# a long-lived process (see worker.py) can open a project once and then reuse it for every job
+DOCUMENTS = {}
+
+
+def load_chunk(project_file):
+    """
+        open a metashape project file (read only) and return the chunk that contains the orthomosaic
+        the document is opened only once per process, no matter how many times this is called
+    """
+    import Metashape
+    project_file = os.path.abspath(project_file)
+    if project_file not in DOCUMENTS:
+        doc = Metashape.Document()
+        doc.open(project_file, read_only=True)
+        DOCUMENTS[project_file] = doc
+    # find the correct chunk
+    for chunk in DOCUMENTS[project_file].chunks:
+        # ie the one with the orthomosaic in it
+        if chunk.orthomosaic is not None:
+            return chunk
+    raise Exception('The project file "'+project_file+'" does not have an orthomosaic.')
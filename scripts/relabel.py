@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+import numpy as np
+
+
+class UnionFind:
+    """
+        a disjoint set forest over the labels 0 to len-1, with the parent of each label stored in an array
+        the root of each set is its smallest label, and labels can be added as
+        they are needed (ex: as each tile of an image is labeled)
+        all of the operations work on arrays of labels at once
+    """
+
+    def __init__(self, size=1):
+        self.size = size
+        self.parent = np.arange(max(size, 1), dtype=np.int64)
+
+    def __len__(self):
+        return self.size
+
+    def add(self, count):
+        """ add count new labels, each in its own set, and return the first of them """
+        start = self.size
+        self.size += count
+        if self.size > len(self.parent):
+            # grow the array geometrically, so that adding many small batches stays cheap
+            parent = np.arange(max(self.size, 2*len(self.parent)), dtype=np.int64)
+            parent[:start] = self.parent[:start]
+            self.parent = parent
+        return start
+
+    def compress(self):
+        """ point every label directly at the root of its set """
+        parent = self.parent[:self.size]
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                break
+            parent = grandparent
+        self.parent[:self.size] = parent
+
+    def find(self, labels):
+        """ get the root of each label """
+        labels = np.asarray(labels, dtype=np.int64)
+        if 8*labels.size >= self.size:
+            # when there are many labels, it's cheaper to flatten every path at once
+            self.compress()
+            return self.parent[labels]
+        roots = self.parent[labels]
+        while True:
+            parents = self.parent[roots]
+            if np.array_equal(parents, roots):
+                break
+            roots = parents
+        # point the labels directly at their roots, so that they're found faster next time
+        self.parent[labels] = roots
+        return roots
+
+    def union(self, a, b):
+        """ merge the sets containing each pair of labels in the arrays a and b """
+        a = np.asarray(a, dtype=np.int64).ravel()
+        b = np.asarray(b, dtype=np.int64).ravel()
+        while len(a):
+            root_a, root_b = self.find(a), self.find(b)
+            differ = root_a != root_b
+            a, b, root_a, root_b = a[differ], b[differ], root_a[differ], root_b[differ]
+            # point the larger root of each pair at the smaller one
+            # if a root is in many pairs, it gets the smallest of them, and the rest are merged in the next round
+            np.minimum.at(self.parent, np.maximum(root_a, root_b), np.minimum(root_a, root_b))
+
+    def roots(self):
+        """ get the root of every label """
+        return self.find(np.arange(self.size))
+
+    def consecutive(self, background=0):
+        """
+            number the sets consecutively (starting at 1) in the order of their smallest labels
+            the set containing the background label is numbered 0 (pass None if there is no background)
+            return the number of sets (excluding the background) and an array mapping each label to its set's number
+        """
+        roots = self.roots()
+        present = np.unique(roots)
+        if background is not None:
+            present = present[present != roots[background]]
+        lookup = np.zeros(self.size, dtype=np.int64)
+        lookup[present] = np.arange(1, len(present)+1)
+        return len(present), lookup[roots]
+
+
+class TileLabeler:
+    """
+        label the connected components of a mask that is too large to label at once, one tile at a time
+        add() each tile (in any order) to get its provisional labels, and then
+        use finish() to map the provisional labels to the final, consecutive ones
+        only the labels along the edges of each tile are kept, so the memory
+        used is proportional to the total length of the edges of the tiles
+    """
+
+    def __init__(self, connectivity=8):
+        self.connectivity = connectivity
+        # the provisional labels (0 is the background)
+        self.sets = UnionFind()
+        # the labels along each side of the tiles we have seen, keyed by the
+        # row (for the top and bottom sides) or column (for the left and right
+        # sides) that they're in
+        self.edges = {'top': {}, 'bottom': {}, 'left': {}, 'right': {}}
+
+    def add(self, top, left, mask):
+        """
+            label a tile of the mask, whose top left corner is at (top, left)
+            return the provisional labels of the tile
+        """
+        import cv2 as cv
+        ret, labels = cv.connectedComponents(np.uint8(mask != 0), connectivity=self.connectivity)
+        offset = self.sets.add(ret-1)
+        labels = np.where(labels > 0, labels.astype(np.int64)+offset-1, 0)
+        bottom, right = top+labels.shape[0]-1, left+labels.shape[1]-1
+        edges = {
+            'top': (top, left, labels[0]), 'bottom': (bottom, left, labels[-1]),
+            'left': (left, top, labels[:, 0]), 'right': (right, top, labels[:, -1])
+        }
+        # merge our labels with those of the neighboring tiles that we've already seen
+        for side, other, step in (
+            ('top', 'bottom', -1), ('bottom', 'top', 1), ('left', 'right', -1), ('right', 'left', 1)
+        ):
+            line, start, values = edges[side]
+            for other_start, other_values in self.edges[other].get(line+step, []):
+                self.merge(start, values, other_start, other_values)
+            self.edges[side].setdefault(line, []).append((start, values))
+        return labels
+
+    def merge(self, start, values, other_start, other_values):
+        """ merge the labels along two adjacent, parallel edges of tiles, which start at different positions """
+        # with 8-connectivity, pixels also touch the diagonal neighbors on the other edge
+        reach = 1 if self.connectivity == 8 else 0
+        if other_start > start+len(values)+reach-1 or start > other_start+len(other_values)+reach-1:
+            # the edges don't touch
+            return
+        for shift in range(-reach, reach+1):
+            # pixel i of values touches pixel j of other_values
+            i = np.arange(len(values))
+            j = i+start+shift-other_start
+            inside = (j >= 0) & (j < len(other_values))
+            a, b = values[i[inside]], other_values[j[inside]]
+            both = (a > 0) & (b > 0)
+            self.sets.union(a[both], b[both])
+
+    def finish(self):
+        """
+            return the number of connected components and an array mapping each
+            provisional label to its final label (numbered in the order that the
+            components were first seen)
+        """
+        return self.sets.consecutive()
+
+
+def label(mask, tile=4096, connectivity=8, out=None):
+    """
+        label the connected components of a large 2D mask (ex: a memory-mapped
+        array) one tile at a time, so that only a few tiles are in memory at once
+        the labels are written to out (ex: a memory-mapped array from
+        np.lib.format.open_memmap()), or a new int32 array if out isn't provided
+        return the number of labels (including the background) and out, like cv.connectedComponents()
+    """
+    if out is None:
+        out = np.zeros(mask.shape[:2], dtype=np.int32)
+    labeler = TileLabeler(connectivity)
+    regions = [
+        (slice(top, top+tile), slice(left, left+tile))
+        for top in range(0, mask.shape[0], tile) for left in range(0, mask.shape[1], tile)
+    ]
+    for region in regions:
+        out[region] = labeler.add(region[0].start, region[1].start, np.asarray(mask[region]))
+    num, lookup = labeler.finish()
+    # now, replace the provisional labels with the final ones
+    for region in regions:
+        out[region] = lookup[out[region]]
+    return num+1, out
@@ -16,10 +16,15 @@ parser.add_argument(
 parser.add_argument(
     "--images", default="", help="a path to the directory in which the original drone images are stored; this argument must be provided if you plan to open the segment files in labelme"
 )
+parser.add_argument(
+    "--precision", type=int, default=None, help="the number of decimal places to which to round the coordinates in the out file; fewer decimal places make for smaller files (default: don't round the coordinates)"
+)
 args = parser.parse_args()
 args.out += '/' if not args.out.endswith('/') else ''
 
 import Metashape
+import project
+import instrument
 import numpy as np
 
 
@@ -75,15 +80,10 @@ def rev_transform(chunk, points):
     return results
 
 
-# open the metashape document
-doc = Metashape.Document()
-doc.open(args.project_file, read_only=True)
-
-# find the correct chunk
-for chunk in doc.chunks:
-    # ie the one with the orthomosaic in it
-    if chunk.orthomosaic is not None:
-        break
+# open the metashape document and find the chunk with the orthomosaic in it
+# (this is instantaneous if a worker has already opened the project; see worker.py)
+with instrument.timer('open_project'):
+    chunk = project.load_chunk(args.project_file)
 
 # create the dir if it doesn't already exist
 Path(args.out).mkdir(exist_ok=True)
@@ -96,12 +96,27 @@ if args.segments.endswith('.json'):
     # prepare a dict of results, containing an array of segments for each camera
     results = {camera.label:[] for camera in chunk.cameras}
     # convert each segment to coords in the cameras it belongs in
-    for label in segments:
-        segs = rev_transform(chunk, segments[label])
-        for cam in segs:
-            results[cam].append((label, segs[cam]))
-    for camera in results:
-        import_labelme.write(args.out+camera+'.json', results[camera], args.images+camera+".JPG")
+    with instrument.timer('rev_transform'):
+        for label in segments:
+            segs = rev_transform(chunk, segments[label])
+            # count the segments that don't appear in any of the cameras
+            if not segs:
+                instrument.count('skipped_segments')
+            for cam in segs:
+                results[cam].append((label, segs[cam]))
+    instrument.count('segments', len(segments))
+    with instrument.timer('write'):
+        for camera in results:
+            import_labelme.write(args.out+camera+'.json', results[camera], args.images+camera+".JPG", args.precision)
+    # also write an index of the cameras that each segment appears in, so
+    # that they can be looked up without reading every camera's segments
+    with instrument.timer('index'):
+        import segment_index
+        dims = {camera.label: (camera.sensor.width, camera.sensor.height) for camera in chunk.cameras}
+        segment_index.write(args.out+segment_index.INDEX_FILE, (
+            (label, camera, segment_index.area(pts), segment_index.visible_area(pts, dims[camera]))
+            for camera in results for label, pts in results[camera]
+        ))
 # # else its a np mask
 # elif args.segments.endswith('.npy'):
 #     segments = np.load(args.segments)
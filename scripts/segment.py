@@ -16,7 +16,7 @@ parser.add_argument(
     "image", help="a path to the image to segment"
 )
 parser.add_argument(
-    "out_high", help="the path to a file in which to store the coordinates of each extracted high confidence object"
+    "out_high", help="the path to a file in which to store the coordinates of each extracted high confidence object; .json files contain a polygon for each object, .npy files a dense array of labels, .bits.npy files a bit-packed mask, and .npz files a compact, run-length encoded mask"
 )
 parser.add_argument(
     "out_low", help="the path to a file in which to store the coordinates of each extracted low confidence object"
@@ -27,19 +27,71 @@ parser.add_argument(
         The path to an npy file containing the texture of the image if already calculated.
         (Providing this option can speed up repeated executions of this script on the same input.)
         If this file does not exist, it will be created when the texture is calculated.
+        The cache is only used at full resolution (ie when --level is 0).
     """
 )
+parser.add_argument(
+    "-l", "--level", type=int, default=0, help=
+    """
+        Segment a downsampled copy of the image at this level of its image
+        pyramid (each level halves the width and height), with the kernel sizes
+        in PARAMS scaled to match. This is much faster and useful for tuning
+        PARAMS. The masks are upsampled back to the size of the image before
+        they are written. (default: 0, ie full resolution)
+    """
+)
+parser.add_argument(
+    "--compare", type=int, default=None, metavar="SIZE", help=
+    """
+        Also segment a randomly sampled SIZE x SIZE pixel region of the image
+        at full resolution and report how well the masks agree. Requires a
+        nonzero --level.
+    """
+)
+parser.add_argument(
+    "--refine", action='store_true', help=
+    """
+        Re-segment the regions along the boundaries of the masks at full
+        resolution, so that only the edges of each segment pay for full
+        resolution processing. Requires a nonzero --level. Each refined block is padded by the reach of
+        the kernels in PARAMS, so this only saves time when the segments are sparse.
+    """
+)
+parser.add_argument(
+    "--sweep", default=None, help=
+    """
+        The path to a TSV in which to store the results of a parameter sweep.
+        Every combination of the settings in SWEEP is evaluated (in parallel),
+        but the texture and the smoothed values (which only depend on the
+        settings that come before thresholding) are calculated only once. If
+        --truth is provided, each combination is scored against it and the
+        masks are written using the best one.
+    """
+)
+parser.add_argument(
+    "--truth", default=None, help="the path to a labelme JSON file of truth polygons with which to score each combination of settings in --sweep"
+)
+parser.add_argument(
+    "-j", "--jobs", type=int, default=1, help="the number of cores to use for --sweep (default: 1); -1 means all of them"
+)
 args = parser.parse_args()
+if args.truth is not None and args.sweep is None:
+    parser.error('The --truth option requires --sweep.')
+if (args.refine or args.compare is not None) and not args.level:
+    parser.error('The --refine and --compare options require a nonzero --level.')
 if not (
-    (args.out_high.endswith('.json') or args.out_high.endswith('.npy')) and
-    (args.out_low.endswith('.json') or args.out_low.endswith('.npy'))
+    args.out_high.endswith(('.json', '.npy', '.npz')) and
+    args.out_low.endswith(('.json', '.npy', '.npz'))
 ):
-    parser.error('Unsupported output file type. The files must have a .json or .npy ending.')
+    parser.error('Unsupported output file type. The files must have a .json, .npy, or .npz ending.')
 
+import json
 import features
+import itertools
 import cv2 as cv
 import numpy as np
 import scipy.ndimage
+import instrument
 
 # # uncomment this stuff for testing
 # from test_util import *
@@ -48,6 +100,16 @@ import scipy.ndimage
 
 
 # CONSTANTS
+# the width and height of the blocks that --refine re-segments at full resolution
+REFINE_BLOCK = 512
+# the settings that --sweep tries, by their dotted names in PARAMS
+# every combination is evaluated, except those with a low threshold above the high one
+SWEEP = {
+    'threshold.high': [0.50, 0.53, 0.56],
+    'threshold.low': [0.43, 0.46, 0.49],
+    'morho.high.opening': [15, 19, 23],
+    'morho.low.opening': [7, 11, 15]
+}
 PARAMS = {
     'texture': {
         'window_radius': 2,
@@ -111,18 +173,395 @@ def sliding_window(img, fnctn, size, num_features=1, skip=0):
 
 def green_contrast(
     green, contrast, green_weight=PARAMS['combine']['green_weight'],
-    contrast_weight=PARAMS['combine']['contrast_weight']
+    contrast_weight=PARAMS['combine']['contrast_weight'], maxima=None
 ):
-    """ take a weighted average of the green and contrast values for each pixel """
+    """
+        take a weighted average of the green and contrast values for each pixel
+        provide maxima (the max green and contrast values) to normalize by
+        something other than the max of these values (ex: when segmenting only
+        part of an image)
+    """
     # normalize the weights, just in case they don't already add to 1
     total = green_weight + contrast_weight
     green_weight /= total
     contrast_weight /= total
     # normalize the green and contrast values
-    green = green / np.max(green)
-    contrast = contrast / np.max(contrast)
+    if maxima is None:
+        maxima = (np.max(green), np.max(contrast))
+    green = green / maxima[0]
+    contrast = contrast / maxima[1]
     return ((1-green)*green_weight) + (contrast*contrast_weight)
 
+def odd(size):
+    """ round a kernel size to the nearest odd integer that is at least 1 """
+    return max(1, int(round((size-1)/2))*2+1)
+
+def scale_params(params, scale):
+    """
+        scale the kernel sizes in params (and the number of morphological
+        iterations) so that segmenting an image resized by scale gives roughly
+        the same result as segmenting the original image with params
+    """
+    import copy
+    params = copy.deepcopy(params)
+    if scale == 1:
+        return params
+    # the texture needs a window of at least 5x5 pixels to have any contrast (see features.glcm())
+    params['texture']['window_radius'] = max(2, round(params['texture']['window_radius']*scale))
+    # the texture is calculated once every inverse_resolution pixels and dominates the runtime
+    # scaling the skip by sqrt(scale) (instead of scale) calculates fewer windows at lower levels
+    # ex: at level 2, 1/4 as many windows as the full image, for a similar segmentation
+    params['texture']['inverse_resolution'] = max(1, round(params['texture']['inverse_resolution']*scale**0.5))
+    params['blur']['green_kernel_size'] = odd(max(3, params['blur']['green_kernel_size']*scale))
+    params['blur']['green_strength'] *= scale
+    params['blur']['contrast_kernel_size'] = max(1, round(params['blur']['contrast_kernel_size']*scale))
+    for window in ('templateWindowSize', 'searchWindowSize'):
+        params['noise_removal'][window] = odd(max(3, params['noise_removal'][window]*scale))
+    params['morho']['big_kernel_size'] = max(1, round(params['morho']['big_kernel_size']*scale))
+    # the small kernel is applied many times, so we scale the number of iterations
+    # instead, keeping how far each operation reaches (ie (size-1)*iterations) proportional
+    old = params['morho']['small_kernel_size']
+    new = max(3, odd(old*scale))
+    params['morho']['small_kernel_size'] = new
+    for confidence in ('high', 'low'):
+        for op in params['morho'][confidence]:
+            params['morho'][confidence][op] = max(
+                1, round(params['morho'][confidence][op]*(old-1)*scale/(new-1))
+            )
+    return params
+
+def reach(params):
+    """
+        roughly how far (in pixels) the operations in segment() reach, so that a
+        region of an image can be segmented the same as the whole image if it is
+        padded by this much
+    """
+    morpho = params['morho']
+    return (
+        params['texture']['window_radius'] + params['texture']['inverse_resolution'] +
+        params['blur']['contrast_kernel_size'] + params['noise_removal']['searchWindowSize'] +
+        morpho['big_kernel_size'] + (morpho['small_kernel_size']//2)*max(
+            sum(morpho['high'].values()), sum(morpho['low'].values())
+        )
+    )
+
+def calc_texture(gray, params=PARAMS):
+    """ calculate the texture of each pixel in a grayscale image """
+    return sliding_window(gray, features.glcm, *tuple([params['texture'][i] for i in ['window_radius', 'num_features', 'inverse_resolution']]))
+
+def smooth(img, texture, params=PARAMS, maxima=None, verbose=False):
+    """
+        combine the green and contrast values of each pixel and remove noise
+        return the combined values and the maxima used to normalize them
+    """
+    # blur image to remove noise from grass
+    if verbose:
+        print('blurring image to remove noise in the green and contrast values')
+    with instrument.timer('blur'):
+        blur_green = cv.GaussianBlur(img, (params['blur']['green_kernel_size'],)*2, params['blur']['green_strength'])
+        blur_contrast = cv.blur(texture[:,:,0], (params['blur']['contrast_kernel_size'],)*2)
+    if maxima is None:
+        maxima = (np.max(blur_green[:,:,1]), np.max(blur_contrast))
+
+    if verbose:
+        print('combining green and contrast values and removing more noise')
+    with instrument.timer('combine'):
+        combined = np.uint8(green_contrast(
+            blur_green[:,:,1], blur_contrast, params['combine']['green_weight'],
+            params['combine']['contrast_weight'], maxima
+        ) * 255)
+    with instrument.timer('denoise'):
+        combined = cv.fastNlMeansDenoising(
+            combined, None, params['noise_removal']['strength'],
+            params['noise_removal']['templateWindowSize'], params['noise_removal']['searchWindowSize']
+        )
+
+    if verbose:
+        print('performing greyscale morphological closing')
+    with instrument.timer('grey_closing'):
+        combined = scipy.ndimage.grey_closing(combined, size=(params['morho']['big_kernel_size'],)*2)
+    return combined, maxima
+
+def threshold(combined, params=PARAMS):
+    """ threshold the combined values to create the high and low confidence regions """
+    with instrument.timer('threshold'):
+        thresh_high = (combined > (params['threshold']['high'] * 255)) * np.uint8(255)
+        # use a lower threshold to create the low confidence regions, so that they are larger
+        thresh_low = (combined > (params['threshold']['low'] * 255)) * np.uint8(255)
+    return thresh_high, thresh_low
+
+def morphology(thresh_high, thresh_low, params=PARAMS):
+    """ remove noise from the thresholded regions, returning the high and low confidence masks """
+    with instrument.timer('morphology'):
+        # first, create the kernels we use in the morpho operations
+        small_kernel = np.ones((params['morho']['small_kernel_size'],)*2, np.uint8)
+        big_kernel = np.ones((params['morho']['big_kernel_size'],)*2, np.uint8)
+        # Now, we do morpho operations and hole filling to get the high confidence regions:
+        # 1) use the fill_holes method to boost background pixels that are surrounded by foreground
+        filled = scipy.ndimage.binary_fill_holes(thresh_high) * np.uint8(255)
+        # 2) use closing to boost the size of the regions even more before step 4
+        closing_high = cv.morphologyEx(
+            filled, cv.MORPH_CLOSE, small_kernel, iterations = params['morho']['high']['closing']
+        )
+        # 3) use fill_holes one more time, just in case there's anything else that needs filling
+        filled1 = scipy.ndimage.binary_fill_holes(closing_high) * np.uint8(255)
+        # 4) use a lot of morphological opening to keep only the regions that we are highly confident contain plants
+        high = cv.morphologyEx(
+            filled1, cv.MORPH_OPEN, small_kernel, iterations = params['morho']['high']['opening']
+        )
+        # Now, we do morpho operations to get the low confidence regions:
+        # 1) use closing to boost the size of some of the plants that have a lot of foreground mixed in
+        closing_low = cv.morphologyEx(
+            thresh_low, cv.MORPH_CLOSE, small_kernel, iterations = params['morho']['low']['closing']
+        )
+        # 2) use opening to get rid of the noise
+        opening_low = cv.morphologyEx(
+            closing_low, cv.MORPH_OPEN, small_kernel, iterations = params['morho']['low']['opening']
+        )
+        # 3) use closing again to mostly undo the effects of the opening from before and create low-confidence regions
+        low = cv.morphologyEx(
+            opening_low, cv.MORPH_CLOSE, small_kernel, iterations = params['morho']['low']['closing2']
+        )
+
+    # # uncomment this stuff for testing
+    # plot_img(([
+    #     img, thresh_high, closing_high, high,
+    #     low, thresh_low, closing_low, opening_low
+    # ], 2, 4), close=True)
+    return high, low
+
+def segment(img, params=PARAMS, texture=None, maxima=None, verbose=False):
+    """
+        segment an image into high and low confidence masks
+        provide texture if it has already been calculated and maxima to
+        normalize the green and contrast values (see green_contrast())
+        return the high and low masks, the texture, and the maxima
+    """
+    if texture is None:
+        if verbose:
+            print('calculating texture (this may take a while)')
+        with instrument.timer('texture'):
+            texture = calc_texture(cv.cvtColor(img, cv.COLOR_BGR2GRAY), params)
+    combined, maxima = smooth(img, texture, params, maxima, verbose)
+    if verbose:
+        print('thresholding')
+    thresh_high, thresh_low = threshold(combined, params)
+    # noise removal
+    if verbose:
+        print('performing morphological operations and hole filling')
+    high, low = morphology(thresh_high, thresh_low, params)
+    return high, low, texture, maxima
+
+def downsample(img, level):
+    """
+        get the image at a level of its pyramid (each level halves the width and height)
+        we subsample the pixels instead of blurring them (as cv.pyrDown() would),
+        since blurring would smooth away the texture that the segmentation relies on
+    """
+    return img[::2**level, ::2**level]
+
+def upsample(mask, shape):
+    """ resize a mask to shape (height, width) """
+    return cv.resize(mask, shape[1::-1], interpolation=cv.INTER_NEAREST)
+
+def segment_region(img, region, params=PARAMS, maxima=None):
+    """
+        segment a region (a tuple of slices) of an image at full resolution
+        the region is padded (see reach()) so that it is segmented roughly the same as it would be within the whole image
+    """
+    pad = reach(params)
+    padded = tuple(
+        slice(max(0, region[i].start-pad), min(img.shape[i], region[i].stop+pad))
+        for i in range(2)
+    )
+    high, low = segment(img[padded], params, maxima=maxima)[:2]
+    # now, remove the padding
+    inner = tuple(
+        slice(region[i].start-padded[i].start, region[i].stop-padded[i].start)
+        for i in range(2)
+    )
+    return high[inner], low[inner]
+
+def boundaries(mask, width):
+    """ get a boolean mask of the pixels within width pixels of the boundary of each region in mask """
+    kernel = np.ones((2*width+1,)*2, np.uint8)
+    return cv.dilate(mask, kernel) != cv.erode(mask, kernel)
+
+def refine(img, high, low, width, params=PARAMS, maxima=None, block=REFINE_BLOCK):
+    """
+        re-segment the pixels along the boundaries of the high and low masks at full resolution
+        the image is split into square blocks, and only the blocks that contain a boundary are processed
+    """
+    band = boundaries(high, width) | boundaries(low, width)
+    for y in range(0, img.shape[0], block):
+        for x in range(0, img.shape[1], block):
+            region = (slice(y, min(y+block, img.shape[0])), slice(x, min(x+block, img.shape[1])))
+            if not band[region].any():
+                continue
+            instrument.count('refined_blocks')
+            new_high, new_low = segment_region(img, region, params, maxima)
+            high[region][band[region]] = new_high[band[region]]
+            low[region][band[region]] = new_low[band[region]]
+    return high, low
+
+def iou(mask, other):
+    """ the intersection over union of two masks """
+    mask, other = mask != 0, other != 0
+    union = np.count_nonzero(mask | other)
+    return np.count_nonzero(mask & other)/union if union else 1.0
+
+def compare(img, high, low, size, params=PARAMS, maxima=None, rng=None):
+    """
+        segment a randomly sampled region of the image at full resolution and
+        compare it to the high and low masks within that region
+        return the IoU of the high masks and the IoU of the low masks
+        the region is sampled with rng (default: a new generator seeded with 0,
+        so that every call samples the same region)
+    """
+    if rng is None:
+        rng = np.random.default_rng(0)
+    size = [min(size, s) for s in img.shape[:2]]
+    start = [int(rng.integers(0, img.shape[i]-size[i]+1)) for i in range(2)]
+    region = tuple(slice(start[i], start[i]+size[i]) for i in range(2))
+    full_high, full_low = segment_region(img, region, params, maxima)
+    return iou(high[region], full_high), iou(low[region], full_low)
+
+def set_param(params, name, value):
+    """ set a setting in params by its dotted name (ex: 'threshold.high') """
+    keys = name.split('.')
+    for key in keys[:-1]:
+        params = params[key]
+    params[keys[-1]] = value
+
+def apply_config(config, params=PARAMS):
+    """ get a copy of params with the settings in config """
+    import copy
+    params = copy.deepcopy(params)
+    for name, value in config.items():
+        set_param(params, name, value)
+    return params
+
+def sweep_configs(grid=SWEEP):
+    """ get every valid combination of the settings in grid """
+    configs = [dict(zip(grid.keys(), values)) for values in itertools.product(*grid.values())]
+    thresholds = [apply_config(config)['threshold'] for config in configs]
+    return [
+        config for config, limits in zip(configs, thresholds)
+        if limits['low'] <= limits['high']
+    ]
+
+def upstream_keys(params):
+    """
+        get keys that identify the settings on which the texture and the
+        smoothed values (see smooth()) depend, respectively
+    """
+    texture = json.dumps(params['texture'], sort_keys=True)
+    smoothed = json.dumps([
+        params['texture'], params['blur'], params['combine'],
+        params['noise_removal'], params['morho']['big_kernel_size']
+    ], sort_keys=True)
+    return texture, smoothed
+
+def load_truth(truth, shape):
+    """ draw the polygons in a labelme JSON file onto a mask with the provided shape """
+    import import_labelme
+    mask = np.zeros(shape[:2], np.uint8)
+    polygons = [np.int32(np.round(pts)) for pts in import_labelme.main(truth)]
+    cv.fillPoly(mask, polygons, 255)
+    return mask
+
+def score(mask, truth):
+    """ the precision, recall, and IoU of the pixels in a mask, compared to a truth mask """
+    mask, truth = mask != 0, truth != 0
+    overlap = np.count_nonzero(mask & truth)
+    predicted, actual = np.count_nonzero(mask), np.count_nonzero(truth)
+    return {
+        'precision': overlap/predicted if predicted else 0.0,
+        'recall': overlap/actual if actual else 0.0,
+        'iou': iou(mask, truth)
+    }
+
+# the intermediates that each process of a sweep shares (see init_sweep())
+SWEEP_DATA = {}
+
+def init_sweep(smoothed, shape, truth):
+    """ store the smoothed values of each group of settings, so that evaluate() can use them """
+    SWEEP_DATA['smoothed'], SWEEP_DATA['shape'], SWEEP_DATA['truth'] = smoothed, shape, truth
+
+def evaluate(item):
+    """
+        threshold the smoothed values and perform the morphological operations using params
+        return the config and a dict describing the resulting masks (and their scores, if there is a truth mask)
+    """
+    import time
+    config, params = item
+    start = time.perf_counter()
+    combined = SWEEP_DATA['smoothed'][upstream_keys(params)[1]]
+    high, low = morphology(*threshold(combined, params), params)
+    result = dict(config)
+    for name, mask in (('high', high), ('low', low)):
+        result[name+'_segments'] = cv.connectedComponents(mask)[0]-1
+        if SWEEP_DATA['truth'] is not None:
+            mask = upsample(mask, SWEEP_DATA['shape'])
+            for metric, value in score(mask, SWEEP_DATA['truth']).items():
+                result[name+'_'+metric] = value
+    result['seconds'] = time.perf_counter()-start
+    return config, result
+
+def sweep(img, shape, configs, scale=1, truth=None, jobs=1, texture=None):
+    """
+        evaluate each config on img (which may be a downsampled copy of an image with the provided shape)
+        the texture and smoothed values are calculated only once for every
+        config that shares the settings they depend on, and then the
+        thresholding and morphological operations are run in parallel
+        provide texture if it has already been calculated using the default PARAMS
+        return a table with the results for each config (the best first, if there
+        is a truth mask) and the texture calculated for each group of settings
+    """
+    import os
+    import pandas as pd
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    items = [(config, scale_params(apply_config(config), scale)) for config in configs]
+    textures, smoothed = {}, {}
+    if texture is not None:
+        textures[upstream_keys(scale_params(PARAMS, scale))[0]] = texture
+    gray = None
+    for config, params in items:
+        texture_key, smoothed_key = upstream_keys(params)
+        if smoothed_key in smoothed:
+            continue
+        if texture_key not in textures:
+            print('calculating texture (this may take a while)')
+            if gray is None:
+                gray = cv.cvtColor(img, cv.COLOR_BGR2GRAY)
+            with instrument.timer('texture'):
+                textures[texture_key] = calc_texture(gray, params)
+        smoothed[smoothed_key] = smooth(img, textures[texture_key], params, verbose=True)[0]
+    instrument.count('smoothed', len(smoothed))
+    print('evaluating', len(items), 'configs with', len(smoothed), 'sets of smoothed values')
+    results = []
+    # fork the processes, so that they inherit the intermediates instead of copying them
+    with ProcessPoolExecutor(
+        jobs if jobs > 0 else os.cpu_count(), multiprocessing.get_context('fork'),
+        initializer=init_sweep, initargs=(smoothed, shape, truth)
+    ) as pool:
+        for config, result in pool.map(evaluate, items):
+            print(
+                ", ".join(name+"="+str(value) for name, value in config.items())+":",
+                ", ".join(
+                    name+"="+str(round(result[name], 4))
+                    for name in ('high_iou', 'low_iou') if name in result
+                ) or str(result['low_segments'])+" low segments",
+                "("+str(round(result['seconds'], 2))+"s)"
+            )
+            results.append(result)
+    results = pd.DataFrame(results)
+    if truth is not None:
+        # the sort is stable, so ties go to the first config
+        results = results.sort_values('low_iou', ascending=False, kind='stable')
+    return results, textures
+
 def largest_polygon(polygons):
     """ get the largest polygon among the polygons """
     # we should probably use a complicated formula to do this
@@ -132,96 +571,100 @@ def largest_polygon(polygons):
 
 def export_results(mask, out):
     """ write the resulting mask to a file """
+    if out.endswith('.npz'):
+        # a run-length encoded mask is much smaller than the dense one in an .npy file
+        import masks
+        mask = masks.RLEMask.from_dense(mask)
+        mask.save(out)
+        instrument.count('segments', mask.label()[0])
+        return
     ret, markers = cv.connectedComponents(mask.astype(np.uint8))
     # should we save the segments as a mask or as bounding boxes?
     if out.endswith('.npy'):
-        np.save(out, markers)
+        import masks
+        if out.endswith(masks.BITS):
+            # only store which pixels belong to a segment, with eight pixels in each byte
+            masks.save_bits(markers, out)
+        else:
+            # store the labels with the narrowest dtype that fits them, rather than int32
+            masks.save_labels(markers, out)
     elif out.endswith('.json'):
         # import extra required modules
         from imantics import Mask
         import import_labelme
-        segments = [
-            (int(i), largest_polygon(Mask(markers == i).polygons()).tolist())
+        # write each polygon as soon as it is found, straight from its array of points
+        segments = (
+            (int(i), largest_polygon(Mask(markers == i).polygons()))
             for i in range(1, ret)
-        ]
+        )
         import_labelme.write(out, segments, args.image)
     else:
         raise Exception("Unsupported output file format.")
+    instrument.count('segments', ret-1)
 
 print('loading image')
-img = cv.imread(args.image)
+with instrument.timer('load'):
+    img = cv.imread(args.image)
 
-gray = cv.cvtColor(img, cv.COLOR_BGR2GRAY)
-if args.texture_cache is not None and args.texture_cache.exists():
+texture = None
+if args.level == 0 and args.texture_cache is not None and args.texture_cache.exists():
     print('loading texture from cached file')
-    texture = np.load(args.texture_cache)
+    with instrument.timer('texture'):
+        texture = np.load(args.texture_cache)
+
+if args.level:
+    print('downsampling image to level', args.level, 'of its image pyramid')
+    with instrument.timer('downsample'):
+        small = downsample(img, args.level)
 else:
-    print('calculating texture (this may take a while)')
-    texture = sliding_window(gray, features.glcm, *tuple([PARAMS['texture'][i] for i in ['window_radius', 'num_features', 'inverse_resolution']]))
-    if args.texture_cache is not None:
-        args.texture_cache.parents[0].mkdir(parents=True, exist_ok=True)
-        np.save(args.texture_cache, texture)
-
-
-# blur image to remove noise from grass
-print('blurring image to remove noise in the green and contrast values')
-blur_green = cv.GaussianBlur(img, (PARAMS['blur']['green_kernel_size'],)*2, PARAMS['blur']['green_strength'])
-blur_contrast = cv.blur(texture[:,:,0], (PARAMS['blur']['contrast_kernel_size'],)*2)
-
-print('combining green and contrast values and removing more noise')
-combined = np.uint8(green_contrast(blur_green[:,:,1], blur_contrast) * 255)
-combined = cv.fastNlMeansDenoising(
-    combined, None, PARAMS['noise_removal']['strength'],
-    PARAMS['noise_removal']['templateWindowSize'], PARAMS['noise_removal']['searchWindowSize']
-)
+    small = img
+scale = small.shape[0]/img.shape[0]
 
-print('performing greyscale morphological closing')
-combined = scipy.ndimage.grey_closing(combined, size=(PARAMS['morho']['big_kernel_size'],)*2)
-
-print('thresholding')
-thresh_high = (combined > (PARAMS['threshold']['high'] * 255)) * np.uint8(255)
-# use a lower threshold to create the low confidence regions, so that they are larger
-thresh_low = (combined > (PARAMS['threshold']['low'] * 255)) * np.uint8(255)
-
-# noise removal
-print('performing morphological operations and hole filling')
-# first, create the kernels we use in the morpho operations
-small_kernel = np.ones((PARAMS['morho']['small_kernel_size'],)*2, np.uint8)
-big_kernel = np.ones((PARAMS['morho']['big_kernel_size'],)*2, np.uint8)
-# Now, we do morpho operations and hole filling to get the high confidence regions:
-# 1) use the fill_holes method to boost background pixels that are surrounded by foreground
-filled = scipy.ndimage.binary_fill_holes(thresh_high) * np.uint8(255)
-# 2) use closing to boost the size of the regions even more before step 4
-closing_high = cv.morphologyEx(
-    filled, cv.MORPH_CLOSE, small_kernel, iterations = PARAMS['morho']['high']['closing']
-)
-# 3) use fill_holes one more time, just in case there's anything else that needs filling
-filled1 = scipy.ndimage.binary_fill_holes(closing_high) * np.uint8(255)
-# 4) use a lot of morphological opening to keep only the regions that we are highly confident contain plants
-high = cv.morphologyEx(
-    filled1, cv.MORPH_OPEN, small_kernel, iterations = PARAMS['morho']['high']['opening']
-)
-# Now, we do morpho operations to get the low confidence regions:
-# 1) use closing to boost the size of some of the plants that have a lot of foreground mixed in
-closing_low = cv.morphologyEx(
-    thresh_low, cv.MORPH_CLOSE, small_kernel, iterations = PARAMS['morho']['low']['closing']
-)
-# 2) use opening to get rid of the noise
-opening_low = cv.morphologyEx(
-    closing_low, cv.MORPH_OPEN, small_kernel, iterations = PARAMS['morho']['low']['opening']
-)
-# 3) use closing again to mostly undo the effects of the opening from before and create low-confidence regions
-low = cv.morphologyEx(
-    opening_low, cv.MORPH_CLOSE, small_kernel, iterations = PARAMS['morho']['low']['closing2']
-)
+full_params = PARAMS
+if args.sweep is not None:
+    truth = None
+    if args.truth is not None:
+        print('loading truth polygons')
+        with instrument.timer('load_truth'):
+            truth = load_truth(args.truth, img.shape)
+    configs = sweep_configs()
+    print('sweeping', len(configs), 'combinations of settings')
+    with instrument.timer('sweep'):
+        results, textures = sweep(small, img.shape, configs, scale, truth, args.jobs, texture)
+    results.to_csv(args.sweep, sep="\t", index=False)
+    if truth is not None:
+        best = {name: results[name].iloc[0].item() for name in configs[0]}
+        print('the best settings are', best)
+        full_params = apply_config(best)
+    # reuse the texture that the sweep already calculated
+    texture = textures.get(upstream_keys(scale_params(full_params, scale))[0])
+params = scale_params(full_params, scale)
+high, low, texture, maxima = segment(small, params, texture, verbose=True)
+if (
+    args.level == 0 and args.texture_cache is not None and not args.texture_cache.exists() and
+    full_params['texture'] == PARAMS['texture']
+):
+    args.texture_cache.parents[0].mkdir(parents=True, exist_ok=True)
+    np.save(args.texture_cache, texture)
 
-# # uncomment this stuff for testing
-# plot_img(([
-#     img, thresh_high, closing_high, high,
-#     low, thresh_low, closing_low, opening_low
-# ], 2, 4), close=True)
+if args.level:
+    with instrument.timer('upsample'):
+        high, low = upsample(high, img.shape), upsample(low, img.shape)
+    if args.refine:
+        print('refining the boundaries of the masks at full resolution')
+        with instrument.timer('refine'):
+            # the boundaries are uncertain to within a pixel at the downsampled resolution
+            high, low = refine(img, high, low, 2**args.level, full_params, maxima)
+    if args.compare:
+        print('comparing the masks to a full resolution segmentation of a sampled region')
+        with instrument.timer('compare'):
+            high_iou, low_iou = compare(img, high, low, args.compare, full_params, maxima)
+        print('IoU of the high confidence masks:', round(high_iou, 4))
+        print('IoU of the low confidence masks:', round(low_iou, 4))
+        instrument.record(stage='compare', high_iou=high_iou, low_iou=low_iou)
 
 # save the resulting masks to files
 print('writing resulting masks to output files')
-export_results(high, args.out_high)
-export_results(low, args.out_low)
+with instrument.timer('export'):
+    export_results(high, args.out_high)
+    export_results(low, args.out_low)
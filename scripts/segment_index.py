@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+import sqlite3
+import numpy as np
+
+
+# the name of the index that rev_transform.py writes to its output directory
+INDEX_FILE = 'index.sqlite'
+
+
+def area(coords):
+    """ get the area of a polygon, represented as a list of x-y coordinates """
+    if len(coords) < 3:
+        return 0.0
+    coords = np.asarray(coords, dtype=np.float64)
+    x, y = coords[:,0], coords[:,1]
+    return float(0.5*np.abs(np.dot(x,np.roll(y,1))-np.dot(y,np.roll(x,1))))
+
+def clip(coords, dims):
+    """
+        clip a polygon to an image with the provided dimensions, using the
+        Sutherland-Hodgman algorithm (which works for concave polygons, since
+        the image is convex)
+        return the vertices of the part of the polygon inside the image
+    """
+    pts = [tuple(pt[:2]) for pt in coords]
+    # clip against each side of the image in turn: x >= 0, x <= width, y >= 0, y <= height
+    for axis, bound, inside in (
+        (0, 0, lambda v, b: v >= b), (0, dims[0], lambda v, b: v <= b),
+        (1, 0, lambda v, b: v >= b), (1, dims[1], lambda v, b: v <= b)
+    ):
+        if not pts:
+            break
+        clipped = []
+        for i, cur in enumerate(pts):
+            prev = pts[i-1]
+            if inside(cur[axis], bound) != inside(prev[axis], bound):
+                # the edge crosses this side of the image, so add the point where it crosses
+                t = (bound-prev[axis])/(cur[axis]-prev[axis])
+                crossing = [prev[0]+t*(cur[0]-prev[0]), prev[1]+t*(cur[1]-prev[1])]
+                crossing[axis] = bound
+                clipped.append(tuple(crossing))
+            if inside(cur[axis], bound):
+                clipped.append(cur)
+        pts = clipped
+    return pts
+
+def visible_area(coords, dims):
+    """ get the area of the part of a polygon that is visible in an image with the provided dimensions """
+    return area(clip(coords, dims))
+
+def write(fname, entries):
+    """
+        write an index of the cameras that each segment appears in
+        entries is an iterable of (label, camera, area, visible_area) tuples
+        the rows are clustered by label, so looking up a label only reads the rows for that label
+    """
+    import os
+    if os.path.exists(fname):
+        os.remove(fname)
+    with sqlite3.connect(fname) as con:
+        con.execute(
+            "CREATE TABLE segments ("
+            "label INTEGER NOT NULL, camera TEXT NOT NULL, area REAL, visible_area REAL, "
+            "PRIMARY KEY (label, camera)) WITHOUT ROWID"
+        )
+        con.executemany("INSERT OR REPLACE INTO segments VALUES (?, ?, ?, ?)", entries)
+    con.close()
+
+def query(fname, labels):
+    """
+        look up the cameras that each of the labels appears in
+        labels that aren't integers can't be in the index, so they are ignored
+        return a list of (label, camera, area, visible_area) tuples, sorted by label and then camera
+    """
+    labels = [int(label) for label in labels if str(label).strip().lstrip('-').isdigit()]
+    con = sqlite3.connect('file:'+fname+'?mode=ro', uri=True)
+    try:
+        # join against a table of the labels, since there is a limit to how
+        # many values can be bound to a single statement
+        con.execute("CREATE TEMP TABLE labels (label INTEGER PRIMARY KEY)")
+        con.executemany("INSERT OR IGNORE INTO labels VALUES (?)", ((label,) for label in labels))
+        return con.execute(
+            "SELECT segments.label, camera, area, visible_area FROM segments "
+            "JOIN labels ON segments.label = labels.label ORDER BY segments.label, camera"
+        ).fetchall()
+    finally:
+        con.close()
+
+
+if __name__ == '__main__':
+    # if this script is being called but not imported:
+    import argparse
+    parser = argparse.ArgumentParser(description='List the original drone images that each segment appears in, using the index written by rev_transform.py.')
+    parser.add_argument(
+        "index", help="the path to the index (ex: out/<sample>/rev_transforms/"+INDEX_FILE+")"
+    )
+    parser.add_argument(
+        "labels", nargs='+', type=int, help="the segment IDs to look up"
+    )
+    parser.add_argument(
+        "-a", "--areas", action='store_true', help="whether to also output the label of each segment, along with its area and visible area in each image"
+    )
+    args = parser.parse_args()
+    for label, camera, segment_area, segment_visible_area in query(args.index, args.labels):
+        if args.areas:
+            print(label, camera, segment_area, segment_visible_area, sep="\t")
+        else:
+            print(camera)
@@ -20,6 +20,12 @@ parser.add_argument(
 parser.add_argument(
     "-r", "--roc", action='store_true', help="create roc (instead of prc) data"
 )
+parser.add_argument(
+    "-b", "--bins", type=int, default=None, help="read the table in chunks and count the probabilities in this many bins between 0 and 1 (see --range), instead of reading the whole table into memory; the curve then has at most one point per bin (default: read the whole table and use every distinct probability)"
+)
+parser.add_argument(
+    "--range", nargs=2, type=float, default=[0, 1], metavar=('LOW', 'HIGH'), help="the lowest and highest possible probabilities, between which the --bins are spread; the scores aren't divided by their maximum like they are without --bins, so it is an error for any of them to be outside of this range (default: 0 1)"
+)
 parser.add_argument(
     "table", nargs="?", default=sys.stdin,
     help="a two column (truth/probs) table of variant classifications w/o a header"
@@ -28,6 +34,8 @@ args = parser.parse_args()
 if args.flip__sorted:
     args.flip = True
     args.sorted = True
+if args.bins is not None and args.sorted:
+    parser.error("The --bins option cannot be used with sorted input, since its probabilities are its row numbers.")
 if args.table == '':
     args.table = sys.stdin
 
@@ -37,6 +45,27 @@ from sklearn.metrics import precision_recall_curve
 from sklearn.metrics import roc_curve
 
 
+if args.bins is not None:
+    # stream the table, keeping only the counts in each bin in memory
+    import histogram
+    hist = histogram.ScoreHistogram(args.bins, *args.range)
+    for chunk in histogram.read_chunks(args.table, ['truth', 'probs'], {'probs': np.float_, 'truth': np.bool_}):
+        hist.add(chunk['truth'], chunk['probs'])
+    try:
+        hist.check()
+    except ValueError as error:
+        sys.exit(str(error))
+    if args.flip:
+        print("Inverting predictions.", file=sys.stderr)
+        hist.flip()
+    if args.roc:
+        fpr, tpr, thresh = hist.roc_curve()
+        np.savetxt(args.out, np.array([fpr, tpr]))
+    else:
+        precision, recall, thresh = hist.precision_recall_curve()
+        np.savetxt(args.out, np.array([recall, precision]))
+    sys.exit()
+
 # read the file into a pandas data frame
 df = pd.read_csv(
     args.table, sep='\t', header=None, names=['truth', 'probs'],
@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+import sys
+import argparse
+from pathlib import Path
+
+parser = argparse.ArgumentParser(
+    description=
+    """
+        Benchmark the main steps of the pipeline on synthetic data, so that their
+        performance can be tracked across commits without any drone imagery or
+        Metashape output. A synthetic orthomosaic and a set of overlapping drone
+        image segments are generated and then segment.py, watershed.py,
+        extract_features.py, resolve_conflicts.py, and map.py are run on them.
+        The wall time, CPU time, peak memory usage, and throughput of each step
+        are written to a JSON file, along with how long each script takes to
+        start up (ie to import the modules it needs).
+    """
+)
+parser.add_argument(
+    "out", nargs='?', type=argparse.FileType('w', encoding='UTF-8'), default=sys.stdout,
+    help="the path to a JSON file in which to store the benchmark results (default: stdout)"
+)
+parser.add_argument(
+    "-p", "--megapixels", type=float, default=1, help="the size of the synthetic orthomosaic in megapixels (default: 1)"
+)
+parser.add_argument(
+    "-s", "--segments", type=int, default=50, help="the number of plants in the synthetic orthomosaic (default: 50)"
+)
+parser.add_argument(
+    "-c", "--cameras", type=int, default=8, help="the number of synthetic drone images (default: 8)"
+)
+parser.add_argument(
+    "--stages", default='startup,segment,watershed,extract_features,resolve_conflicts,map',
+    help="a comma separated list of the steps to benchmark (default: all of them)"
+)
+parser.add_argument(
+    "--seed", type=int, default=0, help="the seed for the random number generator (default: 0)"
+)
+parser.add_argument(
+    "-d", "--dir", type=Path, default=None, help="a directory in which to store the synthetic data and the output of each step; defaults to a temporary directory that is deleted afterward"
+)
+args = parser.parse_args()
+args.stages = args.stages.split(",")
+
+import os
+import ast
+import json
+import time
+import datetime
+import tempfile
+import subprocess
+import cv2 as cv
+import numpy as np
+import pandas as pd
+import import_labelme
+
+
+SCRIPTS = Path(__file__).resolve().parent
+# the fraction of the orthomosaic that each drone image covers (along each axis)
+CAMERA_SIZE = 0.5
+# how much larger (or smaller) the low (or high) confidence segments should be than the plants
+LOW_SCALE = 1.25
+HIGH_SCALE = 0.6
+# the scripts whose startup time we measure
+# (the ones that need Metashape are left out, since it requires a license)
+STARTUP_SCRIPTS = [
+    'segment.py', 'watershed.py', 'extract_features.py', 'create_truth_data.py',
+    'classify.py', 'resolve_conflicts.py', 'map.py'
+]
+# how many of the slowest imports to report for each script
+SLOWEST_IMPORTS = 5
+
+
+def synthetic_ortho(megapixels, num_segments, rng):
+    """
+        create a synthetic orthomosaic: textured, green grass with dark, elliptical plants on it
+        the plants are darker and more textured than the grass, like the flowering
+        plants that segment.py looks for, so that it finds them with its default PARAMS
+        return the image and a list of the plants as (center, axes, angle) tuples
+    """
+    width = int(np.sqrt(megapixels*1e6*4/3))
+    height = int(megapixels*1e6/width)
+    # the grass is green noise, blurred a bit so that it has some texture
+    img = np.clip(
+        rng.normal((60, 170, 80), 25, (height, width, 3)), 0, 255
+    ).astype(np.uint8)
+    img = cv.GaussianBlur(img, (5, 5), 0)
+    # pick plant sizes proportional to the size of the image, so that they cover a similar fraction of it
+    # they must be wide enough to survive the morphological opening in segment.py
+    radius = np.sqrt(width*height/num_segments)/3
+    plants = []
+    for i in range(num_segments):
+        center = (int(rng.uniform(0, width)), int(rng.uniform(0, height)))
+        axes = tuple(int(a) for a in rng.uniform(0.5, 1.5, 2)*radius)
+        angle = int(rng.uniform(0, 180))
+        plants.append((center, axes, angle))
+        color = tuple(int(c) for c in rng.normal((30, 45, 35), 10))
+        cv.ellipse(img, center, axes, angle, 0, 360, color, -1)
+        # add some flowers, so that the plants have texture
+        for _ in range(int(axes[0]*axes[1]/40)):
+            pt = (
+                int(center[0]+rng.normal(0, axes[0]/2)),
+                int(center[1]+rng.normal(0, axes[1]/2))
+            )
+            cv.circle(img, pt, 1, (220, 230, 240), -1)
+    return img, plants
+
+def ellipse_polygon(center, axes, angle, scale=1, jitter=0, rng=None):
+    """ get the vertices of an ellipse as a polygon, optionally jittering the center """
+    if jitter:
+        center = tuple(int(c+rng.normal(0, jitter)) for c in center)
+    axes = tuple(max(1, int(a*scale)) for a in axes)
+    return cv.ellipse2Poly(center, axes, angle, 0, 360, 10)
+
+def camera_footprints(shape, num_cameras, rng):
+    """ pick a random, overlapping region of the orthomosaic for each drone image """
+    height, width = shape[:2]
+    cam_w, cam_h = int(width*CAMERA_SIZE), int(height*CAMERA_SIZE)
+    return {
+        'cam{:04d}'.format(i): (
+            int(rng.uniform(0, width-cam_w)), int(rng.uniform(0, height-cam_h)),
+            cam_w, cam_h
+        )
+        for i in range(num_cameras)
+    }
+
+def in_footprint(pts, footprint):
+    """ whether the center of a polygon lies within a camera's footprint """
+    x, y, w, h = footprint
+    cx, cy = np.mean(pts, axis=0)
+    return (x <= cx < x+w) and (y <= cy < y+h)
+
+def write_camera_segments(plants, footprints, high_dir, low_dir, rng):
+    """
+        write the high and low confidence segments that each drone image would
+        contribute to the orthomosaic (ie the output of transform.py)
+    """
+    high_dir.mkdir(parents=True, exist_ok=True)
+    low_dir.mkdir(parents=True, exist_ok=True)
+    for cam, footprint in footprints.items():
+        high, low = [], []
+        for plant in plants:
+            pts = ellipse_polygon(*plant, HIGH_SCALE, 2, rng)
+            if not in_footprint(pts, footprint):
+                continue
+            high.append(pts.tolist())
+            low.append(ellipse_polygon(*plant, LOW_SCALE, 2, rng).tolist())
+        import_labelme.write(str(high_dir/(cam+'.json')), high)
+        import_labelme.write(str(low_dir/(cam+'.json')), low)
+
+def write_camera_predictions(segments, footprints, segments_dir, predicts_dir, rng):
+    """
+        write the segments (in drone image coords) of each drone image (ie the
+        output of rev_transform.py) and random predictions for each segment
+        (ie the output of the classify step)
+    """
+    segments_dir.mkdir(parents=True, exist_ok=True)
+    predicts_dir.mkdir(parents=True, exist_ok=True)
+    for cam, (x, y, w, h) in footprints.items():
+        cam_segments = [
+            (label, (np.array(pts)-(x, y)).tolist())
+            for label, pts in sorted(segments.items())
+            if in_footprint(pts, (x, y, w, h))
+        ]
+        import_labelme.write(str(segments_dir/(cam+'.json')), cam_segments)
+        probs = rng.uniform(0, 1, len(cam_segments))
+        pd.DataFrame(
+            {
+                'truth': rng.integers(0, 2, len(cam_segments)),
+                'prob.0': 1-probs, 'prob.1': probs,
+                'response': (probs >= 0.5).astype(int)
+            },
+            index=[label for label, pts in cam_segments]
+        ).to_csv(str(predicts_dir/(cam+'.tsv')), sep="\t", index_label=False)
+
+# a tiny python process that runs each script for us (see run())
+# it reads the arguments of each script as a line of JSON and writes back its
+# exit status, CPU time, and peak memory usage (in kilobytes)
+LAUNCHER = """
+import os, sys, json
+for line in sys.stdin:
+    argv = json.loads(line)
+    pid = os.fork()
+    if not pid:
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, 1)
+        try:
+            os.execv(argv[0], argv)
+        finally:
+            os._exit(127)
+    _, status, usage = os.wait4(pid, 0)
+    print(json.dumps([status, usage.ru_utime+usage.ru_stime, usage.ru_maxrss]), flush=True)
+"""
+launcher = None
+
+def start_launcher():
+    """
+        start the process that runs each script
+        this must happen before we create the synthetic data: on linux, the peak
+        memory usage of a child starts at the memory usage of its parent when
+        it was forked (even after it execs a new program), so the scripts must
+        be forked from a process that has never held the orthomosaic
+    """
+    global launcher
+    launcher = subprocess.Popen(
+        [sys.executable, '-c', LAUNCHER], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+        universal_newlines=True
+    )
+
+def stop_launcher():
+    launcher.stdin.close()
+    launcher.wait()
+
+def run(script, *script_args):
+    """
+        run a script and measure its performance
+        return the wall time, the CPU time, the peak memory usage (in MB), and the exit code
+    """
+    print('running', script, file=sys.stderr)
+    start = time.perf_counter()
+    launcher.stdin.write(json.dumps(
+        [sys.executable, str(SCRIPTS/script)] + [str(arg) for arg in script_args]
+    )+"\n")
+    launcher.stdin.flush()
+    # os.wait4 (in the launcher) gives us the resource usage of this child only
+    status, cpu_seconds, max_rss = json.loads(launcher.stdout.readline())
+    return {
+        'seconds': time.perf_counter()-start,
+        'cpu_seconds': cpu_seconds,
+        # ru_maxrss is in kilobytes on linux
+        'max_rss': max_rss/1024,
+        'returncode': os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+    }
+
+def import_statements(script):
+    """ get the source code of the import statements at the top level of a script """
+    with open(str(SCRIPTS/script)) as f:
+        source = f.read()
+    return [
+        ast.get_source_segment(source, node)
+        for node in ast.parse(source).body
+        if isinstance(node, (ast.Import, ast.ImportFrom))
+    ]
+
+def startup_time(script):
+    """
+        measure how long a fresh interpreter takes to import the modules that a
+        script imports at the top level (ie before it can do any work)
+        return the time, the exit code, and the slowest imports (according to -X importtime)
+    """
+    print('timing the startup of', script, file=sys.stderr)
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', "\n".join(import_statements(script))],
+        cwd=str(SCRIPTS), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+    )
+    seconds = time.perf_counter()-start
+    # lines look like "import time:   self [us] | cumulative | imported package"
+    # where nested imports are indented in the last column
+    imports = []
+    for line in proc.stderr.decode().splitlines():
+        if not line.startswith('import time:'):
+            continue
+        cols = line[len('import time:'):].split('|')
+        if len(cols) != 3 or cols[2].startswith('  ') or not cols[1].strip().isdigit():
+            continue
+        imports.append((cols[2].strip(), int(cols[1])/1e6))
+    return {
+        'seconds': seconds,
+        'returncode': proc.returncode,
+        'slowest_imports': sorted(imports, key=lambda i: i[1], reverse=True)[:SLOWEST_IMPORTS]
+    }
+
+def git_commit():
+    """ get the hash of the current commit, if we can """
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=str(SCRIPTS),
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True
+        ).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def benchmark(workdir):
+    """ generate the synthetic data in workdir, run each step on it, and return the results """
+    rng = np.random.default_rng(args.seed)
+    print('creating synthetic data', file=sys.stderr)
+    img, plants = synthetic_ortho(args.megapixels, args.segments, rng)
+    ortho = workdir/'ortho.png'
+    cv.imwrite(str(ortho), img)
+    footprints = camera_footprints(img.shape, args.cameras, rng)
+    write_camera_segments(plants, footprints, workdir/'transforms/high', workdir/'transforms/low', rng)
+    megapixels = img.shape[0]*img.shape[1]/1e6
+    (workdir/'segments').mkdir(exist_ok=True)
+    stages = {}
+    if 'startup' in args.stages:
+        stages['startup'] = {script: startup_time(script) for script in STARTUP_SCRIPTS}
+        stages['startup']['returncode'] = max(
+            stages['startup'][script]['returncode'] for script in STARTUP_SCRIPTS
+        )
+    def add_stage(name, units, amount, script, *script_args, required=False):
+        """
+            run and benchmark a step, if it should be benchmarked
+            steps whose output is needed by a later step are run even if they aren't
+            benchmarked, in which case only their failures are recorded
+            return whether the step succeeded (or didn't have to be run)
+        """
+        if name not in args.stages and not required:
+            return True
+        result = run(script, *script_args)
+        if name in args.stages:
+            stages[name] = result
+            stages[name]['throughput'] = amount/stages[name]['seconds']
+            stages[name]['throughput_units'] = units
+        elif result['returncode']:
+            stages[name] = result
+        return not result['returncode']
+    if add_stage(
+        'segment', 'megapixels/s', megapixels,
+        'segment.py', ortho, workdir/'segments/high.json', workdir/'segments/low.json'
+    ) and 'segment' in args.stages:
+        # make sure that segment.py actually found the plants, since its
+        # performance would be meaningless otherwise
+        for confidence in ('high', 'low'):
+            stages['segment'][confidence+'_segments'] = sum(
+                1 for shape in import_labelme.shapes(str(workdir/'segments'/(confidence+'.json')))
+            )
+            if not stages['segment'][confidence+'_segments']:
+                print('segment.py didn\'t find any '+confidence+' confidence segments in the synthetic orthomosaic', file=sys.stderr)
+                stages['segment']['returncode'] = 1
+    # the rest of the steps use the output of the watershed step, so we must
+    # always run it, even if it isn't being benchmarked
+    segments = {}
+    if add_stage(
+        'watershed', 'cameras/s', len(footprints),
+        'watershed.py', ortho, workdir/'transforms/high', workdir/'transforms/low', workdir/'segments-exp.json',
+        required=True
+    ):
+        segments = import_labelme.main(str(workdir/'segments-exp.json'), True)
+        add_stage(
+            'extract_features', 'segments/s', len(segments),
+            'extract_features.py', ortho, workdir/'segments-exp.json', workdir/'features.tsv'
+        )
+        write_camera_predictions(segments, footprints, workdir/'rev_transforms', workdir/'classify-exp', rng)
+        # the map step uses the output of the resolve_conflicts step
+        if add_stage(
+            'resolve_conflicts', 'segments/s', len(segments),
+            'resolve_conflicts.py', ortho, workdir/'rev_transforms', workdir/'classify-exp', workdir/'results.tsv',
+            required='map' in args.stages
+        ):
+            add_stage(
+                'map', 'megapixels/s', megapixels,
+                'map.py', ortho, workdir/'segments-exp.json', workdir/'map.tiff', workdir/'results.tsv'
+            )
+    return {
+        'commit': git_commit(),
+        'date': datetime.datetime.now().isoformat(),
+        'python': sys.version.split()[0],
+        'params': {
+            'megapixels': megapixels,
+            'segments': args.segments,
+            'merged_segments': len(segments),
+            'cameras': args.cameras,
+            'seed': args.seed
+        },
+        'stages': stages
+    }
+
+
+start_launcher()
+if args.dir is None:
+    with tempfile.TemporaryDirectory() as workdir:
+        results = benchmark(Path(workdir))
+else:
+    args.dir.mkdir(parents=True, exist_ok=True)
+    results = benchmark(args.dir)
+stop_launcher()
+json.dump(results, args.out, indent=4)
+args.out.write("\n")
+# exit with an error if any of the steps failed
+sys.exit(any(stage['returncode'] for stage in results['stages'].values()))
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+from pathlib import Path
+
+
+# the table formats we support, keyed by file ending
+# TSV files are plain text, while the others are binary columnar formats that
+# preserve the dtype of each column (and are much faster to read and write)
+FORMATS = {
+    '.tsv': 'tsv',
+    '.parquet': 'parquet',
+    '.pq': 'parquet',
+    '.feather': 'feather'
+}
+# the name of the column containing camera names in a multi-camera table
+CAMERA = 'camera'
+
+
+def table_format(fname):
+    """ determine the format of a table from its file ending """
+    suffix = Path(fname).suffix.lower()
+    if suffix not in FORMATS:
+        raise Exception('Unsupported table format "'+suffix+'". The file must have one of these endings: '+", ".join(FORMATS))
+    return FORMATS[suffix]
+
+def is_table(fname):
+    """ whether the file ending of fname belongs to a table we can read """
+    return Path(fname).suffix.lower() in FORMATS
+
+def read(fname, index_col=None, **kwargs):
+    """
+        read a table into a pandas data frame
+        the format of the table is inferred from its file ending
+        kwargs are passed to pd.read_csv if the table is a TSV
+    """
+    import pandas as pd
+    fmt = table_format(fname)
+    if fmt == 'tsv':
+        return pd.read_csv(fname, sep="\t", index_col=index_col, **kwargs)
+    # the binary formats store the index alongside the data (see write() below)
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        df = pq.read_table(str(fname)).to_pandas()
+    else:
+        import pyarrow.feather as feather
+        df = feather.read_table(str(fname)).to_pandas()
+    # set the index if it wasn't already stored that way
+    if index_col is not None:
+        index_col = [index_col] if type(index_col) in (str, int) else list(index_col)
+        index_col = [df.columns[i] if type(i) is int else i for i in index_col]
+        if not set(index_col).issubset(df.index.names):
+            df = df.reset_index(drop=(df.index.names == [None])).set_index(index_col)
+    return df
+
+def write(df, fname, index=True, **kwargs):
+    """
+        write a pandas data frame to a table
+        the format of the table is inferred from its file ending
+        kwargs are passed to df.to_csv if the table is a TSV
+    """
+    fmt = table_format(fname)
+    if fmt == 'tsv':
+        df.to_csv(fname, sep="\t", index=index, **kwargs)
+        return
+    import pyarrow as pa
+    # the binary formats require string column names
+    df = df.rename(columns=str)
+    table = pa.Table.from_pandas(df, preserve_index=index)
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        pq.write_table(table, str(fname))
+    else:
+        import pyarrow.feather as feather
+        feather.write_feather(table, str(fname))
+
+def read_cameras(path, index_col='label', suffix=None, **kwargs):
+    """
+        read the tables for many cameras into a single data frame multi-indexed by camera and index_col
+        path can be either
+            1) a directory containing a table for each camera, named by the camera
+            2) a single multi-camera table (see write_cameras()) with a camera column
+        provide suffix to read only those tables in the directory with that file ending
+    """
+    import pandas as pd
+    path = Path(path)
+    if path.is_dir():
+        files = sorted(
+            f for f in path.iterdir()
+            if f.is_file() and is_table(f) and (suffix is None or f.suffix == suffix)
+        )
+        return pd.concat(
+            {
+                f.stem: read(f, index_col=index_col, **kwargs)
+                for f in files
+            },
+            names=[CAMERA]
+        )
+    df = read(path, **kwargs)
+    # multi-camera tables written by write_cameras() store the camera in the index
+    if CAMERA in df.index.names:
+        return df
+    if CAMERA not in df.columns:
+        raise Exception('The table "'+str(path)+'" does not have a "'+CAMERA+'" column, so it cannot be split by camera.')
+    index = [CAMERA] + ([index_col] if index_col in df.columns else [])
+    return df.set_index(index)
+
+def write_cameras(df, out, suffix='.tsv', **kwargs):
+    """
+        write a data frame multi-indexed by camera (in its first level) to out
+        out can be either
+            1) a directory, in which case a separate table (with the file ending suffix) is written for each camera
+            2) the path to a single, multi-camera table, which must be in a binary format
+        kwargs are passed to write()
+    """
+    out = Path(out)
+    if out.is_dir():
+        for cam, cam_df in df.groupby(level=0, sort=False):
+            write(cam_df.droplevel(0), str(out/(cam+suffix)), **kwargs)
+        return
+    if table_format(out) == 'tsv':
+        raise Exception('Multi-camera tables must be stored in a binary format (ex: .parquet or .feather)')
+    df = df.copy()
+    df.index = df.index.set_names(CAMERA, level=0)
+    write(df, out, index=True)
+
+
+if __name__ == '__main__':
+    # if this script is being called but not imported:
+    import argparse
+    parser = argparse.ArgumentParser(description='Convert between per-camera tables and a single, multi-camera table.')
+    parser.add_argument(
+        "table", help="the path to a table or a directory of tables (named by camera)"
+    )
+    parser.add_argument(
+        "out", help="the path to a table or directory in which to write the converted table(s); the format is inferred from the file ending"
+    )
+    parser.add_argument(
+        "-s", "--suffix", default='.tsv', help="the file ending of the per-camera tables to read or write, if either table or out is a directory (default: .tsv)"
+    )
+    parser.add_argument(
+        "-i", "--index", default='label', help="the name of the column that labels each row (default: label); pass an empty string if there is no such column"
+    )
+    args = parser.parse_args()
+    index_col = args.index if args.index else None
+    if Path(args.table).is_dir() or Path(args.out).is_dir():
+        df = read_cameras(args.table, index_col=index_col, suffix=args.suffix)
+        write_cameras(df, args.out, suffix=args.suffix)
+    else:
+        write(read(args.table, index_col=index_col), args.out, index=(index_col is not None))
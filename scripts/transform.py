@@ -19,12 +19,17 @@ parser.add_argument(
 parser.add_argument(
     "--image", default="", help="a path to the original drone; this argument must be provided if you plan to open the out file in labelme"
 )
+parser.add_argument(
+    "--precision", type=int, default=None, help="the number of decimal places to which to round the coordinates in the out file; fewer decimal places make for smaller files (default: don't round the coordinates)"
+)
 args = parser.parse_args()
 args.camera = Path(args.segments if args.camera is None else args.camera).stem
 
 import logging
 import Metashape
 import numpy as np
+import project
+import instrument
 import import_labelme
 import time
 
@@ -58,15 +63,10 @@ def transform(chunk, camera, points):
                 yield [(pt[0]-chunk.orthomosaic.left)/x, (chunk.orthomosaic.top-pt[1])/y]
     except TypeError:
         print("camera.center = ", str(camera.center), ", Meaning that too few images are on the orthomosaic. Maybe change a dataset.")
-# open the metashape document
-doc = Metashape.Document()
-doc.open(args.project_file, read_only=True)
-
-# find the correct chunk
-for chunk in doc.chunks:
-    # ie the one with the orthomosaic in it
-    if chunk.orthomosaic is not None:
-        break
+# open the metashape document and find the chunk with the orthomosaic in it
+# (this is instantaneous if a worker has already opened the project; see worker.py)
+with instrument.timer('open_project'):
+    chunk = project.load_chunk(args.project_file)
 
 # now find the camera that matches the name given
 for camera in chunk.cameras+[None]:
@@ -91,13 +91,14 @@ for camera in chunk.cameras+[None]:
 # 1) import the segments using the labelme importer
 # 2) transform them
 # 3) and then write them to the out file
-import_labelme.write(
-    args.out,
-    [
+with instrument.timer('transform'):
+    segments = [
         list(transform(chunk, camera, seg))
         for seg in import_labelme.main(args.segments)
-    ],
-    args.image
-)
+    ]
+instrument.count('segments', len(segments))
+instrument.count('skipped_points', skipped)
+with instrument.timer('write'):
+    import_labelme.write(args.out, segments, args.image, args.precision)
 if skipped:
     logging.warning("There were "+str(skipped)+" points that couldn't be transformed")
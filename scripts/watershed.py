@@ -9,88 +9,448 @@ parser.add_argument(
     "ortho", help="the path to the orthomosaic image"
 )
 parser.add_argument(
-    "high", type=Path, help="the path to the file that contain the coordinates of each extracted high confidence object (or a directory if there are multiple such files)"
+    "high", type=Path, help="the path to the file that contain the coordinates of each extracted high confidence object (or a directory if there are multiple such files); either a .json file of polygons or an .npy, .bits.npy, or .npz mask from segment.py"
 )
 parser.add_argument(
     "low", type=Path, help="the path to the file that contain the coordinates of each extracted low confidence object (or a directory if there are multiple such files)"
 )
 parser.add_argument(
-    "-m", "--map", default=None, help="a json file in which to store a dictionary mapping the labels of the original segmented regions to their corresponding merged labels in the orthomosaic; the original segments are labeled by their file name"
+    "-m", "--map", default=None, help="a json file in which to store a dictionary mapping the labels of the original segmented regions to their corresponding merged labels in the orthomosaic; the original segments are labeled by their file name; each one is mapped to the merged segment that covers most of its pixels"
 )
 parser.add_argument(
-    "--high-out", default=None, help="a file in which to write the new, merged high segments; default is not to do so"
+    "--high-out", default=None, help="a file in which to write the new, merged high segments (.npz files store a compact, run-length encoded mask); default is not to do so"
 )
 parser.add_argument(
-    "--low-out", default=None, help="a file in which to write the new, merged low segments; default is not to do so"
+    "--low-out", default=None, help="a file in which to write the new, merged low segments (.npz files store a compact, run-length encoded mask); default is not to do so"
+)
+parser.add_argument(
+    "--state", type=Path, default=None, help=
+    """
+        a directory in which to keep the merged segments, the resulting labels,
+        and the segments of each camera between runs; if it contains the state
+        of a previous run, only the cameras whose segments have changed are
+        re-merged and the watershed algorithm is only rerun within the region
+        they affect, while the labels of the segments elsewhere stay the same
+    """
+)
+parser.add_argument(
+    "-t", "--tile", type=int, default=None, help="run the watershed algorithm on overlapping square tiles of this width (in pixels) and then merge the segments that cross between tiles; this uses much less memory on large orthomosaics; default is not to use tiles"
+)
+parser.add_argument(
+    "-j", "--jobs", type=int, default=1, help="the number of tiles to process in parallel if --tile is provided (default: 1); -1 means one for each core"
 )
 parser.add_argument(
     "out", help="the path to the final segmented regions produced by running the watershed algorithm"
 )
 args = parser.parse_args()
 # validate the input
+if args.state is not None and (args.high_out is not None or args.low_out is not None):
+    parser.error('The --high-out and --low-out options cannot be used with --state.')
 if args.high.is_dir() ^ args.low.is_dir():
     parser.error('Either the high and low args must both be directories, or they must both be files. One cannot be a file while the other is a directory.')
 if args.high.is_dir():
-    args.high = [f for f in sorted(args.high.iterdir()) if f.is_file() and f.suffix == '.json']
-    args.low = [f for f in sorted(args.low.iterdir()) if f.is_file() and f.suffix == '.json']
+    args.high = [f for f in sorted(args.high.iterdir()) if f.is_file() and f.suffix in ('.json', '.npy', '.npz')]
+    args.low = [f for f in sorted(args.low.iterdir()) if f.is_file() and f.suffix in ('.json', '.npy', '.npz')]
 else:
-    args.high = [args.high] if args.high.suffix == '.json' else []
-    args.low = [args.low] if args.low.suffix == '.json' else []
-if not (len(args.high) == len(args.low) and len(args.high) and args.out.endswith('.json')):
-    # TODO: support .npy files so that this error message becomes correct
-    parser.error('Unsupported segments input (high and low args) or output (out arg) file type. The files must have a .json ending.')
+    args.high = [args.high] if args.high.suffix in ('.json', '.npy', '.npz') else []
+    args.low = [args.low] if args.low.suffix in ('.json', '.npy', '.npz') else []
+if not (len(args.high) == len(args.low) and len(args.high) and args.out.endswith(('.json', '.npy'))):
+    parser.error('Unsupported segments input (high and low args) or output (out arg) file type. The inputs must have a .json, .npy, or .npz ending, and the output must have a .json or .npy ending.')
 
+import os
 import json
 import cv2 as cv
 import numpy as np
+import masks
+import relabel
 import scipy.ndimage
+import instrument
 import import_labelme
 from imantics import Polygons
 
-# uncomment this stuff for testing
-from test_util import *
-import matplotlib.pyplot as plt
-plt.ion()
+# # uncomment this stuff for testing
+# from test_util import *
+# import matplotlib.pyplot as plt
+# plt.ion()
+
 
+# the file in the --state directory that describes the previous run
+STATE_FILE = 'state.json'
 
-def import_segments(file, img_shape=cv.imread(args.ortho)[-2::-1], pts=True):
+
+def ortho_shape(ortho=args.ortho):
+    """ get the width and height of the orthomosaic without loading all of its pixels """
+    from PIL import Image
+    Image.MAX_IMAGE_PIXELS = None # so that PIL doesn't complain when we open large files
+    with Image.open(ortho) as img:
+        return img.size
+
+def import_segments(file, img_shape=None, labeled=True):
     """
         import the segments in whatever format they're in as a bool mask
-        provide img_shape if you want to ignore the coordinates of segments that lie outside of the img
+        provide img_shape (width, height) if you want to ignore the coordinates of segments that lie outside of the img
+        it defaults to the shape of the orthomosaic
+        if labeled, also return the labels of the segments (see crop_labels())
     """
+    if img_shape is None:
+        img_shape = ortho_shape()
     # if the data is from labelme, import it using the labelme importer
     if file.endswith('.json'):
         labels = import_labelme.main(file, True, img_shape)
         label_keys = sorted(labels.keys())
         # make sure the segments are in sorted order, according to the keys
-        labels = Polygons([labels[i] for i in label_keys])
-        if pts:
-            pts = {
-                label_keys[i] : tuple(np.around(labels.points[i].mean(axis=0)).astype(np.uint))[::-1]
-                for i in range(len(labels.points))
-            }
-        segments = labels.mask(*img_shape).array
+        polygons = Polygons([labels[i] for i in label_keys])
+        segments = polygons.mask(*img_shape).array
+        if labeled:
+            labeled = polygon_labels(label_keys, [labels[i] for i in label_keys])
+    elif file.endswith('.npz'):
+        mask = masks.RLEMask.load(file)
+        check_shape(file, mask.shape, img_shape)
+        segments = mask.to_dense(bool)
+        if labeled:
+            # label the segments by the order of their first pixel, starting at 1
+            ret, labels = mask.to_labels()
+            labeled = crop_labels(labels, np.arange(1, ret))
+    elif file.endswith(masks.BITS):
+        segments = masks.load_bits(file, img_shape[0])
+        check_shape(file, segments.shape, img_shape)
+        if labeled:
+            # label the segments the same way that segment.py labels its .npy files
+            ret, labels = cv.connectedComponents(np.uint8(segments))
+            labeled = crop_labels(labels, np.arange(1, ret))
     elif file.endswith('.npy'):
-        segments = np.load(file) != 0
-        if pts:
-            # todo: implement pts here
-            pts = {}
+        labels = np.load(file, mmap_mode='r')
+        check_shape(file, labels.shape, img_shape)
+        segments = labels != 0
+        if labeled:
+            label_keys = np.flatnonzero(np.bincount(labels.ravel()))
+            labeled = crop_labels(labels, label_keys[label_keys != 0])
     else:
         raise Exception('Unsupported input file format.')
-    return (pts, segments) if type(pts) is dict else segments
+    return (labeled, segments) if labeled else segments
+
+def crop_labels(labels, keys):
+    """
+        crop a dense array of segment labels to the bounding box of its segments
+        keys are the (sorted) labels of the segments
+        return the keys, the box (top, bottom, left, right), and the cropped
+        labels, in which each segment is numbered by its index in keys plus one
+    """
+    rows, cols = np.flatnonzero(np.any(labels, axis=1)), np.flatnonzero(np.any(labels, axis=0))
+    if not len(rows):
+        return [], (0, 0, 0, 0), np.zeros((0, 0), dtype=np.uint8)
+    box = (rows[0], rows[-1]+1, cols[0], cols[-1]+1)
+    crop = np.asarray(labels[box[0]:box[1], box[2]:box[3]])
+    crop = np.where(crop != 0, np.searchsorted(keys, crop)+1, 0)
+    return list(keys), tuple(int(i) for i in box), crop.astype(masks.narrowest_dtype(len(keys)))
+
+def polygon_labels(keys, polygons):
+    """
+        rasterize the polygons of some segments into a cropped array of labels, like crop_labels()
+        where polygons overlap, the later one wins
+    """
+    if not polygons:
+        return [], (0, 0, 0, 0), np.zeros((0, 0), dtype=np.uint8)
+    polygons = [np.around(polygon).astype(np.int32) for polygon in polygons]
+    # the points are (x, y)
+    points = np.concatenate(polygons)
+    left, top = points.min(axis=0)
+    right, bottom = points.max(axis=0)+1
+    # cv.fillPoly() doesn't support uint32 arrays
+    crop = np.zeros((bottom-top, right-left), dtype=np.uint16 if len(keys) < 2**16 else np.int32)
+    for label, polygon in enumerate(polygons, 1):
+        cv.fillPoly(crop, [polygon-(left, top)], label)
+    return list(keys), (int(top), int(bottom), int(left), int(right)), crop
 
-def load_segments(high, low, high_all=None, low_all=None, img_shape=cv.imread(args.ortho)[:2]):
-    """ load the segments and merge them with a cumulative OR of the segments """
-    # first, load the segments as boolean masks
-    pts, high_segs = import_segments(high, img_shape[::-1])
+def majority(labels, markers, num):
+    """
+        find the segment in markers that covers the most pixels of each of the num segments in labels
+        return an array with the label in markers of each segment in labels (0
+        for the background and any segments that don't overlap with markers)
+    """
+    inside = (labels != 0) & (markers != 0)
+    present, marks = np.unique(markers[inside], return_inverse=True)
+    best = np.zeros(num+1, dtype=np.int64)
+    if not len(present):
+        return best
+    # count the pixels of each segment that lie in each of the markers, as a 2D histogram
+    counts = np.bincount(
+        labels[inside].astype(np.int64)*len(present)+marks.ravel(), minlength=(num+1)*len(present)
+    ).reshape(num+1, len(present))
+    overlaps = counts.max(axis=1) > 0
+    best[overlaps] = present[counts[overlaps].argmax(axis=1)]
+    return best
+
+def check_shape(file, shape, img_shape):
+    """ make sure that a mask has the same shape as the image (img_shape is width, height) """
+    if tuple(shape) != tuple(img_shape[::-1]):
+        raise Exception('The mask in "'+file+'" does not have the same shape as the orthomosaic.')
+
+def load_camera(high, low, img_shape=None):
+    """ load the high and low segments of a single camera as boolean masks, along with the labels of the high segments """
+    if img_shape is None:
+        img_shape = ortho_shape()[::-1]
+    labels, high_segs = import_segments(high, img_shape[::-1])
     low_segs = import_segments(low, img_shape[::-1], False)
-    # create the high and low cumulative arrays if they don't exist yet
-    if high_all is None:
-        high_all = np.zeros(img_shape, dtype=np.uint8)
-    if low_all is None:
-        low_all = np.zeros(img_shape, dtype=np.uint8)
-    # now merge the segments with the cumulative high and low masks
-    return pts, np.add(high_all, high_segs), np.add(low_all, low_segs)
+    return labels, high_segs, low_segs
+
+def camera(file):
+    """ get the name of the camera (ie drone image) that a file of segments belongs to """
+    return file.name[:-len(masks.BITS)] if file.name.endswith(masks.BITS) else file.stem
+
+def merge(img, high, low, verbose=True):
+    """
+        run the watershed algorithm on the merged high and low segments of img
+        high and low are the number of cameras whose segments contain each pixel
+        return the number of labels (including the background), the labeled
+        segments, and the final high and low masks
+    """
+    high = high.astype(np.float32)
+    low = np.uint8(low != 0)
+
+    with instrument.timer('normalize'):
+        # the high-confidence segments that we have right now are arrays of integers
+        # high integers represent pixels that we are highly confident contain plants
+        # we use the following algorithm to convert this array to a boolean mask:
+        # 1) first, extract the connected components of the largest possible segments
+        high_ret, high_mask = cv.connectedComponents(np.uint8(high != 0))
+        instrument.count('merged_high_segments', high_ret-1)
+        # 2) normalize the values within each segment by their mean
+        for seg in range(1, high_ret):
+            high[high_mask == seg] /= np.mean(high[high_mask == seg])
+        # 3) threshold the high confidence regions to convert them to a bool mask
+        high = np.uint8(high >= 1)
+
+    # Finding unknown region
+    if verbose:
+        print('identifying unknown regions (those not classified as either foreground or background)')
+    # subtract low (1st argument) from high (2nd argument) since high confidence
+    # regions are contained within low confidence ones
+    with instrument.timer('unknown'):
+        unknown = cv.subtract(low, high)
+
+    # Marker labeling
+    if verbose:
+        print('marking connected components')
+    with instrument.timer('markers'):
+        ret, markers = cv.connectedComponents(high)
+
+        # Add one to all labels so that sure background is not 0, but 1
+        markers = markers+1
+        # Now, mark the region of unknown with zero
+        markers[unknown==1] = 0
+
+    if verbose:
+        print('running the watershed algorithm')
+    with instrument.timer('watershed'):
+        markers = cv.watershed(img,markers)
+        # clean up the indices
+        # merge background with old background
+        markers[markers == -1] = 1
+        markers -= 1
+    return ret, markers, high, low
+
+def fingerprint(file):
+    """ get something that changes whenever a file does: its modification time and size """
+    stat = os.stat(str(file))
+    return [stat.st_mtime_ns, stat.st_size]
+
+def load_state(state_dir, shape):
+    """
+        load the state of a previous run from state_dir
+        return None if there isn't one or if it was for a different orthomosaic
+    """
+    if not (state_dir/STATE_FILE).exists():
+        return None
+    with open(str(state_dir/STATE_FILE)) as state_file:
+        state = json.load(state_file)
+    if state['shape'] != list(shape) or state['ortho'] != fingerprint(args.ortho):
+        return None
+    for name in ('high', 'low'):
+        state[name] = np.load(str(state_dir/(name+'.npy')))
+    # cv.watershed() needs int32 markers
+    state['markers'] = np.load(str(state_dir/'markers.npy')).astype(np.int32)
+    return state
+
+def save_state(state_dir, state, high, low, markers):
+    """ write the state of this run to state_dir, so that the next run can be incremental """
+    state_dir.mkdir(parents=True, exist_ok=True)
+    np.save(str(state_dir/'high.npy'), high)
+    np.save(str(state_dir/'low.npy'), low)
+    masks.save_labels(markers, str(state_dir/'markers.npy'))
+    with open(str(state_dir/STATE_FILE), 'w') as state_file:
+        json.dump(state, state_file)
+
+def camera_files(state_dir, cam):
+    """ get the paths to the high and low masks of a camera in state_dir """
+    return [str(state_dir/'cameras'/(cam+'.'+name+'.npz')) for name in ('high', 'low')]
+
+def labels_file(state_dir, cam):
+    """ get the path to the labels of a camera's high segments in state_dir """
+    return str(state_dir/'cameras'/(cam+'.labels.npz'))
+
+def save_camera_labels(fname, labels):
+    """ write the labels of a camera's segments (see crop_labels()) to an npz file """
+    keys, box, crop = labels
+    np.savez_compressed(fname, keys=np.array([str(key) for key in keys]), box=np.array(box), labels=crop)
+
+def load_camera_labels(fname):
+    """ read the labels of a camera's segments written by save_camera_labels() """
+    with np.load(fname) as data:
+        return data['keys'].tolist(), tuple(int(i) for i in data['box']), data['labels']
+
+def component_bounds(mask):
+    """ get the (top, bottom, left, right) bounds of each connected component in a mask """
+    _, _, stats, _ = cv.connectedComponentsWithStats(np.uint8(mask))
+    stats = stats[1:]
+    return np.stack((
+        stats[:, cv.CC_STAT_TOP], stats[:, cv.CC_STAT_TOP]+stats[:, cv.CC_STAT_HEIGHT],
+        stats[:, cv.CC_STAT_LEFT], stats[:, cv.CC_STAT_LEFT]+stats[:, cv.CC_STAT_WIDTH]
+    ), axis=1)
+
+def cover(box, bounds, shape, margin=2, repeat=True):
+    """
+        expand a box (top, bottom, left, right) until it contains every one of
+        the bounds within margin pixels of it
+        if repeat is False, only the bounds near the original box are considered
+        return the expanded box (with the margin) as a tuple of slices that fit within shape
+    """
+    box = np.array(box)
+    while True:
+        hits = bounds[
+            (bounds[:, 0] < box[1]+margin) & (bounds[:, 1] > box[0]-margin) &
+            (bounds[:, 2] < box[3]+margin) & (bounds[:, 3] > box[2]-margin)
+        ]
+        new_box = np.array([
+            min(box[0], hits[:, 0].min(initial=box[0])), max(box[1], hits[:, 1].max(initial=box[1])),
+            min(box[2], hits[:, 2].min(initial=box[2])), max(box[3], hits[:, 3].max(initial=box[3]))
+        ])
+        if (new_box == box).all() or not repeat:
+            box = new_box
+            break
+        box = new_box
+    return (
+        slice(max(0, box[0]-margin), min(shape[0], box[1]+margin)),
+        slice(max(0, box[2]-margin), min(shape[1], box[3]+margin))
+    )
+
+def affected_region(box, high, low, markers, margin=2):
+    """
+        expand a box (top, bottom, left, right) until it contains every segment
+        (both merged and from the previous run, ie in markers) within margin
+        pixels of it, so that rerunning watershed within it gives the same
+        results as rerunning it over the whole orthomosaic
+        return the expanded box (with the margin) as a tuple of slices
+    """
+    # the bounds of each merged segment, as (top, bottom, left, right)
+    bounds = [component_bounds((high != 0) | (low != 0))]
+    # and the bounds of each segment from the previous run
+    old = [obj for obj in scipy.ndimage.find_objects(markers) if obj is not None]
+    if old:
+        bounds.append(np.array([(obj[0].start, obj[0].stop, obj[1].start, obj[1].stop) for obj in old]))
+    return cover(box, np.concatenate(bounds), markers.shape, margin)
+
+def tiles(high, low, size, margin=2):
+    """
+        split the orthomosaic into square tiles of the provided size
+        return the core of each tile and the region to process for it: the core
+        expanded to contain every merged segment within margin pixels of it, so
+        that the watershed results within the core are the same as for the
+        whole orthomosaic
+    """
+    bounds = component_bounds((high != 0) | (low != 0))
+    return [
+        (core, cover(
+            (core[0].start, core[0].stop, core[1].start, core[1].stop), bounds, high.shape, margin, False
+        ))
+        for core in (
+            (slice(top, min(top+size, high.shape[0])), slice(left, min(left+size, high.shape[1])))
+            for top in range(0, high.shape[0], size) for left in range(0, high.shape[1], size)
+        )
+    ]
+
+# the arrays that each process of merge_tiles() shares (see init_tiles())
+TILE_DATA = {}
+
+def init_tiles(img, high, low):
+    TILE_DATA['img'], TILE_DATA['high'], TILE_DATA['low'] = img, high, low
+
+def merge_tile(tile):
+    """
+        run the watershed algorithm on a tile (see tiles())
+        return the labels, high mask, and low mask within the core of the tile,
+        as well as the coordinates and labels of the pixels just past the
+        bottom and right edges of the core (and its corners), which belong to
+        the neighboring tiles
+    """
+    core, region = tile
+    ret, markers, high, low = merge(
+        TILE_DATA['img'][region], TILE_DATA['high'][region], TILE_DATA['low'][region], verbose=False
+    )
+    inner = tuple(slice(core[i].start-region[i].start, core[i].stop-region[i].start) for i in range(2))
+    rows, cols = [], []
+    shape = TILE_DATA['high'].shape
+    if core[0].stop < shape[0]:
+        strip = np.arange(max(0, core[1].start-1), min(shape[1], core[1].stop+1))
+        rows.append(np.full(len(strip), core[0].stop))
+        cols.append(strip)
+    if core[1].stop < shape[1]:
+        strip = np.arange(max(0, core[0].start-1), min(shape[0], core[0].stop+1))
+        rows.append(strip)
+        cols.append(np.full(len(strip), core[1].stop))
+    rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+    cols = np.concatenate(cols) if cols else np.zeros(0, dtype=np.int64)
+    edge = markers[rows-region[0].start, cols-region[1].start]
+    return ret, markers[inner], high[inner], low[inner], (rows, cols, edge)
+
+def merge_tiles(img, high, low, size, jobs=1):
+    """
+        run the watershed algorithm on overlapping tiles of img in parallel and
+        then combine the segments that cross from one tile into another
+        this uses much less memory than merge() and returns the same segments
+        (although their labels may differ)
+    """
+    import os
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    regions = tiles(high, low, size)
+    print('running the watershed algorithm on', len(regions), 'tiles')
+    instrument.count('tiles', len(regions))
+    markers = np.zeros(high.shape, dtype=np.int32)
+    high_mask = np.zeros(high.shape, dtype=np.uint8)
+    low_mask = np.zeros(high.shape, dtype=np.uint8)
+    edges = []
+    num_labels = 0
+    # fork the processes, so that they inherit the merged segments instead of copying them
+    with ProcessPoolExecutor(
+        jobs if jobs > 0 else os.cpu_count(), multiprocessing.get_context('fork'),
+        initializer=init_tiles, initargs=(img, high, low)
+    ) as pool:
+        for (core, _), (ret, tile_markers, tile_high, tile_low, edge) in zip(
+            regions, pool.map(merge_tile, regions)
+        ):
+            # give the labels of each tile their own range
+            markers[core] = np.where(tile_markers > 0, tile_markers+num_labels, 0)
+            high_mask[core], low_mask[core] = tile_high, tile_low
+            # segments past the edge of the core only count if they are also in the core
+            rows, cols, labels = edge
+            labels = np.where(np.isin(labels, tile_markers), labels+num_labels, 0)
+            edges.append((rows, cols, labels))
+            num_labels += ret-1
+    # now, merge the labels of the segments that cross from one tile into the next
+    with instrument.timer('seams'):
+        sets = relabel.UnionFind(num_labels+1)
+        for rows, cols, labels in edges:
+            neighbors = markers[rows, cols]
+            both = (labels > 0) & (neighbors > 0)
+            sets.union(labels[both], neighbors[both])
+        roots = sets.roots()
+        # renumber the segments so that their labels are consecutive
+        present = np.setdiff1d(roots[np.unique(markers)], [0])
+        lookup = np.zeros(num_labels+1, dtype=np.int32)
+        lookup[present] = np.arange(1, len(present)+1)
+        markers = lookup[roots][markers]
+    return len(present)+1, markers, high_mask, low_mask
 
 def largest_polygon(polygons):
     """ get the largest polygon among the polygons """
@@ -103,72 +463,138 @@ def export_results(ret, markers, out):
     """ write the resulting mask to a file """
     # should we save the segments as a mask or as bounding boxes?
     if out.endswith('.npy'):
-        np.save(out, markers)
+        if out.endswith(masks.BITS):
+            # only store which pixels belong to a segment, with eight pixels in each byte
+            masks.save_bits(markers, out)
+        else:
+            # store the labels with the narrowest dtype that fits them, rather than int32
+            masks.save_labels(markers, out)
+    elif out.endswith('.npz'):
+        # a run-length encoded mask only stores which pixels belong to a segment, not their labels
+        masks.RLEMask.from_dense(markers).save(out)
     elif out.endswith('.json'):
         # import extra required modules
         from imantics import Mask
         import import_labelme
-        segments = [
-            (int(i), largest_polygon(Mask(markers == i).polygons()).tolist())
-            for i in (range(1, ret) if ret is not None else np.unique(markers).astype(int))
-        ]
+        # write each polygon as soon as it is found, straight from its array of points
+        segments = (
+            (int(i), largest_polygon(Mask(markers == i).polygons()))
+            for i in (range(1, ret) if ret is not None else np.setdiff1d(np.unique(markers), [0]))
+        )
         import_labelme.write(out, segments, args.ortho)
     else:
         raise Exception("Unsupported output file format.")
 
 
 print('loading orthomosaic')
-img = cv.imread(args.ortho)
+with instrument.timer('load_ortho'):
+    img = cv.imread(args.ortho)
+
+# the state of the previous run, if we're running incrementally
+state = load_state(args.state, img.shape[:2]) if args.state is not None else None
+high, low = (None, None) if state is None else (state['high'], state['low'])
+cameras = {} if state is None else state['cameras']
+files = {camera(high_file): (high_file, low_file) for high_file, low_file in zip(args.high, args.low)}
+# the cameras whose segments have changed (or been removed) since the previous run
+stale = [
+    cam for cam in cameras
+    if cam not in files or cameras[cam]['files'] != [fingerprint(f) for f in files[cam]]
+]
 
 print('loading segments')
-high, low = None, None
-pts = {cam.stem:None for cam in args.high}
-# load each segment and add its values to the values we already have
-for high_file, low_file in zip(args.high, args.low):
-    pts[high_file.stem], high, low = load_segments(str(high_file), str(low_file), high, low, img.shape[:2])
-    # convert the merged high and low matrices into the appropriate datatypes
-high = high.astype(np.float32)
-low = np.uint8(low != 0)
+with instrument.timer('load_segments'):
+    # the segments that we've subtracted, so that we can find the pixels that changed
+    old = {}
+    # first, subtract the segments that have changed from those we merged last time
+    for cam in stale:
+        old[cam] = [masks.RLEMask.load(fname) for fname in camera_files(args.state, cam)]
+        for merged, mask in zip((high, low), old[cam]):
+            merged -= mask.to_dense()
+        for fname in camera_files(args.state, cam)+[labels_file(args.state, cam)]:
+            os.remove(fname)
+        del cameras[cam]
+    # the labels of the high segments of each camera that we've loaded (see crop_labels())
+    labels = {}
+    # the bounds of the pixels that have changed
+    boxes = [mask.bbox() for cam in old if cam not in files for mask in old[cam]]
+    if high is None:
+        high = np.zeros(img.shape[:2], dtype=np.uint8)
+        low = np.zeros(img.shape[:2], dtype=np.uint8)
+    # load each segment and add its values to the values we already have
+    for cam in files:
+        if cam in cameras:
+            continue
+        high_file, low_file = files[cam]
+        cam_labels, high_segs, low_segs = load_camera(str(high_file), str(low_file), img.shape[:2])
+        if args.map is not None:
+            labels[cam] = cam_labels
+        high += high_segs
+        low += low_segs
+        instrument.count('cameras')
+        if args.state is not None:
+            # keep a compact copy of this camera's segments, so that we can subtract them next time
+            (args.state/'cameras').mkdir(parents=True, exist_ok=True)
+            for i, (segs, fname) in enumerate(zip((high_segs, low_segs), camera_files(args.state, cam))):
+                mask = masks.RLEMask.from_dense(segs)
+                mask.save(fname)
+                # only the pixels that were added or removed can change the result
+                boxes.append(((mask-old[cam][i]) | (old[cam][i]-mask)).bbox() if cam in old else mask.bbox())
+            # and the labels, so that we can map them without loading this camera again
+            save_camera_labels(labels_file(args.state, cam), cam_labels)
+        cameras[cam] = {'files': [fingerprint(f) for f in files[cam]]}
+    boxes = [box for box in boxes if box is not None]
 
 print('processing segments')
-# the high-confidence segments that we have right now are arrays of integers
-# high integers represent pixels that we are highly confident contain plants
-# we use the following algorithm to convert this array to a boolean mask:
-# 1) first, extract the connected components of the largest possible segments
-high_ret, high_mask = cv.connectedComponents(np.uint8(high != 0))
-# 2) normalize the values within each segment by their mean
-for seg in range(1, high_ret):
-    high[high_mask == seg] /= np.mean(high[high_mask == seg])
-# 3) threshold the high confidence regions to convert them to a bool mask
-high = np.uint8(high >= 1)
-
-# write to temporary output files, if desired
-if args.high_out is not None:
-    export_results(*cv.connectedComponents(high), args.high_out)
-if args.low_out is not None:
-    export_results(*cv.connectedComponents(low), args.low_out)
-
-# Finding unknown region
-print('identifying unknown regions (those not classified as either foreground or background)')
-# subtract low (1st argument) from high (2nd argument) since high confidence
-# regions are contained within low confidence ones
-unknown = cv.subtract(low, high)
-
-# Marker labeling
-print('marking connected components')
-ret, markers = cv.connectedComponents(high)
-
-# Add one to all labels so that sure background is not 0, but 1
-markers = markers+1
-# Now, mark the region of unknown with zero
-markers[unknown==1] = 0
-
-print('running the watershed algorithm')
-markers = cv.watershed(img,markers)
-# clean up the indices
-# merge background with old background
-markers[markers == -1] = 1
-markers -= 1
+if state is None:
+    if args.tile:
+        ret, markers, high_mask, low_mask = merge_tiles(img, high, low, args.tile, args.jobs)
+    else:
+        ret, markers, high_mask, low_mask = merge(img, high, low)
+    # every segment is new
+    changed = list(range(1, ret))
+
+    # write to temporary output files, if desired
+    if args.high_out is not None:
+        export_results(*cv.connectedComponents(high_mask), args.high_out)
+    if args.low_out is not None:
+        export_results(*cv.connectedComponents(low_mask), args.low_out)
+elif boxes:
+    ret, markers = None, state['markers']
+    with instrument.timer('region'):
+        boxes = np.array(boxes)
+        region = affected_region(
+            (boxes[:, 0].min(), boxes[:, 1].max(), boxes[:, 2].min(), boxes[:, 3].max()),
+            high, low, markers
+        )
+    print(
+        'rerunning watershed on rows', region[0].start, 'to', region[0].stop,
+        'and columns', region[1].start, 'to', region[1].stop
+    )
+    instrument.count('rerun_pixels', (region[0].stop-region[0].start)*(region[1].stop-region[1].start))
+    if args.tile:
+        region_ret, region_markers = merge_tiles(img[region], high[region], low[region], args.tile, args.jobs)[:2]
+    else:
+        region_ret, region_markers = merge(img[region], high[region], low[region])[:2]
+    # reuse the labels of the old segments in the region and then add new labels after the largest one
+    freed = np.setdiff1d(np.unique(markers[region]), [0])
+    labels = np.concatenate((
+        freed, np.arange(markers.max()+1, markers.max()+region_ret)
+    ))[:region_ret-1]
+    lookup = np.zeros(region_ret, dtype=np.int32)
+    lookup[1:] = labels
+    markers[region] = lookup[region_markers]
+    changed = np.union1d(freed, labels).astype(int).tolist()
+else:
+    print('none of the segments have changed since the previous run')
+    ret, markers, changed = None, state['markers'], []
+print(len(changed), 'segments have changed')
+
+if args.state is not None:
+    with instrument.timer('save_state'):
+        save_state(args.state, {
+            'shape': list(img.shape[:2]), 'ortho': fingerprint(args.ortho),
+            'cameras': cameras, 'changed': changed
+        }, high, low, markers)
 
 if args.map is not None:
     # a data structure for mapping drone image segments to orthomosaic segments
@@ -180,18 +606,23 @@ if args.map is not None:
     #           value: the orthomosaic segment id
     #
     # algorithm to construct this data structure:
-    # 1) keep a running dictionary mapping a drone image segment to an arbitrary
-    #    point in that segment (ex: its centroid)
-    # 2) after you've collected all of the points, go through each point and find
-    #    the id of the orthomosaic segment it belongs in
-    # 3) replace the point with the newfound id
-    for cam in pts:
-        for label in pts[cam]:
-            pts[cam][label] = str(markers[pts[cam][label]])
+    # 1) keep the labels of each drone image's segments, cropped to their bounding box
+    # 2) once the orthomosaic segments are final, count the pixels of each
+    #    drone image segment that lie in each orthomosaic segment within that box
+    # 3) map each drone image segment to the orthomosaic segment that covers the most of it
+    # unlike a single point (ex: the centroid), this works for concave segments, too
+    segment_map = {}
+    with instrument.timer('map'):
+        for cam in files:
+            keys, box, cam_labels = labels[cam] if cam in labels else load_camera_labels(labels_file(args.state, cam))
+            best = majority(cam_labels, markers[box[0]:box[1], box[2]:box[3]], len(keys))
+            segment_map[cam] = {str(key): str(best[i]) for i, key in enumerate(keys, 1)}
 
 print('writing to desired output files')
-export_results(ret, markers, args.out)
+with instrument.timer('export'):
+    export_results(ret, markers, args.out)
+instrument.count('segments', ret-1 if ret is not None else len(np.setdiff1d(np.unique(markers), [0])))
 
 # also create the map file if the user requested it
 if args.map is not None:
-    json.dump(pts, open(args.map, 'w'))
+    json.dump(segment_map, open(args.map, 'w'))
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import socket
+
+
+# the modules that a worker imports before it starts accepting jobs
+# these are the slowest imports of the scripts that run once per drone image
+PRELOAD = [
+    'numpy', 'cv2', 'scipy.ndimage', 'skimage.feature', 'PIL.Image', 'pandas',
+    'imantics', 'sklearn.ensemble', 'joblib', 'Metashape',
+    # our own modules that are safe to import before a job's environment is known
+    # (instrument.py, for example, reads its environment variable when imported)
+    'features', 'import_labelme', 'tables', 'project', 'models', 'classify'
+]
+# the job's output is followed by a line with this prefix and the job's exit code
+TRAILER = b"\0exit "
+
+
+def preload(modules=PRELOAD, projects=(), models=()):
+    """ import modules and load the metashape projects and trained models that jobs will need """
+    import importlib
+    for module in modules:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            # not every environment has every module (ex: Metashape)
+            pass
+    if projects:
+        import project
+        for project_file in projects:
+            project.load_chunk(project_file)
+    if models:
+        import models as trained_models
+        for model in models:
+            trained_models.load_model(model)
+
+def run_job(conn, job):
+    """
+        run a python script in a child process, as if it had been called from the command line
+        the child inherits everything the worker has already imported and loaded
+        its stdout and stderr are sent back over the connection
+        return the exit code of the script
+    """
+    pid = os.fork()
+    if pid:
+        _, status = os.waitpid(pid, 0)
+        return os.WEXITSTATUS(status) if os.WIFEXITED(status) else 128+os.WTERMSIG(status)
+    # this is the child process
+    code = 1
+    try:
+        import runpy
+        import atexit
+        import traceback
+        os.dup2(conn.fileno(), 1)
+        os.dup2(conn.fileno(), 2)
+        os.chdir(job['cwd'])
+        os.environ.clear()
+        os.environ.update(job['env'])
+        sys.argv = [job['script']] + job['args']
+        sys.path[0] = os.path.dirname(os.path.abspath(job['script']))
+        try:
+            runpy.run_path(job['script'], run_name='__main__')
+            code = 0
+        except SystemExit as e:
+            # sys.exit() can be called with an exit code or an error message
+            if isinstance(e.code, int) or e.code is None:
+                code = e.code or 0
+            else:
+                print(e.code, file=sys.stderr)
+        except BaseException:
+            traceback.print_exc()
+        # os._exit() doesn't run the exit handlers (ex: the one that writes the instrument.py metrics)
+        atexit._run_exitfuncs()
+        sys.stdout.flush()
+        sys.stderr.flush()
+    finally:
+        os._exit(code)
+
+def handle(conn):
+    """ read a job (as a line of JSON) from a connection, run it, and reply with its exit code """
+    with conn, conn.makefile('rb') as request:
+        job = json.loads(request.readline())
+        code = run_job(conn, job)
+        conn.sendall(TRAILER+str(code).encode()+b"\n")
+
+def serve(path, projects=(), models=()):
+    """ accept jobs on a unix socket until the worker is killed """
+    import signal
+    print('preloading modules', file=sys.stderr)
+    preload(projects=projects, models=models)
+    if os.path.exists(path):
+        os.remove(path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen(128)
+    # exit cleanly (and remove the socket) when killed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit())
+    # don't let the processes that handle each connection become zombies
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    print('listening on', path, file=sys.stderr)
+    try:
+        while True:
+            conn, _ = server.accept()
+            # handle each connection in its own process, so that jobs can run in parallel
+            if os.fork():
+                conn.close()
+                continue
+            server.close()
+            # we need to wait for the job's process, so we must undo SIG_IGN
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            code = 1
+            try:
+                handle(conn)
+                code = 0
+            finally:
+                os._exit(code)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        if os.path.exists(path):
+            os.remove(path)
+
+def submit(path, script, script_args):
+    """
+        ask the worker listening on a unix socket to run a python script and
+        print its output as it runs
+        if there isn't a worker, just run the script in this process instead
+        return the exit code of the script
+    """
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(path)
+    except OSError:
+        conn.close()
+        os.execv(sys.executable, [sys.executable, script] + list(script_args))
+    with conn:
+        conn.sendall(json.dumps({
+            'script': script, 'args': list(script_args),
+            'cwd': os.getcwd(), 'env': dict(os.environ)
+        }).encode()+b"\n")
+        out = sys.stdout.buffer
+        # hold back anything that might be the start of the trailer
+        buf = b""
+        while True:
+            data = conn.recv(65536)
+            if not data:
+                break
+            buf += data
+            trailer = buf.find(TRAILER)
+            if trailer == -1:
+                keep = len(TRAILER)-1
+                out.write(buf[:-keep])
+                buf = buf[-keep:]
+            else:
+                out.write(buf[:trailer])
+                buf = buf[trailer:]
+            out.flush()
+    if not buf.startswith(TRAILER):
+        out.write(buf)
+        print('The worker exited before the job finished.', file=sys.stderr)
+        return 1
+    return int(buf[len(TRAILER):].strip() or 1)
+
+
+if __name__ == '__main__':
+    # if this script is being called but not imported:
+    import argparse
+    parser = argparse.ArgumentParser(description='Run python scripts in a long-lived worker that has already imported their modules and loaded their metashape projects and models, so that each job starts in milliseconds.')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    serve_parser = subparsers.add_parser('serve', help='start a worker')
+    serve_parser.add_argument(
+        "socket", help="the path to a unix socket on which to listen for jobs"
+    )
+    serve_parser.add_argument(
+        "-p", "--project", action='append', default=[], help="a metashape project file to open ahead of time; can be given more than once"
+    )
+    serve_parser.add_argument(
+        "-m", "--model", action='append', default=[], help="a trained model (from classify.py) to load ahead of time; can be given more than once"
+    )
+    submit_parser = subparsers.add_parser('submit', help='run a script in a worker (or directly, if there is no worker)')
+    submit_parser.add_argument(
+        "socket", help="the path to the unix socket of the worker"
+    )
+    submit_parser.add_argument(
+        "script", help="the path to the python script to run"
+    )
+    submit_parser.add_argument(
+        "args", nargs=argparse.REMAINDER, help="the arguments to the script"
+    )
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        serve(args.socket, args.project, args.model)
+    else:
+        sys.exit(submit(args.socket, args.script, args.args))